@@ -1,30 +1,133 @@
 import asyncio
 from asyncio import Lock
+from array import array
+import atexit
+import bisect
+import copy
+import cProfile
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import itertools
+import queue
+import sqlite3
+import struct
 import random
 import logging
+import logging.handlers
 import json
 import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from functools import lru_cache
-from collections import defaultdict
+from functools import lru_cache, wraps
+from collections import defaultdict, OrderedDict, deque
 from typing import Dict, List, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+from telegram.ext import BaseRateLimiter, TypeHandler
+from telegram.ext import SimpleUpdateProcessor
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.request import HTTPXRequest
 
 # Настройка логирования
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('slot_bot.log', encoding='utf-8')
-    ]
-)
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        category = getattr(record, 'category', None)
+        if category:
+            entry['category'] = category
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class CategoryRateFilter(logging.Filter):
+    """Ограничивает частоту записей по категориям (extra={'category': ...})"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]]):
+        super().__init__()
+        self.limits = limits  # категория -> (записей в секунду, запас)
+        self._buckets = {}  # категория -> [токены, время, подавлено]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, 'category', None)
+        if category not in self.limits:
+            return True
+
+        rate, capacity = self.limits[category]
+        now = time.monotonic()
+        bucket = self._buckets.setdefault(category, [capacity, now, 0])
+        bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+
+        bucket[0] -= 1
+        # Сообщаем, сколько записей этой категории было пропущено
+        record.suppressed = bucket[2]
+        bucket[2] = 0
+        return True
+
+
+# Частые записи горячего пути: (записей в секунду, запас)
+LOG_RATE_LIMITS = {
+    'button': (1.0, 10),
+    'settings': (1.0, 10),
+    'flood': (0.2, 5),
+    'loop': (0.5, 5),
+    'spin': (2.0, 20),
+}
+
+
+def setup_logging(log_file: str = 'slot_bot.log', level: int = logging.INFO,
+                  max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5) -> logging.handlers.QueueListener:
+    """Неблокирующее логирование: запись в очередь, вывод и ротация файла в отдельном потоке"""
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(CategoryRateFilter(LOG_RATE_LIMITS))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    # Запросы httpx на каждый вызов Bot API - слишком подробно для INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    listener = logging.handlers.QueueListener(log_queue, console, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
 
 class SlotMachine:
-    def __init__(self):
+    def __init__(self, config: dict = None):
         self.symbols = ['🍒', '🍋', '🍊', '🍇', '🍌', '⭐', '💎', '7️⃣', '💰']
         # Увеличили вероятности высокоценных символов
         self.probabilities = [0.16, 0.15, 0.14, 0.13, 0.12, 0.10, 0.08, 0.07, 0.05]
@@ -45,22 +148,44 @@ class SlotMachine:
         self.jackpot = 12000  # +20%
         self.jackpot_increment = 0.12  # +20%
 
+        if config:
+            self.apply_config(config)
+
+    def apply_config(self, config: dict) -> None:
+        """Веса и выплаты из конфигурации (например, подобранной rtp_solver.py)"""
+        if config.get('symbols', self.symbols) != self.symbols:
+            raise ValueError("Символы конфигурации не совпадают с символами машины")
+        probabilities = [float(p) for p in config.get('probabilities', self.probabilities)]
+        if len(probabilities) != len(self.symbols) or min(probabilities) <= 0:
+            raise ValueError("Нужен положительный вес для каждого символа")
+        self.probabilities = probabilities
+        if 'payouts' in config:
+            # В JSON длины серий - строки
+            self.payouts = {symbol: {int(count): int(payout) for count, payout in config['payouts'][symbol].items()}
+                            for symbol in self.symbols}
+        self.jackpot_increment = config.get('jackpot_increment', self.jackpot_increment)
+
     def spin(self, bet: int) -> Tuple[List[List[str]], int, bool]:
         """Генерация результата вращения с учетом вероятностей"""
+        reels, win_amount, is_jackpot, _ = self.spin_with_hits(bet)
+        return reels, win_amount, is_jackpot
+
+    def spin_with_hits(self, bet: int) -> Tuple[List[List[str]], int, bool, List[Tuple[str, int]]]:
+        """Спин и его выигрышные линии: линии проверяются один раз, для выплаты и гистограмм"""
         reels = []
         for _ in range(5):
             reel = random.choices(self.symbols, weights=self.probabilities, k=3)
             reels.append(reel)
 
-        win_amount, is_jackpot = self.calculate_win(reels, bet)
+        hits = self.line_hits(reels)
+        win_amount, is_jackpot = self.calculate_win(reels, bet, hits)
         self.jackpot += round(bet * self.jackpot_increment)
 
-        return reels, win_amount, is_jackpot
+        return reels, win_amount, is_jackpot, hits
 
-    def calculate_win(self, reels: List[List[str]], bet: int) -> Tuple[int, bool]:
-        """Расчет выигрыша по линиям"""
-        total_win = 0
-        is_jackpot = False
+    def line_hits(self, reels: List[List[str]]) -> List[Tuple[str, int]]:
+        """Выигрышные линии: (символ, длина серии) для линий с 3+ одинаковыми символами"""
+        hits = []
 
         # Проверка линий выплат
         lines = [
@@ -72,51 +197,993 @@ class SlotMachine:
         ]
 
         for line in lines:
-            count = 1
-            current_sequence = 1
-            symbol = ''
-
-            for i in range(1, len(line)):
-                if line[i] == line[i - 1]:
-                    symbol = line[i]
-                    current_sequence += 1
-                    count = max(count, current_sequence)
-                else:
-                    current_sequence = 1
+            hit = self.line_hit(line)
+            if hit:
+                hits.append(hit)
 
-            if count >= 3 and symbol in self.payouts:
-                payout = self.payouts[symbol].get(count, 0)
-                total_win += bet * payout
+        return hits
+
+    def line_hit(self, line: List[str]):
+        """(символ, длина серии) для одной линии или None.
+
+        Длина - самая длинная серия, символ - у последней пары одинаковых соседей
+        (для 🍒🍒🍒🍋🍋 платится 🍋 × 3): так считали всегда, таблицы движка повторяют это.
+        """
+        count = 1
+        current_sequence = 1
+        symbol = ''
+
+        for i in range(1, len(line)):
+            if line[i] == line[i - 1]:
+                symbol = line[i]
+                current_sequence += 1
+                count = max(count, current_sequence)
+            else:
+                current_sequence = 1
 
-                # Проверка на джекпот
-                if symbol == '💰' and count == 5:
-                    total_win += self.jackpot
-                    is_jackpot = True
-                    self.jackpot = 10000  # Сброс джекпота
+        if count >= 3 and symbol in self.payouts:
+            return symbol, count
+        return None
+
+    def calculate_win(self, reels: List[List[str]], bet: int, hits=None) -> Tuple[int, bool]:
+        """Расчет выигрыша по линиям (hits - уже найденные линии этого поля)"""
+        total_win = 0
+        is_jackpot = False
+
+        for symbol, count in (self.line_hits(reels) if hits is None else hits):
+            payout = self.payouts[symbol].get(count, 0)
+            total_win += bet * payout
+
+            # Проверка на джекпот
+            if symbol == '💰' and count == 5:
+                total_win += self.jackpot
+                is_jackpot = True
+                self.jackpot = 10000  # Сброс джекпота
 
         return total_win, is_jackpot
 
 
+class TableSlotMachine(SlotMachine):
+    """Движок "сначала исход": класс выплаты из точной таблицы вероятностей, поле - из пула этого класса.
+
+    Класс - набор выигрышных линий (символ, длина), как их возвращает line_hits.
+    Вероятности классов считаются точно по весам барабанов: при известных центральных
+    ячейках (1,1), (3,1), (2,0), (2,2) верхняя строка с диагональю 1, нижняя строка с
+    диагональю 2 и средняя строка независимы, поэтому 9^15 полей не перебираются.
+    Спин - O(1): класс по alias-таблице, готовое поле из пула, выплата из таблицы.
+    Распределение классов и выплат совпадает с SlotMachine (проверка - engine_check.py).
+    """
+
+    TABLE_VERSION = 1
+    POOL_SPINS = 100000  # Настоящих спинов для пулов: частый класс получает пропорционально больше полей
+    RARE_POOL_SIZE = 2  # Полей для классов, не выпавших в этих спинах
+
+    def __init__(self, cache_file: str = None, config: dict = None):
+        super().__init__(config)
+        tables = self._load_cache(cache_file) if cache_file else None
+        if tables is None:
+            start = time.perf_counter()
+            tables = self.build_tables()
+            logging.info(f"Таблицы движка: {len(tables['classes'])} классов за {time.perf_counter() - start:.1f} с")
+            if cache_file:
+                self._save_cache(cache_file, tables)
+        self.classes = [tuple(tuple(hit) for hit in hits) for hits in tables['classes']]
+        self.class_probabilities = tables['probabilities']
+        self.pools = tables['pools']
+        self._base = len(self.symbols)
+        # Выплата класса в ставках и число линий с джекпотом (💰 × 5)
+        self.class_multipliers = array('I', (sum(self.payouts[symbol][count] for symbol, count in hits)
+                                             for hits in self.classes))
+        self.class_jackpots = array('B', (sum(1 for hit in hits if hit == ('💰', 5)) for hits in self.classes))
+        self._alias_probability, self._alias = self._build_alias(self.class_probabilities)
+
+    def config_key(self) -> str:
+        """Отпечаток символов, весов и выплат: кэш таблиц от другой конфигурации не подойдет"""
+        config = [self.TABLE_VERSION, self.symbols, self.probabilities, self.payouts,
+                  self.POOL_SPINS, self.RARE_POOL_SIZE]
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+    def _load_cache(self, path: str):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                tables = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return tables if tables.get('config') == self.config_key() else None
+
+    def _save_cache(self, path: str, tables: dict) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(tables, config=self.config_key()), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _build_alias(probabilities: List[float]):
+        """Alias-таблица Уокера: выбор класса за два random() независимо от числа классов"""
+        n = len(probabilities)
+        scaled = [p * n for p in probabilities]
+        alias_probability = array('d', [1.0] * n)
+        alias = array('I', range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            alias_probability[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        return alias_probability, alias
+
+    def draw_class(self) -> int:
+        index = int(random.random() * len(self._alias))
+        return index if random.random() < self._alias_probability[index] else self._alias[index]
+
+    def encode_grid(self, reels: List[List[str]]) -> int:
+        code = 0
+        for reel in reels:
+            for symbol in reel:
+                code = code * self._base + self.symbols.index(symbol)
+        return code
+
+    def decode_grid(self, code: int) -> List[List[str]]:
+        cells = []
+        for _ in range(15):
+            code, index = divmod(code, self._base)
+            cells.append(self.symbols[index])
+        cells.reverse()
+        return [cells[i:i + 3] for i in range(0, 15, 3)]
+
+    def settle(self, class_index: int, bet: int) -> Tuple[int, bool]:
+        """Выплата класса - как calculate_win: первый джекпот платит накопленное, следующий - после сброса"""
+        total_win = bet * self.class_multipliers[class_index]
+        jackpots = self.class_jackpots[class_index]
+        for _ in range(jackpots):
+            total_win += self.jackpot
+            self.jackpot = 10000  # Сброс джекпота
+        return total_win, jackpots > 0
+
+    def spin_with_hits(self, bet: int) -> Tuple[List[List[str]], int, bool, Tuple[Tuple[str, int], ...]]:
+        """Класс выплаты из таблицы, поле - из пула класса; линии не проверяются, они и есть класс"""
+        class_index = self.draw_class()
+        pool = self.pools[class_index]
+        reels = self.decode_grid(pool[int(random.random() * len(pool))])
+
+        win_amount, is_jackpot = self.settle(class_index, bet)
+        self.jackpot += round(bet * self.jackpot_increment)
+
+        return reels, win_amount, is_jackpot, self.classes[class_index]
+
+    def build_tables(self, seed: int = 0) -> dict:
+        """Точные вероятности классов и пулы полей для каждого класса"""
+        rng = random.Random(seed)
+        symbols = self.symbols
+        n = len(symbols)
+        total_weight = sum(self.probabilities)
+        p = [w / total_weight for w in self.probabilities]
+        cells = range(n)
+
+        def hit(*line):
+            found = self.line_hit([symbols[i] for i in line])
+            return (found,) if found else ()
+
+        def add_option(options, value, weight):
+            options[0].append(value)
+            options[1].append(weight)
+
+        def choose(options):
+            return rng.choices(options[0], options[1])[0]
+
+        # Строка со своими ячейками b, c между общими a, x, e: распределение исхода по b, c
+        # и варианты (b, c) для каждого исхода - для сборки полей редких классов
+        row, row_cells = {}, {}
+        for a, x, e in itertools.product(cells, repeat=3):
+            outcomes = defaultdict(float)
+            options = defaultdict(lambda: ([], []))
+            for b, c in itertools.product(cells, repeat=2):
+                row_hit = hit(a, b, x, c, e)
+                outcomes[row_hit] += p[b] * p[c]
+                add_option(options[row_hit], (b, c), p[b] * p[c])
+            row[a, x, e] = dict(outcomes)
+            row_cells[a, x, e] = options
+        diagonal = {key: hit(*key) for key in itertools.product(cells, repeat=5)}
+
+        # Строка + диагональ с общими углами a, e: group[x, h1, y, h3] - исходы пары линий
+        group = {}
+        for x, h1, y, h3 in itertools.product(cells, repeat=4):
+            outcomes = defaultdict(float)
+            for a, e in itertools.product(cells, repeat=2):
+                weight = p[a] * p[e]
+                diagonal_hit = diagonal[a, h1, y, h3, e]
+                for row_hit, q in row[a, x, e].items():
+                    outcomes[tuple(sorted(row_hit + diagonal_hit))] += weight * q
+            group[x, h1, y, h3] = list(outcomes.items())
+
+        # Средняя строка: свои ячейки l, m, r между h1 и h3
+        middle, middle_cells = {}, {}
+        for h1, m, h3 in itertools.product(cells, repeat=3):
+            outcomes = defaultdict(float)
+            options = defaultdict(lambda: ([], []))
+            for l, r in itertools.product(cells, repeat=2):
+                middle_hit = hit(l, h1, m, h3, r)
+                outcomes[middle_hit] += p[l] * p[r]
+                add_option(options[middle_hit], (l, r), p[l] * p[r])
+            middle[h1, m, h3] = outcomes
+            middle_cells[h1, m, h3] = options
+        middle_total = {}
+        for h1, h3 in itertools.product(cells, repeat=2):
+            outcomes = defaultdict(float)
+            for m in cells:
+                for middle_hit, q in middle[h1, m, h3].items():
+                    outcomes[middle_hit] += p[m] * q
+            middle_total[h1, h3] = list(outcomes.items())
+
+        # Сумма по центральным ячейкам. Для каждого класса держим одного "свидетеля"
+        # (ячейки и исходы групп), выбранного с вероятностью его доли в классе
+        probabilities = defaultdict(float)
+        witnesses = {}
+        for h1, h3, x, y in itertools.product(cells, repeat=4):
+            weight = p[h1] * p[h3] * p[x] * p[y]
+            for top_hits, q1 in group[x, h1, y, h3]:
+                for bottom_hits, q2 in group[y, h1, x, h3]:
+                    q12 = weight * q1 * q2
+                    for middle_hits, q3 in middle_total[h1, h3]:
+                        hits = top_hits + bottom_hits + middle_hits
+                        if len(hits) > 1:
+                            hits = tuple(sorted(hits))
+                        q = q12 * q3
+                        probabilities[hits] += q
+                        if rng.random() * probabilities[hits] < q:
+                            witnesses[hits] = (h1, h3, x, y, top_hits, bottom_hits, middle_hits)
+
+        corner_cells = {}
+
+        def expand_group(x, h1, y, h3, group_hits):
+            """Ячейки a, b, c, e пары "строка + диагональ" с заданным исходом"""
+            options = corner_cells.get((x, h1, y, h3))
+            if options is None:
+                options = corner_cells[x, h1, y, h3] = defaultdict(lambda: ([], []))
+                for a, e in itertools.product(cells, repeat=2):
+                    diagonal_hit = diagonal[a, h1, y, h3, e]
+                    for row_hit, q in row[a, x, e].items():
+                        add_option(options[tuple(sorted(row_hit + diagonal_hit))], (a, e, row_hit), p[a] * p[e] * q)
+            a, e, row_hit = choose(options[group_hits])
+            b, c = choose(row_cells[a, x, e][row_hit])
+            return a, b, c, e
+
+        def expand(witness) -> List[List[str]]:
+            """Поле по свидетелю: остальные ячейки - с их условными вероятностями"""
+            h1, h3, x, y, top_hits, bottom_hits, middle_hits = witness
+            a, b, c, e = expand_group(x, h1, y, h3, top_hits)
+            a2, b2, c2, e2 = expand_group(y, h1, x, h3, bottom_hits)
+            m = choose((cells, [p[m] * middle[h1, m, h3].get(middle_hits, 0.0) for m in cells]))
+            l, r = choose(middle_cells[h1, m, h3][middle_hits])
+            grid = [[a, l, a2], [b, h1, b2], [x, m, y], [c, h3, c2], [e, r, e2]]
+            return [[symbols[i] for i in reel] for reel in grid]
+
+        # Пулы частых классов - из настоящих спинов (точное условное распределение поля),
+        # редких - из свидетеля
+        classes = sorted(probabilities, key=probabilities.get, reverse=True)
+        index = {hits: i for i, hits in enumerate(classes)}
+        pools = [[] for _ in classes]
+        self._base = n
+        for _ in range(self.POOL_SPINS):
+            reels = [rng.choices(symbols, weights=self.probabilities, k=3) for _ in range(5)]
+            pools[index[tuple(sorted(self.line_hits(reels)))]].append(self.encode_grid(reels))
+        for i, hits in enumerate(classes):
+            if not pools[i]:
+                pools[i] = [self.encode_grid(expand(witnesses[hits])) for _ in range(self.RARE_POOL_SIZE)]
+
+        return {
+            'classes': [list(hits) for hits in classes],
+            'probabilities': [probabilities[hits] for hits in classes],
+            'pools': pools,
+        }
+
+
+def load_machine_config(path: str) -> dict:
+    """Конфигурация слот-машины из JSON; проверяется сразу, а не при первом спине"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    SlotMachine(config)
+    return config
+
+
+class SpinHistory:
+    """Последние спины каждого игрока в кольцевом буфере фиксированного размера.
+
+    Запись - 20 байт: время, ставка, выигрыш и поле 5x3 в системе счисления по числу
+    символов (9^15 < 2^48) вместе с флагом джекпота в одном 64-битном числе.
+    """
+
+    RECORD = struct.Struct('<IIIQ')  # Время (с), ставка, выигрыш, поле | джекпот << 48
+    JACKPOT_BIT = 1 << 48
+    FILE_MAGIC = b'SPH1'
+
+    def __init__(self, symbols: List[str], capacity: int = 100):
+        self.symbols = list(symbols)
+        self.capacity = capacity
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._buffers: Dict[int, bytearray] = {}
+        self._counts: Dict[int, int] = {}  # Всего спинов игрока; позиция записи = count % capacity
+
+    def encode_grid(self, reels: List[List[str]]) -> int:
+        code = 0
+        base = len(self.symbols)
+        for reel in reversed(reels):
+            for symbol in reversed(reel):
+                code = code * base + self._index[symbol]
+        return code
+
+    def decode_grid(self, code: int) -> List[List[str]]:
+        base = len(self.symbols)
+        cells = []
+        for _ in range(15):
+            code, index = divmod(code, base)
+            cells.append(self.symbols[index])
+        return [cells[col * 3:col * 3 + 3] for col in range(5)]
+
+    def add(self, user_id: int, bet: int, reels: List[List[str]], win_amount: int, is_jackpot: bool,
+            timestamp: float = None) -> None:
+        buffer = self._buffers.get(user_id)
+        if buffer is None:
+            buffer = self._buffers[user_id] = bytearray(self.RECORD.size * self.capacity)
+        count = self._counts.get(user_id, 0)
+        grid = self.encode_grid(reels) | (self.JACKPOT_BIT if is_jackpot else 0)
+        self.RECORD.pack_into(buffer, (count % self.capacity) * self.RECORD.size,
+                              int(timestamp if timestamp is not None else time.time()),
+                              min(bet, 0xFFFFFFFF), min(win_amount, 0xFFFFFFFF), grid)
+        self._counts[user_id] = count + 1
+
+    def total(self, user_id: int) -> int:
+        return self._counts.get(user_id, 0)
+
+    def recent(self, user_id: int, limit: int = None) -> List[Dict]:
+        """Последние спины игрока, от новых к старым"""
+        count = self._counts.get(user_id, 0)
+        stored = min(count, self.capacity)
+        if limit is not None:
+            stored = min(stored, limit)
+        buffer = self._buffers.get(user_id)
+        entries = []
+        for number in range(count, count - stored, -1):
+            timestamp, bet, win_amount, grid = self.RECORD.unpack_from(
+                buffer, ((number - 1) % self.capacity) * self.RECORD.size)
+            if not timestamp:
+                break  # Пустой слот: старые записи не сохранились при увеличении емкости
+            entries.append({
+                'number': number,
+                'timestamp': timestamp,
+                'bet': bet,
+                'win': win_amount,
+                'jackpot': bool(grid & self.JACKPOT_BIT),
+                'reels': self.decode_grid(grid & (self.JACKPOT_BIT - 1)),
+            })
+        return entries
+
+    def __len__(self) -> int:
+        return len(self._buffers)  # Игроков с историей
+
+    def memory_bytes(self) -> int:
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def save(self, path: str) -> None:
+        """Сохранение в двоичный файл: записи каждого игрока от старых к новым"""
+        size = self.RECORD.size
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.FILE_MAGIC + struct.pack('<I', len(self._buffers)))
+            for user_id, buffer in self._buffers.items():
+                count = self._counts[user_id]
+                stored = min(count, self.capacity)
+                f.write(struct.pack('<qII', user_id, count, stored))
+                for number in range(count - stored, count):
+                    offset = (number % self.capacity) * size
+                    f.write(buffer[offset:offset + size])
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        size = self.RECORD.size
+        with open(path, 'rb') as f:
+            if f.read(4) != self.FILE_MAGIC:
+                logging.error(f"Неизвестный формат истории спинов: {path}")
+                return
+            users, = struct.unpack('<I', f.read(4))
+            for _ in range(users):
+                user_id, count, stored = struct.unpack('<qII', f.read(16))
+                data = f.read(stored * size)
+                # Емкость могла уменьшиться: оставляем только последние записи
+                keep = min(stored, self.capacity)
+                buffer = self._buffers[user_id] = bytearray(size * self.capacity)
+                for i in range(stored - keep, stored):
+                    number = count - stored + i
+                    offset = (number % self.capacity) * size
+                    buffer[offset:offset + size] = data[i * size:(i + 1) * size]
+                self._counts[user_id] = count
+        logging.info(f"Загружена история спинов {len(self._buffers)} игроков")
+
+
+class WinHistogram:
+    """Гистограммы спинов: массив счетчиков фиксированной длины на игрока и общий массив.
+
+    Раскладка массива: корзины множителя выигрыша, выигрышные линии по символам,
+    текущая и самая длинная серия спинов без выигрыша.
+    """
+
+    # Границы корзин множителя (выигрыш / ставка): 0, <1, 1-2, 2-5, 5-10, 10-25, 25-100, 100+
+    MULTIPLIER_BOUNDS = (1, 2, 5, 10, 25, 100)
+    BUCKET_LABELS = ("0", "<×1", "×1-2", "×2-5", "×5-10", "×10-25", "×25-100", "×100+")
+
+    def __init__(self, symbols: List[str]):
+        self.symbols = list(symbols)
+        self._symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.buckets = len(self.BUCKET_LABELS)
+        self.symbol_offset = self.buckets
+        self.streak = self.symbol_offset + len(self.symbols)  # Текущая серия без выигрыша
+        self.longest = self.streak + 1  # Самая длинная серия без выигрыша
+        self.size = self.longest + 1
+        self.users: Dict[int, array] = {}
+        self.total = array('Q', bytes(8 * self.size))
+
+    def bucket(self, bet: int, win_amount: int) -> int:
+        if win_amount <= 0:
+            return 0
+        return 1 + bisect.bisect_right(self.MULTIPLIER_BOUNDS, win_amount / bet)
+
+    def record(self, user_id: int, bet: int, win_amount: int, hits: List[Tuple[str, int]]) -> None:
+        counters = self.users.get(user_id)
+        if counters is None:
+            counters = self.users[user_id] = array('I', bytes(4 * self.size))
+        total = self.total
+
+        bucket = self.bucket(bet, win_amount)
+        counters[bucket] += 1
+        total[bucket] += 1
+        for symbol, _ in hits:
+            index = self.symbol_offset + self._symbol_index[symbol]
+            counters[index] += 1
+            total[index] += 1
+
+        if win_amount > 0:
+            counters[self.streak] = 0
+        else:
+            counters[self.streak] += 1
+            if counters[self.streak] > counters[self.longest]:
+                counters[self.longest] = counters[self.streak]
+                total[self.longest] = max(total[self.longest], counters[self.longest])
+
+    def get(self, user_id: int):
+        return self.users.get(user_id)
+
+    def save(self, path: str) -> None:
+        data = {
+            'symbols': self.symbols,
+            'total': list(self.total),
+            'users': {str(user_id): list(counters) for user_id, counters in self.users.items()},
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Ошибка при загрузке гистограмм: {e}")
+            return
+        if data.get('symbols') != self.symbols or len(data.get('total', ())) != self.size:
+            logging.error("Гистограммы сохранены для другого набора символов, пропускаем")
+            return
+        self.total = array('Q', data['total'])
+        self.users = {int(user_id): array('I', counters) for user_id, counters in data['users'].items()}
+        logging.info(f"Загружены гистограммы {len(self.users)} игроков")
+
+
+class BonusSchedule:
+    """Колесо таймеров "бонус снова доступен" с шагом в минуту.
+
+    Все сроки не дальше 24 часов, поэтому хватает одного оборота из 1440 ячеек.
+    Наступившие сроки складываются в очередь для напоминаний без обхода всех игроков.
+    """
+
+    SLOT_SECONDS = 60
+    SLOTS = 24 * 60
+
+    def __init__(self, now: float = None):
+        self._slots = [set() for _ in range(self.SLOTS)]
+        self._pending: Dict[int, float] = {}  # Игрок -> время, когда бонус снова доступен
+        self._cursor = int((now if now is not None else time.time()) // self.SLOT_SECONDS)
+        self.due = deque()  # Игроки, чей бонус стал доступен (для напоминаний)
+
+    @property
+    def pending_count(self) -> int:
+        """Сколько игроков еще ждут бонус"""
+        return len(self._pending)
+
+    def schedule(self, user_id: int, ready_at: float) -> None:
+        self.cancel(user_id)
+        self._pending[user_id] = ready_at
+        slot = max(int(ready_at // self.SLOT_SECONDS), self._cursor)
+        self._slots[slot % self.SLOTS].add(user_id)
+
+    def cancel(self, user_id: int) -> None:
+        ready_at = self._pending.pop(user_id, None)
+        if ready_at is not None:
+            slot = max(int(ready_at // self.SLOT_SECONDS), self._cursor)
+            self._slots[slot % self.SLOTS].discard(user_id)
+
+    def advance(self, now: float = None) -> int:
+        """Переносит наступившие сроки в due; возвращает число перенесенных"""
+        now = now if now is not None else time.time()
+        current = int(now // self.SLOT_SECONDS)
+        expired = 0
+        # Прошедшие минуты разбираем целиком, текущую - только наступившие сроки
+        while self._cursor <= current:
+            bucket = self._slots[self._cursor % self.SLOTS]
+            for user_id in [uid for uid in bucket if self._pending[uid] <= now]:
+                bucket.discard(user_id)
+                del self._pending[user_id]
+                self.due.append(user_id)
+                expired += 1
+            if self._cursor == current:
+                break
+            self._cursor += 1
+        return expired
+
+
+class SortedKeys:
+    """Отсортированный список блоками по LOAD..2·LOAD ключей (как sortedcontainers.SortedList).
+
+    Вставка и удаление - bisect по максимумам блоков и сдвиг внутри одного блока, O(log n + LOAD),
+    а не сдвиг всего списка. Длины блоков - в дереве Фенвика: позиция ключа и поиск по позиции -
+    O(log n); дерево перестраивается, O(n / LOAD), только при делении или удалении блока.
+    """
+
+    LOAD = 1000
+
+    def __init__(self):
+        self.build(())
+
+    def build(self, keys) -> None:
+        keys = sorted(keys)
+        self._lists = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._maxes = [block[-1] for block in self._lists]
+        self._len = len(keys)
+        self._tree = None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._lists)
+
+    def memory_bytes(self) -> int:
+        # estimate_size меряет ключи; блоки - это еще указатель на каждый ключ
+        return (estimate_size(self) + sys.getsizeof(self._lists) + sys.getsizeof(self._maxes)
+                + sum(map(sys.getsizeof, self._lists)))
+
+    def add(self, key) -> None:
+        if not self._maxes:
+            self._lists.append([key])
+            self._maxes.append(key)
+        else:
+            i = bisect.bisect_left(self._maxes, key)
+            if i == len(self._maxes):
+                i -= 1
+                self._lists[i].append(key)
+                self._maxes[i] = key
+            else:
+                bisect.insort(self._lists[i], key)
+            block = self._lists[i]
+            if len(block) > 2 * self.LOAD:
+                self._lists[i:i + 1] = [block[:self.LOAD], block[self.LOAD:]]
+                self._maxes[i:i + 1] = [block[self.LOAD - 1], block[-1]]
+                self._tree = None
+            else:
+                self._tree_add(i, 1)
+        self._len += 1
+
+    def discard(self, key) -> None:
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return
+        block = self._lists[i]
+        j = bisect.bisect_left(block, key)
+        if block[j] != key:
+            return
+        del block[j]
+        if block:
+            self._maxes[i] = block[-1]
+            self._tree_add(i, -1)
+        else:
+            del self._lists[i]
+            del self._maxes[i]
+            self._tree = None
+        self._len -= 1
+
+    def _build_tree(self) -> List[int]:
+        tree = [0] + [len(block) for block in self._lists]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+        return tree
+
+    def _tree_add(self, i: int, delta: int) -> None:
+        tree = self._tree
+        if tree is None:
+            return
+        i += 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _position(self, i: int, j: int) -> int:
+        """Позиция j-го ключа блока i: сумма длин блоков до i + j"""
+        tree = self._tree or self._build_tree()
+        while i > 0:
+            j += tree[i]
+            i -= i & -i
+        return j
+
+    def _locate(self, position: int) -> Tuple[int, int]:
+        """(блок, индекс в блоке) для позиции: спуск по дереву Фенвика"""
+        tree = self._tree or self._build_tree()
+        i = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            if i + step < len(tree) and tree[i + step] <= position:
+                i += step
+                position -= tree[i]
+            step >>= 1
+        return i, position
+
+    def bisect_left(self, key) -> int:
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return self._len
+        return self._position(i, bisect.bisect_left(self._lists[i], key))
+
+    def bisect_right(self, key) -> int:
+        i = bisect.bisect_right(self._maxes, key)
+        if i == len(self._maxes):
+            return self._len
+        return self._position(i, bisect.bisect_right(self._lists[i], key))
+
+    def iter_from(self, start: int):
+        """Ключи начиная с позиции start"""
+        if start >= self._len:
+            return
+        i, j = self._locate(start)
+        yield from itertools.islice(self._lists[i], j, None)
+        for block in itertools.islice(self._lists, i + 1, None):
+            yield from block
+
+
+class RankIndex:
+    """Игроки по убыванию значения (баланс, спины): страница - O(размер + log n).
+
+    Ключи (-значение, user_id) в SortedKeys: обновление - O(log n + размер блока),
+    без полной сортировки и без сдвига всего списка.
+    """
+
+    def __init__(self):
+        self._keys = SortedKeys()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def build(self, items) -> None:
+        self._keys.build((-value, user_id) for user_id, value in items)
+
+    def memory_bytes(self) -> int:
+        return self._keys.memory_bytes()
+
+    def update(self, user_id: int, old, new) -> None:
+        if old == new:
+            return
+        if old is not None:
+            self.remove(user_id, old)
+        self._keys.add((-new, user_id))
+
+    def remove(self, user_id: int, value: int) -> None:
+        self._keys.discard((-value, user_id))
+
+    def rank(self, user_id: int, value: int) -> int:
+        """Позиция игрока с 0"""
+        return self._keys.bisect_left((-value, user_id))
+
+    def page(self, start: int, size: int) -> List[Tuple[int, int]]:
+        return [(user_id, -value) for value, user_id in itertools.islice(self._keys.iter_from(start), size)]
+
+    def after(self, cursor: Tuple[int, int]) -> int:
+        """Начало страницы, следующей за курсором (значение, user_id)"""
+        value, user_id = cursor
+        return self._keys.bisect_right((-value, user_id))
+
+    def before(self, cursor: Tuple[int, int], size: int) -> int:
+        """Начало страницы, предшествующей курсору"""
+        value, user_id = cursor
+        return max(0, self._keys.bisect_left((-value, user_id)) - size)
+
+
+class NameIndex:
+    """Поиск игроков по началу имени или любого слова имени, без учета регистра.
+
+    Ключи (слово, user_id) в SortedKeys: поиск - bisect до первого совпадения и
+    проход по совпадениям, O(log n + k); смена имени - O(log n + размер блока) на слово.
+    """
+
+    def __init__(self):
+        self._keys = SortedKeys()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def memory_bytes(self) -> int:
+        return self._keys.memory_bytes()
+
+    @staticmethod
+    def tokens(name: str) -> set:
+        folded = name.casefold().strip()
+        if not folded:
+            return set()
+        return {folded} | set(folded.split())
+
+    def build(self, names) -> None:
+        self._keys.build((token, user_id) for user_id, name in names for token in self.tokens(name))
+
+    def update(self, user_id: int, old_name: str, new_name: str) -> None:
+        old_tokens, new_tokens = self.tokens(old_name or ""), self.tokens(new_name or "")
+        for token in old_tokens - new_tokens:
+            self._keys.discard((token, user_id))
+        for token in new_tokens - old_tokens:
+            self._keys.add((token, user_id))
+
+    def search(self, prefix: str, limit: int = 20) -> List[int]:
+        prefix = prefix.casefold().strip()
+        if not prefix:
+            return []
+        found = []
+        for token, user_id in self._keys.iter_from(self._keys.bisect_left((prefix,))):
+            if len(found) >= limit or not token.startswith(prefix):
+                break
+            if user_id not in found:
+                found.append(user_id)
+        return found
+
+
+class ObservedBalances(defaultdict):
+    """Балансы, сообщающие об изменениях: все пути записи (+=, присваивание, значение
+    по умолчанию) проходят через __setitem__, поэтому индексы не отстают"""
+
+    def __init__(self, default_factory, on_change=None):
+        super().__init__(default_factory)
+        self.on_change = on_change
+
+    def __setitem__(self, user_id, value):
+        old = self.get(user_id)
+        super().__setitem__(user_id, value)
+        if self.on_change:
+            self.on_change(user_id, old, value)
+
+    def __delitem__(self, user_id):
+        old = self[user_id]
+        super().__delitem__(user_id)
+        if self.on_change:
+            self.on_change(user_id, old, None)
+
+
+class StoreBusyError(RuntimeError):
+    """Запись в хранилище не удалась за max_retries попыток - база занята; операцию можно повторить"""
+
+
+class SqliteStore:
+    """Общее для процессов хранилище денег игроков: записи с версиями в SQLite (WAL), запись через CAS.
+
+    Из цикла событий к базе обращаются только через run(): все запросы идут в одном потоке
+    хранилища, и занятая другим процессом база не останавливает бота.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            spins INTEGER NOT NULL DEFAULT 0,
+            total_bet INTEGER NOT NULL DEFAULT 0,
+            total_win INTEGER NOT NULL DEFAULT 0,
+            last_bonus REAL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS users_updated ON users (updated);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    """
+    FIELDS = ('balance', 'spins', 'total_bet', 'total_win', 'last_bonus')
+    BUSY_TIMEOUT = 0.1  # Ожидание чужой блокировки за одну попытку, с; дальше - повтор с паузой
+
+    def __init__(self, path: str, default_balance: int = 1000, max_retries: int = 50):
+        self.path = path
+        self.default_balance = default_balance
+        self.max_retries = max_retries
+        # Автокоммит: каждая запись - отдельная короткая транзакция.
+        # Соединение используется из потока хранилища, но всегда из одного потока за раз
+        self.db = sqlite3.connect(path, timeout=self.BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-store")
+        self.metrics = {'writes': 0, 'conflicts': 0, 'busy': 0}
+
+    async def run(self, function, *args):
+        """Вызов метода хранилища в его потоке"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _backoff(self, error: sqlite3.OperationalError, attempt: int) -> None:
+        """База занята другим процессом: пауза перед повтором; прочие ошибки SQLite - наверх"""
+        if 'locked' not in str(error) and 'busy' not in str(error):
+            raise error
+        self.metrics['busy'] += 1
+        time.sleep(min(0.005 * 2 ** attempt, 0.1))
+
+    def new_record(self) -> Dict:
+        return {'version': 0, 'balance': self.default_balance, 'spins': 0, 'total_bet': 0, 'total_win': 0,
+                'last_bonus': None}
+
+    @staticmethod
+    def _record(row) -> Dict:
+        return {'version': row[0], 'balance': row[1], 'spins': row[2], 'total_bet': row[3],
+                'total_win': row[4], 'last_bonus': row[5]}
+
+    def read(self, user_id: int):
+        row = self.db.execute("SELECT version, balance, spins, total_bet, total_win, last_bonus "
+                              "FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def compare_and_set(self, user_id: int, version: int, record: Dict) -> bool:
+        """Запись, только если версия в базе не изменилась с чтения; version 0 - записи еще нет"""
+        values = [record[field] for field in self.FIELDS]
+        if version == 0:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO users (user_id, version, balance, spins, total_bet, total_win, "
+                "last_bonus, updated) VALUES (?, 1, ?, ?, ?, ?, ?, ?)", (user_id, *values, time.time()))
+        else:
+            cursor = self.db.execute(
+                "UPDATE users SET version = version + 1, balance = ?, spins = ?, total_bet = ?, total_win = ?, "
+                "last_bonus = ?, updated = ? WHERE user_id = ? AND version = ?",
+                (*values, time.time(), user_id, version))
+        self.metrics['writes'] += 1
+        return cursor.rowcount == 1
+
+    def modify(self, user_id: int, change) -> Tuple[Dict, Dict]:
+        """Чтение-изменение-CAS с повтором при конфликте с другим процессом.
+
+        change(запись) возвращает новую запись или None, если изменение недопустимо.
+        Результат: (запись до, запись после или None).
+        """
+        for attempt in range(self.max_retries):
+            try:
+                before = self.read(user_id) or self.new_record()
+                after = change(dict(before))
+                if after is None:
+                    return before, None
+                if self.compare_and_set(user_id, before['version'], after):
+                    after['version'] = before['version'] + 1
+                    return before, after
+            except sqlite3.OperationalError as e:
+                self._backoff(e, attempt)
+                continue
+            self.metrics['conflicts'] += 1
+        raise StoreBusyError(f"Не удалось записать игрока {user_id}: {self.max_retries} попыток подряд")
+
+    def modify_many(self, changes) -> List[Tuple[Dict, Dict]]:
+        """Пакет modify одной транзакцией: [(user_id, change)] -> [(запись до, запись после или None)]"""
+        with self.transaction():
+            return [self.modify(user_id, change) for user_id, change in changes]
+
+    @contextmanager
+    def transaction(self):
+        """Пакет записей одной транзакцией; другие процессы ждут ее окончания, а не конфликтуют"""
+        for attempt in range(self.max_retries):
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                self._backoff(e, attempt)
+        else:
+            raise StoreBusyError(f"Не удалось начать транзакцию: {self.max_retries} попыток подряд")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def records(self, since: float = None):
+        """Все записи или измененные начиная с момента since: (user_id, запись, updated)"""
+        query = "SELECT version, balance, spins, total_bet, total_win, last_bonus, user_id, updated FROM users"
+        rows = self.db.execute(query) if since is None else self.db.execute(query + " WHERE updated >= ?", (since,))
+        for row in rows:
+            yield row[6], self._record(row), row[7]
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def import_records(self, records) -> None:
+        """Начальная загрузка (user_id, запись) из JSON-файла; существующие записи не трогаются"""
+        now = time.time()
+        with self.transaction():
+            self.db.executemany(
+                "INSERT OR IGNORE INTO users (user_id, version, balance, spins, total_bet, total_win, "
+                "last_bonus, updated) VALUES (?, 1, ?, ?, ?, ?, ?, ?)",
+                ((user_id, *(record[field] for field in self.FIELDS), now) for user_id, record in records))
+
+    def get_jackpot(self, default: int) -> int:
+        self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('jackpot', ?)", (default,))
+        return self.db.execute("SELECT value FROM meta WHERE key = 'jackpot'").fetchone()[0]
+
+    def add_jackpot(self, delta: int) -> int:
+        """Изменение джекпота на delta одной командой: вклады процессов складываются, а не затирают друг друга"""
+        for attempt in range(self.max_retries):
+            try:
+                # fetchall: команда должна выполниться до конца, иначе транзакция останется открытой
+                return self.db.execute("UPDATE meta SET value = value + ? WHERE key = 'jackpot' RETURNING value",
+                                       (delta,)).fetchall()[0][0]
+            except sqlite3.OperationalError as e:
+                self._backoff(e, attempt)
+        raise StoreBusyError(f"Не удалось изменить джекпот: {self.max_retries} попыток подряд")
+
+    def changed_records(self, since: float) -> List[Tuple[int, Dict]]:
+        """Измененные записи списком: для вызова через run()"""
+        return [(user_id, record) for user_id, record, _ in self.records(since)]
+
+
 class UserManager:
-    def __init__(self, data_file="user_data.json"):
+    BONUS_INTERVAL = timedelta(hours=24)
+
+    def __init__(self, data_file="user_data.json", store: SqliteStore = None):
         self._locks = defaultdict(asyncio.Lock)
         self._saving = False
+        self._write_lock = threading.Lock()  # Запись файла из потока не пересекается с save_data()
 
         # Инициализируем атрибуты ДО загрузки данных
         self.data_file = data_file
-        self.balances = defaultdict(lambda: 1000)
-        self.daily_bonuses = defaultdict(lambda: datetime.min)
+        # Общее с другими процессами хранилище балансов, статистики и бонусов; в JSON - остальное
+        self.store = store
+        self._store_synced = 0.0
+        self._store_versions = {}  # Версия записи хранилища, которая сейчас в памяти
+        self.balances = ObservedBalances(lambda: 1000)
+        # Упорядоченные индексы для постраничных /leaderboard и /users
+        self.balance_index = RankIndex()
+        self.spins_index = RankIndex()
+        self.name_index = NameIndex()
+        self.daily_bonuses: Dict[int, datetime] = {}  # Только игроки, получавшие бонус
+        self.bonus_schedule = BonusSchedule()
+        self.bonus_reminders = set()  # Игроки, включившие напоминание о бонусе
         self.stats = defaultdict(lambda: {'spins': 0, 'total_bet': 0, 'total_win': 0})
         self.achievements = defaultdict(set)
         self.user_names = defaultdict(str)
         self.user_settings = defaultdict(lambda: {'default_bet': 10})
         self.jackpot = 10000
 
+        # Общие счетчики спинов, чтобы метрики не пересчитывали stats целиком
+        self.totals = {'spins': 0, 'total_bet': 0, 'total_win': 0}
+        # Сохранения: количество, ошибки, длительность и размер файла последнего
+        self.save_metrics = {'count': 0, 'errors': 0, 'duration': 0.0, 'bytes': 0}
+
         # Загружаем данные при инициализации
         self.load_data()
 
     def load_data(self):
         """Загрузка данных пользователей из файла"""
+        # Индексы строятся одной сортировкой после загрузки, а не вставкой каждого игрока
+        self.balances.on_change = None
         try:
             if os.path.exists(self.data_file):
                 with open(self.data_file, 'r', encoding='utf-8') as f:
@@ -136,17 +1203,21 @@ class UserManager:
 
                 # Восстанавливаем даты бонусов
                 daily_bonuses_data = data.get('daily_bonuses', {})
+                self.bonus_schedule = BonusSchedule()
                 for user_id_str, bonus_date_str in daily_bonuses_data.items():
-                    user_id = int(user_id_str)
-                    if bonus_date_str and bonus_date_str != "":
+                    if bonus_date_str:
+                        user_id = int(user_id_str)
                         self.daily_bonuses[user_id] = datetime.fromisoformat(bonus_date_str)
-                    else:
-                        self.daily_bonuses[user_id] = datetime.min
+                        ready_at = self.daily_bonuses[user_id] + self.BONUS_INTERVAL
+                        if ready_at > datetime.now():
+                            self.bonus_schedule.schedule(user_id, ready_at.timestamp())
 
                 # Восстанавливаем статистику
                 stats_data = data.get('stats', {})
                 for user_id_str, user_stats in stats_data.items():
                     self.stats[int(user_id_str)] = user_stats
+                    for key in self.totals:
+                        self.totals[key] += user_stats.get(key, 0)
 
                 # Восстанавливаем имена пользователей
                 user_names_data = data.get('user_names', {})
@@ -157,6 +1228,8 @@ class UserManager:
                 user_settings_data = data.get('user_settings', {})
                 for user_id_str, settings in user_settings_data.items():
                     self.user_settings[int(user_id_str)] = settings
+                self.bonus_reminders = {user_id for user_id, settings in self.user_settings.items()
+                                        if settings.get('bonus_reminder')}
 
                 # Восстанавливаем джекпот
                 self.jackpot = data.get('jackpot', 10000)
@@ -179,55 +1252,193 @@ class UserManager:
         except Exception as e:
             logging.error(f"Ошибка при загрузке данных: {e}")
 
+        if self.store:
+            self._load_from_store()
+        self.rebuild_indexes()
+        self.balances.on_change = self._on_balance_change
+
+    def _load_from_store(self) -> None:
+        """Деньги игроков - из общего хранилища; при первом запуске переносим их туда из JSON"""
+        if not self.store.count() and self.balances:
+            self.store.import_records((user_id, {
+                'balance': balance,
+                'spins': self.get_spins(user_id),
+                'total_bet': self.stats[user_id]['total_bet'] if user_id in self.stats else 0,
+                'total_win': self.stats[user_id]['total_win'] if user_id in self.stats else 0,
+                'last_bonus': self.daily_bonuses[user_id].timestamp() if user_id in self.daily_bonuses else None,
+            }) for user_id, balance in self.balances.items())
+            logging.info(f"Перенесено в {self.store.path} игроков: {len(self.balances)}")
+
+        self.balances.clear()
+        self.stats.clear()
+        self.daily_bonuses.clear()
+        self.bonus_schedule = BonusSchedule()
+        self.totals = dict.fromkeys(self.totals, 0)
+        self._store_synced = time.time()
+        # Индексы строятся после загрузки одной сортировкой (rebuild_indexes), здесь - только данные
+        for user_id, record, _ in self.store.records():
+            self._store_versions[user_id] = record['version']
+            self.balances[user_id] = record['balance']
+            self.stats[user_id] = {key: record[key] for key in self.totals}
+            for key in self.totals:
+                self.totals[key] += record[key]
+            self._set_last_bonus(user_id, record['last_bonus'])
+        self.jackpot = self.store.get_jackpot(self.jackpot)
+        logging.info(f"Загружено из {self.store.path}: {len(self.balances)} игроков, джекпот {self.jackpot}")
+
+    def _apply_record(self, user_id: int, record: Dict) -> None:
+        """Запись игрока из хранилища - в память: баланс, статистика, индексы и дата бонуса"""
+        # Ответы потока хранилища могут прийти позже более новой записи - старую не применяем
+        if record['version'] < self._store_versions.get(user_id, 0):
+            return
+        self._store_versions[user_id] = record['version']
+        if self.balances.get(user_id) != record['balance']:
+            self.balances[user_id] = record['balance']
+        stats = self.stats[user_id]
+        spins, wagered, won = (record['spins'] - stats['spins'], record['total_bet'] - stats['total_bet'],
+                               record['total_win'] - stats['total_win'])
+        if spins or wagered or won:
+            self._add_spin_stats(user_id, spins, wagered, won)
+        self._set_last_bonus(user_id, record['last_bonus'])
+
+    def _set_last_bonus(self, user_id: int, timestamp) -> None:
+        if not timestamp:
+            return
+        last_bonus = datetime.fromtimestamp(timestamp)
+        if self.daily_bonuses.get(user_id) != last_bonus:
+            self.daily_bonuses[user_id] = last_bonus
+            ready_at = last_bonus + self.BONUS_INTERVAL
+            if ready_at > datetime.now():
+                self.bonus_schedule.schedule(user_id, ready_at.timestamp())
+
+    async def _store_modify(self, user_id: int, change) -> Tuple[Dict, Dict]:
+        """Изменение записи игрока в хранилище (CAS); память получает итоговое состояние записи"""
+        before, after = await self.store.run(self.store.modify, user_id, change)
+        self._apply_record(user_id, after or before)
+        return before, after
+
+    @staticmethod
+    def _record_delta(record: Dict, balance: int = 0, spins: int = 0, wagered: int = 0, won: int = 0) -> Dict:
+        record['balance'] += balance
+        record['spins'] += spins
+        record['total_bet'] += wagered
+        record['total_win'] += won
+        return record
+
+    async def sync_from_store(self) -> int:
+        """Подтягивает изменения других процессов с прошлой синхронизации; число обновленных игроков"""
+        # Запас в секунду: запись с чуть более ранней меткой могла закоммититься после прошлого чтения
+        since = self._store_synced - 1.0
+        self._store_synced = time.time()
+        records = await self.store.run(self.store.changed_records, since)
+        for user_id, record in records:
+            self._apply_record(user_id, record)
+        self.jackpot = await self.store.run(self.store.add_jackpot, 0)
+        return len(records)
+
+    def rebuild_indexes(self) -> None:
+        self.balance_index.build(self.balances.items())
+        self.name_index.build(self.user_names.items())
+        self.spins_index.build((user_id, self.get_spins(user_id)) for user_id in self.balances)
+
+    def set_user_name(self, user_id: int, name: str) -> None:
+        """Имя игрока; индекс поиска обновляется только при смене имени"""
+        old_name = self.user_names.get(user_id)
+        if old_name != name:
+            self.user_names[user_id] = name
+            self.name_index.update(user_id, old_name, name)
+
+    def get_spins(self, user_id: int) -> int:
+        stats = self.stats.get(user_id)
+        return stats['spins'] if stats else 0
+
+    def _on_balance_change(self, user_id: int, old, new) -> None:
+        if new is None:
+            self.balance_index.remove(user_id, old)
+            self.spins_index.remove(user_id, self.get_spins(user_id))
+            return
+        self.balance_index.update(user_id, old, new)
+        if old is None:
+            # Новый игрок попадает и в список по спинам
+            self.spins_index.update(user_id, None, self.get_spins(user_id))
+
     def save_data(self):
         """Сохранение данных пользователей в файл"""
+        self._write_data(*self._snapshot_data())
+
+    async def save_data_async(self):
+        """Сохранение без остановки цикла событий: снимок делается сразу, файл пишется в потоке"""
+        await asyncio.to_thread(self._write_data, *self._snapshot_data())
+
+    def _snapshot_data(self) -> Tuple[Dict, int, int, int]:
+        """Копия данных для записи: (данные, пользователей, настроек, джекпот)"""
+        # Создаем копии данных для безопасного сохранения. Ключи-числа json сам пишет строками,
+        # поэтому хватает копии словаря. Статистика игрока - словарь с постоянными ключами,
+        # в потоке в нем могут поменяться только числа; в настройки ключи добавляются - их копируем
+        save_balances = dict(self.balances)
+        save_stats = dict(self.stats)
+        save_user_names = dict(self.user_names)
+        save_user_settings = {user_id: dict(settings) for user_id, settings in self.user_settings.items()}  # ДОБАВЛЕНО
+
+        # Обрабатываем даты бонусов
+        save_daily_bonuses = {user_id: bonus_date.isoformat()
+                              for user_id, bonus_date in self.daily_bonuses.items()}
+
+        data = {
+            'balances': save_balances,
+            'daily_bonuses': save_daily_bonuses,
+            'stats': save_stats,
+            'user_names': save_user_names,
+            'user_settings': save_user_settings,  # ДОБАВЛЕНО
+            'jackpot': self.jackpot
+        }
+        if self.store:
+            # Деньги живут в общем хранилище; снимок другого процесса не должен их перезаписывать
+            for key in ('balances', 'daily_bonuses', 'stats', 'jackpot'):
+                del data[key]
+        return data, len(save_balances), len(save_user_settings), self.jackpot
+
+    def _write_data(self, data: Dict, users: int, settings: int, jackpot: int) -> None:
+        start = time.perf_counter()
         try:
-            # Создаем копии данных для безопасного сохранения
-            save_balances = {str(k): v for k, v in self.balances.items()}
-            save_stats = {str(k): v for k, v in self.stats.items()}
-            save_user_names = {str(k): v for k, v in self.user_names.items()}
-            save_user_settings = {str(k): v for k, v in self.user_settings.items()}  # ДОБАВЛЕНО
-
-            # Обрабатываем даты бонусов
-            save_daily_bonuses = {}
-            for user_id, bonus_date in self.daily_bonuses.items():
-                if bonus_date > datetime.min:
-                    save_daily_bonuses[str(user_id)] = bonus_date.isoformat()
-                else:
-                    save_daily_bonuses[str(user_id)] = ""
-
-            data = {
-                'balances': save_balances,
-                'daily_bonuses': save_daily_bonuses,
-                'stats': save_stats,
-                'user_names': save_user_names,
-                'user_settings': save_user_settings,  # ДОБАВЛЕНО
-                'jackpot': self.jackpot
-            }
-
             # Создаем директорию если не существует
             os.makedirs(os.path.dirname(self.data_file) if os.path.dirname(self.data_file) else '.', exist_ok=True)
 
-            with open(self.data_file, 'w', encoding='utf-8') as f:
+            with self._write_lock, open(self.data_file, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
 
-            logging.info(f"Данные {len(save_balances)} пользователей сохранены в {self.data_file}")
-            logging.info(f"Джекпот сохранен: {self.jackpot}")
-            logging.info(f"Настройки {len(save_user_settings)} пользователей сохранены")  # ДОБАВЛЕНО
+            self.save_metrics['count'] += 1
+            self.save_metrics['duration'] = time.perf_counter() - start
+            self.save_metrics['bytes'] = os.path.getsize(self.data_file)
+
+            logging.info(
+                "Данные %d пользователей сохранены в %s (%d настроек, джекпот %d, %.0f мс, %d байт)",
+                users, self.data_file, settings, jackpot,
+                self.save_metrics['duration'] * 1000, self.save_metrics['bytes'],
+                extra={'category': 'save'}
+            )
 
         except Exception as e:
+            self.save_metrics['errors'] += 1
             logging.error(f"Ошибка при сохранении данных: {e}")
 
     def get_jackpot(self) -> int:
         return self.jackpot
 
-    def set_jackpot(self, amount: int) -> None:
+    def set_jackpot(self, amount: int) -> int:
+        """Новый джекпот (без хранилища; с ним джекпот меняется только приращениями update_jackpot)"""
         self.jackpot = amount
         asyncio.create_task(self._delayed_save())
+        return self.jackpot
 
-    def update_jackpot(self, amount: int) -> None:
+    async def update_jackpot(self, amount: int) -> int:
+        """Джекпот += amount; в хранилище - одной командой, вклады процессов и спинов складываются"""
+        if self.store:
+            self.jackpot = await self.store.run(self.store.add_jackpot, amount)
+            return self.jackpot
         self.jackpot += amount
         asyncio.create_task(self._delayed_save())
+        return self.jackpot
 
     def get_default_bet(self, user_id: int) -> int:
         if user_id not in self.user_settings:
@@ -235,12 +1446,20 @@ class UserManager:
         return self.user_settings[user_id].get('default_bet', 10)
 
     def set_default_bet(self, user_id: int, bet: int) -> None:
-        logging.info(f"Setting default bet for user {user_id} to {bet}")
         if user_id not in self.user_settings:
             self.user_settings[user_id] = {}
         self.user_settings[user_id]['default_bet'] = bet
         asyncio.create_task(self._delayed_save())
-        logging.info(f"User settings after change: {self.user_settings[user_id]}")
+        logging.debug("User %s default bet set to %s", user_id, bet, extra={'category': 'settings'})
+
+    def is_turbo(self, user_id: int) -> bool:
+        return self.user_settings.get(user_id, {}).get('turbo', False)
+
+    def set_turbo(self, user_id: int, enabled: bool) -> None:
+        if user_id not in self.user_settings:
+            self.user_settings[user_id] = {'default_bet': 10}
+        self.user_settings[user_id]['turbo'] = enabled
+        asyncio.create_task(self._delayed_save())
 
     async def _immediate_save(self):
         """Немедленное сохранение для критических данных"""
@@ -252,6 +1471,10 @@ class UserManager:
 
     async def update_balance(self, user_id: int, amount: int) -> bool:
         async with self._locks[user_id]:
+            if self.store:
+                _, after = await self._store_modify(
+                    user_id, lambda r: self._record_delta(r, amount) if r['balance'] + amount >= 0 else None)
+                return after is not None
             if self.balances[user_id] + amount < 0:
                 return False
             self.balances[user_id] += amount
@@ -269,120 +1492,887 @@ class UserManager:
             finally:
                 self._saving = False
 
+    async def record_spin(self, user_id: int, bet: int, win_amount: int) -> None:
+        """Учет одного спина в статистике игрока и общих счетчиках"""
+        if self.store:
+            await self._store_modify(user_id, lambda r: self._record_delta(r, spins=1, wagered=bet, won=win_amount))
+            return
+        self._add_spin_stats(user_id, 1, bet, win_amount)
+
+    def _add_spin_stats(self, user_id: int, spins: int, wagered: int, won: int) -> None:
+        stats = self.stats[user_id]
+        if user_id in self.balances:
+            self.spins_index.update(user_id, stats['spins'], stats['spins'] + spins)
+        stats['spins'] += spins
+        stats['total_bet'] += wagered
+        stats['total_win'] += won
+        self.totals['spins'] += spins
+        self.totals['total_bet'] += wagered
+        self.totals['total_win'] += won
+
+    async def settle_spin_batch(self, user_id: int, bet: int, count: int, spin,
+                                stop_loss: int, stop_win: int) -> Dict:
+        """Серия спинов одной транзакцией: ставки, выигрыши и статистика за один захват блокировки"""
+        result = {
+            'spins': 0, 'wagered': 0, 'won': 0, 'jackpots': 0,
+            'best_win': 0, 'best_reels': None, 'stop_reason': 'done'
+        }
+        async with self._locks[user_id]:
+            if self.store:
+                # Серия считается от актуального баланса, а не от закэшированного
+                self._apply_record(user_id, await self.store.run(self.store.read, user_id) or self.store.new_record())
+            balance = self.balances[user_id]
+            for _ in range(count):
+                if balance < bet:
+                    result['stop_reason'] = 'balance'
+                    break
+
+                reels, win_amount, is_jackpot = spin(bet)
+                balance += win_amount - bet
+                result['spins'] += 1
+                result['wagered'] += bet
+                result['won'] += win_amount
+                if win_amount > result['best_win'] or result['best_reels'] is None:
+                    result['best_win'] = win_amount
+                    result['best_reels'] = reels
+
+                if is_jackpot:
+                    result['jackpots'] += 1
+                if is_jackpot or win_amount >= stop_win:
+                    result['stop_reason'] = 'big_win'
+                    break
+                if result['wagered'] - result['won'] >= stop_loss:
+                    result['stop_reason'] = 'stop_loss'
+                    break
+
+            if self.store:
+                # Пишем приращения: если другой процесс успел изменить баланс, его изменение сохранится
+                await self._store_modify(user_id, lambda r: self._record_delta(
+                    r, result['won'] - result['wagered'], result['spins'], result['wagered'], result['won']))
+                balance = self.balances[user_id]
+            else:
+                self.balances[user_id] = balance
+                self._add_spin_stats(user_id, result['spins'], result['wagered'], result['won'])
+                asyncio.create_task(self._delayed_save())
+
+        result['balance'] = balance
+        return result
+
+    async def apply_balance_batch(self, operations, dry_run: bool = False) -> List[Dict]:
+        """Пакет изменений балансов одной транзакцией: (user_id, сумма) с правилами /addbalance.
+
+        Без хранилища применяется без await: для цикла событий это одна неделимая операция,
+        спины и бонусы не вклиниваются между строками. Данные сохраняются один раз в конце,
+        файл пишется в потоке.
+        """
+        results = []
+        if self.store and not dry_run:
+            # Одна транзакция хранилища: пакет не перемешивается с записями других процессов
+            records = await self.store.run(self.store.modify_many, [
+                (user_id, lambda r, amount=amount: self._batch_record(r, amount)) for user_id, amount in operations])
+            # Память - только после COMMIT: при откате в ней не останется изменений, которых нет в базе
+            for (user_id, amount), (before, after) in zip(operations, records):
+                self._apply_record(user_id, after or before)
+                results.append({'user_id': user_id, 'amount': amount, 'old': before['balance'],
+                                'new': (after or before)['balance'],
+                                'error': None if after else "недостаточно средств"})
+            return results
+
+        for user_id, amount in operations:
+            old_balance = self.balances[user_id]
+            if amount == 0:
+                new_balance = 0
+            else:
+                new_balance = old_balance + amount
+            if new_balance < 0:
+                results.append({'user_id': user_id, 'amount': amount, 'old': old_balance,
+                                'new': old_balance, 'error': "недостаточно средств"})
+                continue
+            if not dry_run:
+                self.balances[user_id] = new_balance
+            results.append({'user_id': user_id, 'amount': amount, 'old': old_balance,
+                            'new': new_balance, 'error': None})
+
+        if not dry_run and results:
+            await self.save_data_async()
+        return results
+
+    @staticmethod
+    def _batch_record(record: Dict, amount: int):
+        """Правило /addbalance для записи хранилища: 0 - обнулить, иначе прибавить, без ухода в минус"""
+        balance = 0 if amount == 0 else record['balance'] + amount
+        if balance < 0:
+            return None
+        record['balance'] = balance
+        return record
+
+    def next_bonus_time(self, user_id: int):
+        """Когда бонус снова станет доступен; None - доступен сейчас"""
+        last_bonus = self.daily_bonuses.get(user_id)
+        if last_bonus is None or datetime.now() - last_bonus >= self.BONUS_INTERVAL:
+            return None
+        return last_bonus + self.BONUS_INTERVAL
+
     def can_claim_bonus(self, user_id: int) -> bool:
-        last_bonus = self.daily_bonuses[user_id]
-        return datetime.now() - last_bonus >= timedelta(hours=24)
-
-    def claim_bonus(self, user_id: int) -> int:
-        bonus = random.randint(50, 200)
-        self.balances[user_id] += bonus
-        self.daily_bonuses[user_id] = datetime.now()
-        # Откладываем сохранение
+        return self.next_bonus_time(user_id) is None
+
+    async def claim_bonus(self, user_id: int) -> int:
+        """Проверка и начисление бонуса за один захват блокировки; 0 - бонус еще не доступен"""
+        async with self._locks[user_id]:
+            if self.store:
+                # Проверка по записи хранилища: бонус не выдадут дважды и два процесса
+                bonus = random.randint(50, 200)
+                now = time.time()
+                interval = self.BONUS_INTERVAL.total_seconds()
+
+                def claim(record):
+                    if record['last_bonus'] and now - record['last_bonus'] < interval:
+                        return None
+                    record['last_bonus'] = now
+                    return self._record_delta(record, bonus)
+                _, after = await self._store_modify(user_id, claim)
+                return bonus if after else 0
+            if not self.can_claim_bonus(user_id):
+                return 0
+            bonus = random.randint(50, 200)
+            self.balances[user_id] += bonus
+            now = datetime.now()
+            self.daily_bonuses[user_id] = now
+            self.bonus_schedule.schedule(user_id, (now + self.BONUS_INTERVAL).timestamp())
+            # Откладываем сохранение
+            asyncio.create_task(self._delayed_save())
+            return bonus
+
+    def claimable_bonus_count(self) -> int:
+        """Игроки, которым сейчас доступен бонус: все, кроме ожидающих в колесе таймеров"""
+        self.bonus_schedule.advance()
+        return max(0, len(self.balances) - self.bonus_schedule.pending_count)
+
+    def set_bonus_reminder(self, user_id: int, enabled: bool, via: str = None) -> None:
+        if user_id not in self.user_settings:
+            self.user_settings[user_id] = {'default_bet': 10}
+        self.user_settings[user_id]['bonus_reminder'] = enabled
+        if via is not None:
+            self.user_settings[user_id]['reminder_bot'] = via
+        if enabled:
+            self.bonus_reminders.add(user_id)
+        else:
+            self.bonus_reminders.discard(user_id)
         asyncio.create_task(self._delayed_save())
-        return bonus
 
 
-class SlotBot:
-    def __init__(self, token: str):
-        self.token = token
-        self.slot_machine = SlotMachine()
-        self.user_manager = UserManager()
-        self.app = Application.builder().token(token).build()
-        self._spin_queues = defaultdict(asyncio.Queue)
-        self._spin_locks = defaultdict(Lock)
-        self.slot_machine.jackpot = self.user_manager.get_jackpot()
+class TrackedUpdateProcessor(SimpleUpdateProcessor):
+    """Параллельная обработка обновлений с учетом ожидающих и активных обновлений"""
 
-        # ДОБАВЛЯЕМ ЗАЩИТУ ОТ ФЛУДА
-        self._last_spin_time = defaultdict(float)
-        self._min_spin_interval = 5  # Минимальный интервал между спинами в секундах
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.pending = 0  # Приняты в обработку (включая ожидающих семафор)
+        self.active = 0  # Обрабатываются прямо сейчас
 
-        # Включаем подробное логирование для отладки
-        logging.getLogger(__name__).setLevel(logging.INFO)
+    async def process_update(self, update, coroutine):
+        self.pending += 1
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self.pending -= 1
 
-        self.setup_handlers()
+    async def do_process_update(self, update, coroutine):
+        self.active += 1
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
 
-    def setup_handlers(self):
-        self.app.add_handler(CommandHandler("start", self.start))
-        self.app.add_handler(CommandHandler("spin", self.spin))
-        self.app.add_handler(CommandHandler("balance", self.balance))
-        self.app.add_handler(CommandHandler("bonus", self.bonus))
-        self.app.add_handler(CommandHandler("leaderboard", self.leaderboard))
-        self.app.add_handler(CommandHandler("help", self.help))
-        self.app.add_handler(CommandHandler("settings", self.settings))
-        self.app.add_handler(CommandHandler("setbet", self.setbet))  # ДОБАВЛЕНО
-
-        self.app.add_handler(CommandHandler("admin", self.admin_stats))
-        self.app.add_handler(CommandHandler("addbalance", self.add_balance))
-        self.app.add_handler(CommandHandler("users", self.list_users))
-        self.app.add_handler(CommandHandler("adminhelp", self.admin_help))
-        self.app.add_handler(CommandHandler("broadcast", self.broadcast_message))
 
-        # Add handlers for callback buttons and text messages (only once each)
-        self.app.add_handler(CallbackQueryHandler(self.button_handler, pattern="^(spin|bet_|settings|menu)$"))
-        self.app.add_handler(CallbackQueryHandler(self.broadcast_confirm_handler, pattern="^broadcast_"))
-        self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message))
+# Накопитель времени Bot API для текущего обработчика: [секунды, число вызовов]
+_api_timing: ContextVar = ContextVar('api_timing', default=None)
 
-    async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик текстовых сообщений для Reply-кнопок"""
-        text = update.message.text
-        user_id = update.effective_user.id
 
-        if text == "🎰 Крутить":
-            bet = self.user_manager.get_default_bet(user_id)
-            await self.process_spin_from_text(update, user_id, update.effective_user.first_name, bet)
+class LatencyHistogram:
+    """Гистограмма задержек в миллисекундах с фиксированными корзинами"""
 
-        elif text == "💰 Баланс":
-            await self.balance(update, context)
+    BOUNDS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
 
-        elif text == "🎁 Бонус":
-            await self.bonus(update, context)
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return float(self.BOUNDS[i]) if i < len(self.BOUNDS) else self.max
+        return self.max
+
+
+class HandlerMetrics:
+    """Задержки, ошибки и доля времени Bot API по обработчикам; выборочное профилирование медленных"""
+
+    def __init__(self, profile_slow_ms: float = None, profile_dir: str = "profiles",
+                 profile_sample_rate: float = 1.0):
+        self.handlers = defaultdict(lambda: {
+            'latency': LatencyHistogram(), 'errors': 0, 'api_time': 0.0, 'api_calls': 0, 'local_time': 0.0
+        })
+        # Вызовы Bot API по методам
+        self.api = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retry_after': 0, 'time': 0.0})
+
+        self.profile_slow_ms = profile_slow_ms  # None - профилирование выключено
+        self.profile_dir = profile_dir
+        self.profile_sample_rate = profile_sample_rate
+        self._profiling = False
+
+    async def measure(self, name: str, func, *args):
+        """Выполняет обработчик, записывая задержку, ошибки и время ожидания Bot API"""
+        timing = [0.0, 0]
+        token = _api_timing.set(timing)
+
+        profiler = None
+        if (self.profile_slow_ms is not None and not self._profiling
+                and random.random() < self.profile_sample_rate):
+            # cProfile глобален для потока: профиль охватывает всё, что цикл делал за время запроса
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            return await func(*args)
+        except Exception:
+            self.handlers[name]['errors'] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _api_timing.reset(token)
+
+            metrics = self.handlers[name]
+            metrics['latency'].observe(elapsed * 1000)
+            metrics['api_time'] += timing[0]
+            metrics['api_calls'] += timing[1]
+            metrics['local_time'] += max(0.0, elapsed - timing[0])
+
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                if elapsed * 1000 >= self.profile_slow_ms:
+                    self._dump_profile(profiler, name, elapsed)
+
+    def _dump_profile(self, profiler: cProfile.Profile, name: str, elapsed: float) -> None:
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(
+                self.profile_dir, f"{name}-{datetime.now():%Y%m%d-%H%M%S-%f}-{int(elapsed * 1000)}ms.prof"
+            )
+            profiler.dump_stats(path)
+            logging.warning(f"Медленный обработчик {name}: {elapsed * 1000:.0f} мс, профиль сохранен в {path}")
+        except Exception as e:
+            logging.error(f"Не удалось сохранить профиль {name}: {e}")
 
-        elif text == "⚙️ Ставка":  # ДОБАВЛЕНО
-            # Создаем временный контекст если его нет
-            temp_context = context if context is not None else ContextTypes.DEFAULT_TYPE()
-            await self.setbet(update, temp_context)
+    def record_api(self, api_method: str, elapsed: float, status: int = None) -> None:
+        api = self.api[api_method]
+        api['calls'] += 1
+        api['time'] += elapsed
+        if status is None or status >= 400:
+            api['errors'] += 1
+        if status == 429:
+            api['retry_after'] += 1
 
-        elif text == "🏆 Лидеры":
-            await self.leaderboard(update, context)
+        timing = _api_timing.get()
+        if timing is not None:
+            timing[0] += elapsed
+            timing[1] += 1
 
-        elif text == "❓ Помощь":
-            await self.help(update, context)
 
-    async def process_spin_from_text(self, update: Update, user_id: int, user_name: str, bet: int):
-        """Обработка спина из текстового сообщения"""
-        # ДОБАВИТЬ ЭТОТ КОД В НАЧАЛО МЕТОДА:
-        current_time = asyncio.get_event_loop().time()
-        time_since_last_spin = current_time - self._last_spin_time.get(user_id, 0)
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-клиент Bot API, замеряющий время и результат каждого вызова"""
 
-        # Проверяем флуд-контроль
-        if time_since_last_spin < self._min_spin_interval:
-            wait_time = int(self._min_spin_interval - time_since_last_spin)
-            await update.message.reply_text(
-                f"⏳ Слишком часто! Подождите {wait_time} секунд(-ы) перед следующим спином.")
-            return
+    def __init__(self, metrics: HandlerMetrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
 
-        if self._spin_locks[user_id].locked():
-            await update.message.reply_text("⏳ Ваш предыдущий спин еще выполняется! Подождите...")
-            return
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception:
+            self.metrics.record_api(api_method, time.perf_counter() - start)
+            raise
+        self.metrics.record_api(api_method, time.perf_counter() - start, code)
+        return code, payload
+
+
+def parse_balance_csv(data: bytes, known_users):
+    """Потоковый разбор CSV "user_id,amount": (номер строки, user_id, сумма, ошибка или None)"""
+    text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    seen = set()
+    for line_no, row in enumerate(csv.reader(text, dialect), 1):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if len(row) < 2:
+            yield line_no, None, None, "нужно два столбца: user_id,amount"
+            continue
+        try:
+            user_id, amount = int(row[0].strip()), int(row[1].strip())
+        except ValueError:
+            if line_no == 1:
+                continue  # Заголовок
+            yield line_no, None, None, f"не число: {row[0].strip()[:20]!r}, {row[1].strip()[:20]!r}"
+            continue
+        if user_id in seen:
+            yield line_no, user_id, amount, "повтор user_id в файле"
+        elif user_id not in known_users:
+            yield line_no, user_id, amount, "пользователь не найден"
+        else:
+            seen.add(user_id)
+            yield line_no, user_id, amount, None
+
+
+EXPORT_FIELDS = {
+    'users': ('user_id', 'name', 'balance', 'spins', 'total_bet', 'total_win',
+              'default_bet', 'turbo', 'bonus_reminder', 'last_bonus'),
+    'spins': ('user_id', 'number', 'time', 'bet', 'win', 'jackpot', 'grid'),
+}
+
+
+def export_rows(kind: str, user_manager, spin_history, user_ids):
+    """Строки выгрузки по одной: игроки или их последние спины"""
+    for user_id in user_ids:
+        if kind == 'spins':
+            for entry in reversed(spin_history.recent(user_id)):
+                yield {
+                    'user_id': user_id,
+                    'number': entry['number'],
+                    'time': datetime.fromtimestamp(entry['timestamp']).isoformat(),
+                    'bet': entry['bet'],
+                    'win': entry['win'],
+                    'jackpot': entry['jackpot'],
+                    'grid': "|".join("".join(reel[row] for reel in entry['reels']) for row in range(3)),
+                }
+            continue
+
+        # get(), а не [], чтобы выгрузка не создавала записи в defaultdict
+        stats = user_manager.stats.get(user_id) or {}
+        settings = user_manager.user_settings.get(user_id) or {}
+        last_bonus = user_manager.daily_bonuses.get(user_id)
+        yield {
+            'user_id': user_id,
+            'name': user_manager.user_names.get(user_id, ""),
+            'balance': user_manager.balances.get(user_id, 0),
+            'spins': stats.get('spins', 0),
+            'total_bet': stats.get('total_bet', 0),
+            'total_win': stats.get('total_win', 0),
+            'default_bet': settings.get('default_bet', 10),
+            'turbo': settings.get('turbo', False),
+            'bonus_reminder': settings.get('bonus_reminder', False),
+            'last_bonus': last_bonus.isoformat() if last_bonus else "",
+        }
 
-        async with self._spin_locks[user_id]:
-            # Обновляем время последнего спина
-            self._last_spin_time[user_id] = current_time
 
-            if not await self.user_manager.update_balance(user_id, -bet):
-                await update.message.reply_text("❌ Недостаточно средств на балансе!")
-                return
+def export_lines(rows, fields, fmt: str):
+    """CSV (с заголовком) или NDJSON построчно, без сборки всей выгрузки в памяти"""
+    if fmt == 'ndjson':
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    for row in rows:
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+    yield buffer.getvalue()
+
+
+def export_format(path: str) -> Tuple[str, bool]:
+    """Формат и сжатие по имени файла: .csv, .ndjson/.jsonl, + .gz"""
+    compressed = path.endswith('.gz')
+    base = path[:-3] if compressed else path
+    return ('ndjson' if base.endswith(('.ndjson', '.jsonl')) else 'csv'), compressed
+
+
+def estimate_size(container, sample: int = 100) -> int:
+    """Примерный размер контейнера в байтах: сам контейнер + средний размер первых sample элементов × их число.
+
+    Элементы меряются на уровень вглубь (словарь статистики, очередь, блокировка с атрибутами);
+    общие объекты вроде маленьких int считаются у каждого элемента, так что оценка - сверху.
+    """
+    def deep(obj) -> int:
+        size = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            size += sum(sys.getsizeof(item) for item in obj)
+        elif hasattr(obj, '__dict__'):
+            size += sys.getsizeof(obj.__dict__) + sum(sys.getsizeof(v) for v in obj.__dict__.values())
+        return size
+
+    total = sys.getsizeof(container)
+    if not container:
+        return total
+    if isinstance(container, dict):
+        picked = [deep(k) + deep(v) for k, v in itertools.islice(container.items(), sample)]
+    else:
+        picked = [deep(item) for item in itertools.islice(container, sample)]
+    per_item = sum(picked) / len(picked)
+    return int(total + per_item * len(container))
+
+
+def process_rss() -> int:
+    """Текущий RSS процесса в байтах (Linux); 0, если узнать нельзя"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} ГБ"
+
+
+def format_metric(name: str, kind: str, help_text: str, samples) -> List[str]:
+    """Метрика в текстовом формате Prometheus; samples - пары (метки, значение)"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if labels:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+        else:
+            lines.append(f"{name} {value}")
+    return lines
+
+
+class LoopMonitor:
+    """Задержка цикла событий и поиск виновника: что выполнялось, пока цикл стоял"""
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, history: int = 20):
+        self.interval = interval  # Период контрольного sleep
+        self.threshold = threshold  # Задержка, начиная с которой фиксируем зависание
+        self.lag = 0.0
+        self.lag_max = 0.0
+        self.stall_count = 0
+        self.stalls = deque(maxlen=history)  # Последние зависания: время, длительность, виновник, стек
+
+        self._last_tick = time.monotonic()
+        self._captured = None  # Стек, снятый сторожевым потоком во время текущего зависания
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self._last_tick = time.monotonic()
+            self.lag = max(0.0, loop.time() - start - self.interval)
+            self.lag_max = max(self.lag_max, self.lag)
+            if self.lag >= self.threshold:
+                self._record_stall(self.lag)
+
+    def _watch(self):
+        """Сторожевой поток: если цикл не отвечает, снимаем стек его потока"""
+        while not self._stop.wait(self.threshold / 2):
+            stalled_for = time.monotonic() - self._last_tick - self.interval
+            if self._captured is None and stalled_for >= self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._captured = traceback.extract_stack(frame)
+
+    def _record_stall(self, lag: float) -> None:
+        stack, self._captured = self._captured, None
+        culprit = self._culprit(stack) if stack else "неизвестно (зависание короче периода сторожа)"
+        frames = [f"{os.path.basename(f.filename)}:{f.name}:{f.lineno}" for f in stack[-6:]] if stack else []
+
+        self.stall_count += 1
+        self.stalls.append({'at': datetime.now(), 'lag': lag, 'culprit': culprit, 'stack': frames})
+        logging.warning("Цикл событий завис на %.0f мс в %s; стек: %s", lag * 1000, culprit,
+                        " <- ".join(reversed(frames)), extra={'category': 'loop'})
+
+    @staticmethod
+    def _culprit(stack) -> str:
+        """Самый глубокий кадр кода бота, иначе самый глубокий кадр вообще"""
+        for frame in reversed(stack):
+            if frame.filename == __file__:
+                return f"{frame.name} (строка {frame.lineno})"
+        return f"{stack[-1].name} ({os.path.basename(stack[-1].filename)})"
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер, отдающий метрики бота в формате Prometheus на /metrics"""
+
+    def __init__(self, render, host: str = "127.0.0.1", port: int = 9108):
+        self.render = render
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logging.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запроса не нужны, просто дочитываем их
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split('?')[0] in ("/", "/metrics"):
+                status, body = "200 OK", self.render().encode('utf-8')
+            else:
+                status, body = "404 Not Found", b"not found\n"
 
-            asyncio.create_task(
-                self.process_spin_animation(update, user_id, user_name, bet)
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
             )
+            await writer.drain()
+        except Exception as e:
+            logging.debug(f"Ошибка запроса метрик: {e}")
+        finally:
+            writer.close()
+
+
+class UpdateRecorder:
+    """Запись входящих обновлений в gzip-файл (строка JSON на обновление) с обезличиванием"""
+
+    # Поля пользователя/чата, которые не нужны для воспроизведения
+    PRIVATE_FIELDS = ('last_name', 'username', 'language_code', 'title', 'bio', 'phone_number', 'photo')
+    # Служебные флаги сообщения, почти всегда False
+    DEFAULT_FLAGS = ('channel_chat_created', 'delete_chat_photo', 'group_chat_created', 'supergroup_chat_created')
+
+    def __init__(self, path: str, allowed_texts=()):
+        self.path = path
+        self.allowed_texts = set(allowed_texts)  # Тексты Reply-кнопок сохраняются как есть
+        self.count = 0
+        # Соль не сохраняется: псевдонимы стабильны в пределах записи, но необратимы
+        self._salt = os.urandom(16)
+        self._start = time.monotonic()
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+
+    async def record(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        entry = {'t': round(time.monotonic() - self._start, 3), 'u': self.anonymize(update.to_dict())}
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n")
+        self.count += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+    def pseudonym(self, value: int) -> int:
+        digest = hmac.new(self._salt, str(value).encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:5], 'big')
+
+    def anonymize(self, data):
+        """Замена ID и имен на псевдонимы, удаление произвольного текста"""
+        if isinstance(data, list):
+            return [self.anonymize(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+
+        result = {}
+        for key, value in data.items():
+            if key in self.PRIVATE_FIELDS or key in ('caption', 'caption_entities', 'contact', 'location'):
+                continue
+            if value is False and key in self.DEFAULT_FLAGS:
+                continue  # Флаги по умолчанию только раздувают запись
+            if key == 'chat_instance':
+                result[key] = str(self.pseudonym(value))
+                continue
+            if key in ('from', 'chat', 'user', 'sender_chat') and isinstance(value, dict):
+                value = dict(value)
+                pseudo_id = self.pseudonym(value['id'])
+                value['id'] = pseudo_id
+                if 'first_name' in value:
+                    value['first_name'] = f"User{pseudo_id % 100000}"
+                result[key] = self.anonymize(value)
+            elif key == 'text' and isinstance(value, str):
+                result[key] = self._anonymize_text(value)
+                if result[key] != value:
+                    result.pop('entities', None)
+            elif key == 'entities' and 'text' in result and result['text'] != data.get('text'):
+                continue
+            else:
+                result[key] = self.anonymize(value)
+        return result
+
+    def _anonymize_text(self, text: str) -> str:
+        if text in self.allowed_texts:
+            return text
+        if text.startswith('/'):
+            # Команды сохраняем, из аргументов - только числа (ставки, количество спинов)
+            command, *args = text.split()
+            return " ".join([command] + [arg for arg in args if arg.lstrip('-').isdigit()])
+        return "<text>"
+
+
+class RateLimiter:
+    """Ограничение частоты запросов: token bucket на пару (пользователь, команда)"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]], default: Tuple[float, int] = (0.5, 5),
+                 max_entries: int = 100000):
+        self.limits = limits  # команда -> (токенов в секунду, емкость с учетом всплеска)
+        self.default = default
+        self.max_entries = max_entries
+        self.clock = time.monotonic  # Подменяется при воспроизведении записей с ускорением
+        # (user_id, команда) -> [токены, время последнего пополнения, предупрежден ли]
+        self._buckets: OrderedDict = OrderedDict()
+        self.allowed = 0
+        self.throttled = defaultdict(int)
+
+    def allow(self, user_id: int, command: str) -> Tuple[bool, bool]:
+        """(разрешено, нужно ли предупредить) - предупреждаем один раз за серию отказов"""
+        rate, capacity = self.limits.get(command, self.default)
+        key = (user_id, command)
+        now = self.clock()
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [capacity, now, False]
+            self._buckets[key] = bucket
+            # Память ограничена: вытесняем давно не использованные корзины (они уже полные)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            self.allowed += 1
+            return True, False
+
+        self.throttled[command] += 1
+        notify = not bucket[2]
+        bucket[2] = True
+        return False, notify
+
+    def get_metrics(self) -> Dict:
+        return {
+            'allowed': self.allowed,
+            'throttled': dict(self.throttled),
+            'buckets': len(self._buckets),
+        }
 
-    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        user_name = update.effective_user.first_name
 
-        welcome_text = f"""
-    🎰 *ДОБРО ПОЖАЛОВАТЬ В СЛОТ-МАШИНУ, {user_name}!* 🎰
+class OutboundRateLimiter(BaseRateLimiter):
+    """Исходящие вызовы Bot API: общий лимит процесса и лимит на чат каждого бота (GCRA)"""
+
+    # Методы, которые отправляют или меняют сообщения и попадают под лимиты Telegram
+    LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+
+    def __init__(self, overall_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: int = 3,
+                 max_retries: int = 2, max_chats: int = 100000):
+        self.overall_interval = 1 / overall_rate
+        self.chat_interval = 1 / chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries  # Повторы отправки после 429; правки сообщений не повторяются
+        self.max_chats = max_chats
+        self.scope = None  # Имя бота в представлении for_tenant
+        self.clock = time.monotonic
+        # Теоретическое время следующего вызова: общее (список - общий для представлений) и по (бот, чат)
+        self._overall_tat = [0.0]
+        self._tat: OrderedDict = OrderedDict()
+        self.stats = defaultdict(int)  # delayed, retried, wait_ms - общие для всех ботов
+
+    def for_tenant(self, name: str) -> 'OutboundRateLimiter':
+        """Представление для одного бота: общий лимит и счетчики те же, лимиты чатов - свои"""
+        view = copy.copy(self)
+        view.scope = name
+        return view
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def reserve(self, chat_id) -> float:
+        """Занимает ближайший слот чата и общий слот; возвращает, сколько до них ждать"""
+        now = self.clock()
+        wait = 0.0
+        if chat_id is not None:
+            key = (self.scope, chat_id)
+            tat = max(self._tat.get(key, now), now)
+            self._tat[key] = tat + self.chat_interval
+            self._tat.move_to_end(key)
+            wait = max(0.0, tat - (self.chat_burst - 1) * self.chat_interval - now)
+            # Давно не писавшие чаты уже свободны: их записи можно вытеснить
+            if len(self._tat) > self.max_chats:
+                self._tat.popitem(last=False)
+        # Общий слот - не раньше, чем освободится чат
+        start = now + wait
+        tat = max(self._overall_tat[0], start)
+        self._overall_tat[0] = tat + self.overall_interval
+        return tat - now
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(self.LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get('chat_id')
+        wait = self.reserve(chat_id)
+        if wait > 0:
+            self.stats['delayed'] += 1
+            self.stats['wait_ms'] += int(wait * 1000)
+            await asyncio.sleep(wait)
+
+        retries = self.max_retries if endpoint.startswith('send') else 0
+        for attempt in range(retries + 1):
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == retries:
+                    raise
+                self.stats['retried'] += 1
+                delay = float(e.retry_after)
+                if chat_id is not None:
+                    # Следующие сообщения в этот чат тоже ждут окончания флуд-контроля
+                    key = (self.scope, chat_id)
+                    self._tat[key] = max(self._tat.get(key, 0.0), self.clock() + delay)
+                await asyncio.sleep(delay)
+
+    def get_metrics(self) -> Dict:
+        return {
+            'delayed': self.stats['delayed'],
+            'retried': self.stats['retried'],
+            'wait_ms': self.stats['wait_ms'],
+            'chats': len(self._tat),
+        }
+
+
+async def run_to_completion(coro):
+    """Ожидание корутины, которую отмена вызывающей задачи не прерывает: сначала она
+    доходит до конца, затем отмена идет дальше"""
+    task = asyncio.ensure_future(coro)
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await task
+        raise
+
+
+class SpinAdmission:
+    """Глобальный контроль одновременно выполняемых спинов с анимацией"""
+
+    def __init__(self, max_inflight: int = 500, degrade_at: int = 200):
+        self.max_inflight = max_inflight  # Выше этого новые спины отклоняются
+        self.degrade_at = degrade_at  # Выше этого спины идут без анимации, одним сообщением
+        self.inflight = 0
+        self.admitted = 0
+        self.degraded = 0
+        self.rejected = 0
+        self._tasks = set()
+
+    def acquire(self) -> str:
+        """Режим для нового спина: 'full', 'degraded' или 'rejected'"""
+        if self.inflight >= self.max_inflight:
+            self.rejected += 1
+            return 'rejected'
+        self.inflight += 1
+        self.admitted += 1
+        if self.inflight > self.degrade_at:
+            self.degraded += 1
+            return 'degraded'
+        return 'full'
+
+    def release(self) -> None:
+        self.inflight -= 1
+
+    def spawn(self, coro) -> asyncio.Task:
+        """Запуск задачи со ссылкой на нее, чтобы ее можно было дождаться при остановке"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def drain(self, timeout: float = 10) -> None:
+        """Ожидает завершения задач, оставшиеся после таймаута отменяет"""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            # Отмененные спины возвращают ставку или доводят расчет до конца - ждем их
+            await asyncio.wait(pending, timeout=timeout)
+        logging.info(f"Спины при остановке: завершено {len(done)}, отменено {len(pending)}")
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {
+            'inflight': self.inflight,
+            'tasks': len(self._tasks),
+            'admitted': self.admitted,
+            'degraded': self.degraded,
+            'rejected': self.rejected,
+        }
+
+
+class MessageRenderer:
+    """Готовые тексты, клавиатуры и строки барабанов, которые не нужно собирать на каждый спин"""
+
+    PLACEHOLDER = '⚫'
+    BETS = (1, 5, 10, 25, 50, 100, 500)
+    SPIN_FRAME_HEADER = "🎰 *ВРАЩЕНИЕ БАРАБАНОВ...*\n\n"
+
+    # Приветствие разбито по местам подстановки: имя игрока и баланс
+    START_PARTS = (
+        """
+    🎰 *ДОБРО ПОЖАЛОВАТЬ В СЛОТ-МАШИНУ, """,
+        """!* 🎰
 
     *🌟 ЧТО НОВОГО В ЭТОЙ ВЕРСИИ:*
     • 🎯 *5 барабанов* с реалистичной анимацией
@@ -397,7 +2387,8 @@ class SlotBot:
     3. Собирайте комбинации из 3+ одинаковых символов
     4. Получайте *ежедневный бонус* каждый 24 часа
 
-    *💰 ВАШ ТЕКУЩИЙ БАЛАНС:* {await self.user_manager.get_balance(user_id):,} кредитов
+    *💰 ВАШ ТЕКУЩИЙ БАЛАНС:* """,
+        """ кредитов
 
     *📋 ДОСТУПНЫЕ КОМАНДЫ:*
     /spin - 🎡 Вращение слотов (можно указать ставку)
@@ -410,46 +2401,515 @@ class SlotBot:
 
     *🎊 УДАЧИ В ИГРЕ!* 🍀
     *Пусть барабаны принесут вам большой выигрыш!* 💫
+        """,
+    )
+
+    HELP_TEXT = """
+    🎰 *ПОМОЩЬ ПО ИГРЕ СЛОТ-МАШИНА* 🎰
+
+    *🏠 ОСНОВНЫЕ КОМАНДЫ:*
+    /spin [ставка] - 🎡 Запуск слотов (по умолчанию используется ваша базовая ставка)
+    /setbet <ставка> - 🎯 Изменение базовой ставки
+    /balance - 💰 Показать баланс и статистику
+    /bonus - 🎁 Получить ежедневный бонус (50-200 кредитов)
+    /leaderboard - 🏆 Таблица лидеров по балансу
+    /settings - ⚙️ Настройка базовой ставки
+    /turbo - ⚡ Турбо-режим: спины без анимации
+    /autospin <N> [ставка] - 🔁 Серия из N спинов (до 100) с одним итогом
+    /history [N] - 📜 Последние спины (до 20)
+    /remind - 🔔 Напоминание о ежедневном бонусе
+
+    *🎯 УПРАВЛЕНИЕ ЧЕРЕЗ КНОПКИ:*
+    • «🎰 Крутить» - быстрый спин с базовой ставкой
+    • «💰 Баланс» - посмотреть свой баланс
+    • «🎁 Бонус» - получить ежедневный бонус
+    • «🏆 Лидеры» - таблица лидеров
+    • «❓ Помощь» - эта справка
+
+    *🎮 ПРАВИЛА ИГРЫ:*
+    • *5 барабанов, 5 линий выплат* (3 горизонтальные + 2 диагональные)
+    • Выигрышные комбинации от 3+ одинаковых символов подряд
+    • Символ 💰 дает самый большой выигрыш и джекпот!
+    • *Прогрессивный джекпот* растет с каждой игрой
+
+    *🎮 ДОСТУПНЫЕ СТАВКИ:*
+    1, 5, 10, 25, 50, 100 кредитов
+
+    *💰 СИМВОЛЫ И ВЫПЛАТЫ (умножаются на вашу ставку):*
+    🍒 3x=×2, 4x=×5, 5x=×10
+    🍋 3x=×3, 4x=×8, 5x=×15  
+    🍊 3x=×4, 4x=×10, 5x=×20
+    🍇 3x=×5, 4x=×15, 5x=×30
+    🍌 3x=×8, 4x=×20, 5x=×50
+    ⭐ 3x=×10, 4x=×25, 5x=×75
+    💎 3x=×15, 4x=×40, 5x=×100
+    7️⃣ 3x=×20, 4x=×50, 5x=×150
+    💰 3x=×50, 4x=×200, 5x=×1000 + *ДЖЕКПОТ!*
+
+    *🎊 ОСОБЫЕ ВОЗМОЖНОСТИ:*
+    • *Ежедневный бонус* - каждый 24 часа
+    • *Настройка ставки* - установите удобную базовую ставку
+    • *Анимации* - специальные эффекты для больших выигрышей
+    • *Статистика* - отслеживайте свою игровую активность
+
+    *💡 СОВЕТЫ:*
+    • Используйте /setbet для удобной настройки ставок
+    • Начните с небольших ставок для знакомства с игрой
+    • Используйте /settings для удобной настройки ставок
+    • Не забывайте забирать ежедневный бонус!
+    • Следите за прогрессивным джекпотом
+
+    *Удачи в игре! 🍀*
         """
 
-        keyboard = self.get_main_keyboard()
-        await update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=keyboard)
+    ADMIN_HELP_TEXT = """
+    🔧 *АДМИНИСТРАТИВНЫЕ КОМАНДЫ*
 
-    def get_main_keyboard(self):
-        """Создает основную клавиатуру с кнопками"""
-        keyboard = [
+    *Статистика и мониторинг:*
+    /admin - 📊 Общая статистика бота
+    /perf - ⏱ Задержки обработчиков и Bot API
+    /memstats [trace|diff N|stop] - 🧠 Память по структурам, задачи, tracemalloc
+    /users - 👥 Список игроков (ID, имя, прокруты)
+    /userhistory <user_id> [N] - 📜 Последние спины игрока с полями и временем
+    /finduser <имя или ID> - 🔍 Поиск игрока по началу имени
+    /leaderboard - 🏆 Таблица лидеров
+
+    *Управление балансами:*
+    /addbalance - 💰 Управление балансом пользователя
+
+    *Нагрузка:*
+    /forceturbo on|off - ⚡ Турбо-режим для всех игроков
+
+    *Массовые операции:*
+    /bulkbalance [dry] - 📄 Балансы из CSV `user_id,amount` (подпись к файлу)
+    /export [users|spins] [csv|ndjson] [gz] - 📦 Выгрузка игроков или истории спинов
+
+    *Использование /addbalance:*
+    `/addbalance <user_id> <amount>`
+
+    *Рассылка сообщений:*
+    `/broadcast - 📢 Отправка сообщения всем пользователям`
+
+    *Использование /broadcast:*
+    `/broadcast <текст сообщения>`
+
+    *Примеры:*
+    • `/addbalance 123456789 1000` - добавить 1000 кредитов
+    • `/addbalance 123456789 -500` - списать 500 кредитов  
+    • `/addbalance 123456789 0` - обнулить баланс
+
+    *Параметры:*
+    • `user_id` - ID пользователя в Telegram
+    • `amount` - сумма (положительная - пополнение, отрицательная - списание, 0 - обнуление)
+
+    *Примечания:*
+    • Все изменения баланса логируются
+    • Проверяйте ID пользователя через /users
+    • При списании проверяется достаточность средств
+    • Джекпот автоматически растет с каждой игрой
+        """
+
+    def __init__(self):
+        # Объекты PTB неизменяемы после создания, поэтому их можно отдавать многим сообщениям
+        self.main_keyboard = ReplyKeyboardMarkup([
             [KeyboardButton("🎰 Крутить"), KeyboardButton("💰 Баланс")],
             [KeyboardButton("🎁 Бонус"), KeyboardButton("⚙️ Ставка")],
             [KeyboardButton("🏆 Лидеры"), KeyboardButton("❓ Помощь")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def get_spin_keyboard(self, user_id: int):
-        """Создает инлайн клавиатуру для спинов"""
-        current_bet = self.user_manager.get_default_bet(user_id)
-        keyboard = [
+        ], resize_keyboard=True)
+        # Кэши на экземпляре, а не на классе: иначе lru_cache держал бы ссылку на self
+        self.spin_keyboard = lru_cache(maxsize=256)(self._build_spin_keyboard)
+        self.settings_keyboard = lru_cache(maxsize=256)(self._build_settings_keyboard)
+        self.row = lru_cache(maxsize=8192)(self._build_row)
+
+    def start_text(self, user_name: str, balance: int) -> str:
+        head, middle, tail = self.START_PARTS
+        return f"{head}{user_name}{middle}{balance:,}{tail}"
+
+    @staticmethod
+    def _build_spin_keyboard(bet: int) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([
             [
                 InlineKeyboardButton("🎰 Крутить снова", callback_data="spin"),
+                InlineKeyboardButton("🔁 Авто ×10", callback_data="autospin_10"),
             ],
             [
-                InlineKeyboardButton(f"Ставка: {current_bet} 💰", callback_data="current_bet"),
+                InlineKeyboardButton(f"Ставка: {bet} 💰", callback_data="current_bet"),
                 InlineKeyboardButton("🏠 Меню", callback_data="menu")
             ]
+        ])
+
+    def _build_settings_keyboard(self, bet: int, turbo: bool) -> InlineKeyboardMarkup:
+        bet_buttons = [
+            InlineKeyboardButton(f"✅ {value}" if value == bet else str(value), callback_data=f"bet_{value}")
+            for value in self.BETS
         ]
-        return InlineKeyboardMarkup(keyboard)
+        turbo_label = "⚡ Турбо: вкл" if turbo else "⚡ Турбо: выкл"
+        return InlineKeyboardMarkup([
+            bet_buttons[:4],
+            bet_buttons[4:],
+            [InlineKeyboardButton(turbo_label, callback_data="turbo")],
+            [InlineKeyboardButton("🎰 Крутить", callback_data="spin")]
+        ])
+
+    @staticmethod
+    def _build_row(cells: Tuple[str, ...]) -> str:
+        return " ".join(cells)
+
+    def reels(self, reels: List[List[str]]) -> str:
+        """Три строки барабанов; строки берутся из кэша"""
+        row = self.row
+        return "\n".join([row(tuple([reel[i] for reel in reels])) for i in range(3)])
+
+    def spin_frames(self, reels: List[List[str]]) -> List[str]:
+        """Кадры анимации: барабаны открываются по одному слева направо"""
+        row = self.row
+        rows = [tuple([reel[i] for reel in reels]) for i in range(3)]
+        frames = []
+        for shown in range(1, len(reels) + 1):
+            hidden = (self.PLACEHOLDER,) * (len(reels) - shown)
+            frames.append(self.SPIN_FRAME_HEADER + "\n".join([row(cells[:shown] + hidden) for cells in rows]))
+        return frames
+
+    def cache_info(self) -> Dict[str, tuple]:
+        return {
+            'spin_keyboard': self.spin_keyboard.cache_info(),
+            'settings_keyboard': self.settings_keyboard.cache_info(),
+            'row': self.row.cache_info(),
+        }
+
+
+class SlotBot:
+    def __init__(self, token: str, concurrent_updates: int = 1, base_url: str = None,
+                 profile_slow_ms: float = None, profile_dir: str = "profiles",
+                 metrics_port: int = None, metrics_host: str = "127.0.0.1",
+                 data_file: str = "user_data.json", record_file: str = None,
+                 tenant: str = None, wallet: 'SlotBot' = None, slot_machine: SlotMachine = None,
+                 rate_limiter: BaseRateLimiter = None, store_file: str = None, engine: str = "reels",
+                 machine_config: dict = None):
+        """wallet - бот, с которым делятся игроки (балансы, история, напоминания);
+        slot_machine - общий с другими ботами движок и джекпот (multibot.py);
+        machine_config - веса и выплаты вместо встроенных (rtp_solver.py)"""
+        self.token = token
+        self.tenant = tenant
+        if slot_machine is not None:
+            self.slot_machine = slot_machine
+        elif engine == "table":
+            # Таблицы классов строятся один раз и кэшируются рядом с данными
+            self.slot_machine = TableSlotMachine(os.path.join(os.path.dirname(data_file), "engine_tables.json"),
+                                                 machine_config)
+        else:
+            self.slot_machine = SlotMachine(machine_config)
+        self.renderer = MessageRenderer()
+        if wallet is not None:
+            self.user_manager = wallet.user_manager
+            self.history_file, self.spin_history = wallet.history_file, wallet.spin_history
+            self.histogram_file, self.win_histogram = wallet.histogram_file, wallet.win_histogram
+            # Боты одного кошелька: через кого из них слать напоминание игроку
+            self.peers = wallet.peers
+        else:
+            # store_file - SQLite, общий с другими процессами (резервный бот, параллельные воркеры)
+            self.user_manager = UserManager(data_file, store=SqliteStore(store_file) if store_file else None)
+            # История последних спинов для /history и разбора спорных ситуаций
+            self.history_file = os.path.splitext(data_file)[0] + "_history.bin"
+            self.spin_history = SpinHistory(self.slot_machine.symbols)
+            self.spin_history.load(self.history_file)
+            # Распределение выигрышей по игрокам для /balance и проверок волатильности
+            self.histogram_file = os.path.splitext(data_file)[0] + "_histograms.json"
+            self.win_histogram = WinHistogram(self.slot_machine.symbols)
+            self.win_histogram.load(self.histogram_file)
+            self.peers: Dict[str, 'SlotBot'] = {}
+        self.wallet_owner = wallet is None
+        self.peers[tenant] = self
+        self.metrics = HandlerMetrics(profile_slow_ms=profile_slow_ms, profile_dir=profile_dir)
+
+        # Обновления разных пользователей обрабатываются параллельно,
+        # порядок спинов одного пользователя по-прежнему держит _spin_locks
+        self.update_processor = TrackedUpdateProcessor(concurrent_updates)
+        builder = (Application.builder().token(token)
+                   .concurrent_updates(self.update_processor)
+                   .request(InstrumentedRequest(self.metrics, connection_pool_size=256))
+                   .post_init(self._on_start)
+                   .post_stop(self._on_stop))
+        # Общий для ботов процесса лимит исходящих вызовов (OutboundRateLimiter)
+        self.outbound = rate_limiter
+        if rate_limiter:
+            builder = builder.rate_limiter(rate_limiter)
+        if base_url:
+            # Например, локальный тестовый сервер: http://127.0.0.1:8081/bot
+            builder = builder.base_url(base_url).base_file_url(base_url.rsplit('/bot', 1)[0] + '/file/bot')
+        self.app = builder.build()
+        # Очередь спинов игрока: лишние нажатия ждут своей очереди, а не получают отказ.
+        # Размер - емкость лимита 'spin' (задается ниже): весь разрешенный всплеск помещается в очередь
+        self._spin_queues = defaultdict(lambda: asyncio.Queue(maxsize=self._spin_queue_size))
+        self._spin_consumers: Dict[int, asyncio.Task] = {}
+        # Сообщения, спин с кнопки которых уже ждет в очереди: (chat_id, message_id)
+        self._queued_messages = set()
+        self._spin_locks = defaultdict(Lock)
+        self.admission = SpinAdmission()
+
+        # Метрики для Prometheus и контроль задержки цикла событий
+        self.metrics_server = MetricsServer(self.render_metrics, metrics_host, metrics_port) if metrics_port else None
+        self.loop_monitor = LoopMonitor()
+
+        # Запись входящих обновлений для последующего воспроизведения (replay.py)
+        self.recorder = UpdateRecorder(record_file, allowed_texts=self._text_commands) if record_file else None
+
+        # Напоминания о бонусе: проверка раз в 30 с, до 20 сообщений в секунду
+        self._reminder_interval = 30
+        self._reminder_batch = 20
+        self._reminder_task = None
+        self.reminders_sent = 0
+        # Изменения других процессов в общем хранилище подтягиваются раз в 2 с
+        self._store_sync_interval = 2
+        self._store_sync_task = None
+
+        self._bulk_max_bytes = 5 * 1024 * 1024  # Предел размера CSV для /bulkbalance
+        self._finduser_limit = 20
+        self._memstats_top = 10  # Строк в разнице снимков tracemalloc по умолчанию
+        self._trace_snapshot = None
+        self._export_chunk = 1000  # Строк выгрузки между передачами управления циклу событий
+        self._export_max_bytes = 50 * 1024 * 1024  # Предел Bot API на отправку файла
+
+        # Лимиты команд: (токенов в секунду, емкость). Дорогие команды - строже
+        self.rate_limiter = RateLimiter({
+            'spin': (0.5, 5),
+            'callback': (1.0, 5),
+            'leaderboard': (0.1, 2),
+            'users': (0.1, 2),
+            'admin': (0.1, 2),
+            'broadcast': (0.05, 1),
+            'start': (0.2, 3),
+            'help': (0.2, 3),
+            'history': (0.2, 3),
+        })
+        self._spin_queue_size = self.rate_limiter.limits['spin'][1]
+        if slot_machine is None:
+            self.slot_machine.jackpot = self.user_manager.get_jackpot()
+
+        # Турбо-режим для всех игроков (включается администратором под нагрузкой)
+        self._force_turbo = False
+
+        # Автоспин: максимум спинов за раз и правила остановки
+        self._max_autospin = 100
+        self._autospin_big_win = 10  # Остановка при выигрыше от ставки × 10 или джекпоте
+
+        self.setup_handlers()
+
+    def setup_handlers(self):
+        if self.recorder:
+            # Группа -1 выполняется раньше остальных и не мешает им
+            self.app.add_handler(TypeHandler(Update, self.recorder.record), group=-1)
+
+        handler = self.handler
+        self.app.add_handler(CommandHandler("start", handler("start", self.start)))
+        self.app.add_handler(CommandHandler("spin", handler("spin", self.spin)))
+        self.app.add_handler(CommandHandler("balance", handler("balance", self.balance)))
+        self.app.add_handler(CommandHandler("bonus", handler("bonus", self.bonus)))
+        self.app.add_handler(CommandHandler("leaderboard", handler("leaderboard", self.leaderboard)))
+        self.app.add_handler(CommandHandler("help", handler("help", self.help)))
+        self.app.add_handler(CommandHandler("settings", handler("settings", self.settings)))
+        self.app.add_handler(CommandHandler("setbet", handler("setbet", self.setbet)))  # ДОБАВЛЕНО
+        self.app.add_handler(CommandHandler("turbo", handler("turbo", self.turbo)))
+        self.app.add_handler(CommandHandler("remind", handler("remind", self.remind)))
+        self.app.add_handler(CommandHandler("autospin", handler("spin", self.autospin)))
+        self.app.add_handler(CommandHandler("history", handler("history", self.history)))
+
+        self.app.add_handler(CommandHandler("admin", handler("admin", self.admin_stats)))
+        self.app.add_handler(CommandHandler("addbalance", handler("addbalance", self.add_balance)))
+        self.app.add_handler(CommandHandler("users", handler("users", self.list_users)))
+        self.app.add_handler(CommandHandler("bulkbalance", handler("admin", self.bulk_balance)))
+        self.app.add_handler(CommandHandler("export", handler("admin", self.export_data)))
+        self.app.add_handler(CommandHandler("finduser", handler("users", self.find_user)))
+        self.app.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r'^/bulkbalance\b'),
+                                            handler("admin", self.bulk_balance)))
+        self.app.add_handler(CommandHandler("adminhelp", handler("help", self.admin_help)))
+        self.app.add_handler(CommandHandler("broadcast", handler("broadcast", self.broadcast_message)))
+        self.app.add_handler(CommandHandler("forceturbo", handler("forceturbo", self.force_turbo)))
+        self.app.add_handler(CommandHandler("perf", handler("admin", self.perf_stats)))
+        self.app.add_handler(CommandHandler("memstats", handler("admin", self.mem_stats)))
+        self.app.add_handler(CommandHandler("userhistory", handler("admin", self.user_history)))
+
+        # Add handlers for callback buttons and text messages (only once each)
+        self.app.add_handler(CallbackQueryHandler(handler(self._callback_command, self.button_handler),
+                                                  pattern=r"^(spin|bet_\d+|autospin_\d+|settings|menu|current_bet|turbo)$"))
+        self.app.add_handler(CallbackQueryHandler(handler("leaderboard", self.ranking_page_handler),
+                                                  pattern=r"^(lb|us)([<>]-?\d+:\d+|@)$"))
+        self.app.add_handler(CallbackQueryHandler(handler("callback", self.broadcast_confirm_handler),
+                                                  pattern="^broadcast_"))
+        self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND,
+                                            handler(self._text_command, self.handle_text_message)))
+
+    # Reply-кнопки расходуют лимит соответствующей команды
+    _text_commands = {
+        "🎰 Крутить": "spin",
+        "💰 Баланс": "balance",
+        "🎁 Бонус": "bonus",
+        "⚙️ Ставка": "setbet",
+        "🏆 Лидеры": "leaderboard",
+        "❓ Помощь": "help",
+    }
+
+    def _text_command(self, update: Update) -> str:
+        return self._text_commands.get(update.message.text, "text")
+
+    def _callback_command(self, update: Update) -> str:
+        data = update.callback_query.data
+        return "spin" if data == "spin" or data.startswith("autospin_") else "callback"
+
+    def handler(self, command, callback):
+        """Обработчик с лимитом частоты и замером задержки"""
+        limited = self.limited(command, callback)
+
+        @wraps(callback)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            return await self.metrics.measure(callback.__name__, limited, update, context)
+        return wrapper
+
+    def limited(self, command, callback):
+        """Оборачивает обработчик проверкой лимита частоты (command - имя или функция от update)"""
+        @wraps(callback)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            key = command(update) if callable(command) else command
+            allowed, notify = self.rate_limiter.allow(update.effective_user.id, key)
+            if allowed:
+                return await callback(update, context)
+
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Слишком часто! Подождите немного.")
+            elif notify and update.message:
+                await update.message.reply_text("⏳ Слишком часто! Подождите немного.")
+        return wrapper
+
+    async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик текстовых сообщений для Reply-кнопок"""
+        text = update.message.text
+        user_id = update.effective_user.id
+
+        if text == "🎰 Крутить":
+            bet = self.user_manager.get_default_bet(user_id)
+            await self.process_spin_from_text(update, user_id, update.effective_user.first_name, bet)
+
+        elif text == "💰 Баланс":
+            await self.balance(update, context)
+
+        elif text == "🎁 Бонус":
+            await self.bonus(update, context)
+
+        elif text == "⚙️ Ставка":  # ДОБАВЛЕНО
+            # Создаем временный контекст если его нет
+            temp_context = context if context is not None else ContextTypes.DEFAULT_TYPE()
+            await self.setbet(update, temp_context)
+
+        elif text == "🏆 Лидеры":
+            await self.leaderboard(update, context)
+
+        elif text == "❓ Помощь":
+            await self.help(update, context)
+
+    async def process_spin_from_text(self, update: Update, user_id: int, user_name: str, bet: int):
+        """Обработка спина из текстового сообщения"""
+        async def run(mode: str):
+            await self.process_spin_animation(update, user_id, user_name, bet, turbo=mode == 'degraded')
+
+        if not self._enqueue_spin_job(user_id, update.message.reply_text, run, bet=bet):
+            await update.message.reply_text("⏳ Очередь спинов заполнена, дождитесь результата предыдущих.")
+
+    def _enqueue_spin_job(self, user_id: int, reply, run, bet: int = None, edit=None, message_key=None) -> bool:
+        """Ставит спин в очередь с общими ответами: перегрузка, занятое хранилище, нехватка средств.
+
+        reply - ответ новым сообщением, edit - правка сообщения со спином (по умолчанию reply),
+        run(mode) - сам спин после допуска. С bet ставка списывается до run, автоспин списывает сам.
+        message_key - сообщение, спин с которого ждет в очереди (см. process_spin_from_button)"""
+        async def job(mode: str):
+            if message_key:
+                self._queued_messages.discard(message_key)
+            if mode == 'rejected':
+                await reply("⏳ Сейчас слишком много спинов, попробуйте чуть позже.")
+                return
+            try:
+                if bet is not None and not await self.place_bet(user_id, bet):
+                    await (edit or reply)("❌ Недостаточно средств на балансе!")
+                    return
+                await run(mode)
+            except StoreBusyError:
+                await reply("⏳ Хранилище занято, попробуйте еще раз через пару секунд.")
+
+        if not self.enqueue_spin(user_id, job):
+            return False
+        if message_key:
+            self._queued_messages.add(message_key)
+        return True
+
+    def enqueue_spin(self, user_id: int, job) -> bool:
+        """Ставит спин в очередь игрока. False - очередь заполнена, спин отброшен"""
+        try:
+            self._spin_queues[user_id].put_nowait(job)
+        except asyncio.QueueFull:
+            logging.debug(f"Очередь спинов игрока {user_id} заполнена, спин отброшен")
+            return False
+
+        if user_id not in self._spin_consumers:
+            self._spin_consumers[user_id] = self.admission.spawn(self._spin_consumer(user_id))
+        return True
+
+    async def _spin_consumer(self, user_id: int):
+        """Единственный обработчик очереди спинов игрока; завершается, когда игрок затих"""
+        queue = self._spin_queues[user_id]
+        try:
+            # Темп спинов задает только лимит частоты 'spin' при постановке в очередь
+            while not queue.empty():
+                job = queue.get_nowait()
+                mode = self.admission.acquire()
+                async with self._spin_locks[user_id]:
+                    try:
+                        await self.metrics.measure(f"spin_job:{mode}", job, mode)
+                    except Exception as e:
+                        logging.error(f"Ошибка спина из очереди игрока {user_id}: {e}")
+                    finally:
+                        if mode != 'rejected':
+                            self.admission.release()
+        finally:
+            # Игрок затих: освобождаем его состояние
+            self._spin_consumers.pop(user_id, None)
+            self._spin_queues.pop(user_id, None)
+            self._spin_locks.pop(user_id, None)
+
+    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        user_name = update.effective_user.first_name
+
+        balance = await self.user_manager.get_balance(user_id)
+        await update.message.reply_text(self.renderer.start_text(user_name, balance), parse_mode='Markdown',
+                                        reply_markup=self.renderer.main_keyboard)
+
+    def get_main_keyboard(self):
+        """Основная клавиатура с кнопками"""
+        return self.renderer.main_keyboard
+
+    def get_spin_keyboard(self, user_id: int):
+        """Инлайн клавиатура для спинов (из кэша по ставке)"""
+        return self.renderer.spin_keyboard(self.user_manager.get_default_bet(user_id))
+
+    def get_settings_keyboard(self, user_id: int):
+        """Инлайн клавиатура настроек ставки и турбо-режима (из кэша)"""
+        return self.renderer.settings_keyboard(self.user_manager.get_default_bet(user_id),
+                                               self.user_manager.is_turbo(user_id))
+
+    def is_turbo(self, user_id: int) -> bool:
+        """Турбо-режим: результат спина одним сообщением, без анимации"""
+        return self._force_turbo or self.user_manager.is_turbo(user_id)
 
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик нажатий на инлайн кнопки"""
         query = update.callback_query
-        await query.answer()
-
         user_id = query.from_user.id
         data = query.data
 
-        logging.info(f"Button pressed: {data} by user {user_id}")
-        logging.info(f"=== BUTTON HANDLER ===")
-        logging.info(f"User: {user_id}, Data: {data}")
-        logging.info(f"Starts with 'bet_': {data.startswith('bet_')}")
+        # Спины отвечают на нажатие сами, после постановки в очередь
+        if data != "spin" and not data.startswith("autospin_"):
+            await query.answer()
+
+        logging.debug("Button pressed: %s by user %s", data, user_id, extra={'category': 'button'})
 
         if data == "spin":
             # Выполняем спин с базовой ставкой
@@ -482,7 +2942,7 @@ class SlotBot:
 
                 )
 
-                logging.info(f"User {user_id} changed bet to {new_bet}")
+                logging.debug("User %s changed bet to %s", user_id, new_bet, extra={'category': 'settings'})
 
             except (ValueError, IndexError) as e:
 
@@ -526,6 +2986,31 @@ class SlotBot:
 
             )
 
+        elif data.startswith("autospin_"):
+
+            count = int(data.split("_")[1])
+
+            bet = self.user_manager.get_default_bet(user_id)
+
+            user_name = query.from_user.first_name
+
+            async def run(mode: str):
+                text = await self.run_autospin(user_id, user_name, count, bet)
+                await query.message.reply_text(text, parse_mode='Markdown', reply_markup=self.get_spin_keyboard(user_id))
+
+            if self._enqueue_spin_job(user_id, query.message.reply_text, run):
+                await query.answer()
+            else:
+                await query.answer("⏳ Очередь спинов заполнена, дождитесь результата предыдущих.", show_alert=True)
+
+        elif data == "turbo":
+
+            enabled = not self.user_manager.is_turbo(user_id)
+
+            self.user_manager.set_turbo(user_id, enabled)
+
+            await query.edit_message_reply_markup(reply_markup=self.get_settings_keyboard(user_id))
+
         elif data == "current_bet":
 
             # Просто показываем текущую ставку без изменений
@@ -549,7 +3034,7 @@ class SlotBot:
                     parse_mode='Markdown',
                     reply_markup=keyboard
                 )
-                logging.info(f"User {user_id} changed bet to {new_bet}")
+                logging.debug("User %s changed bet to %s", user_id, new_bet, extra={'category': 'settings'})
 
             except (ValueError, IndexError) as e:
                 logging.error(f"Error parsing bet from {data}: {e}")
@@ -561,59 +3046,51 @@ class SlotBot:
 
     async def process_spin_from_button(self, query, user_id: int, user_name: str, bet: int):
         """Обработка спина из кнопки"""
-        # ДОБАВИТЬ ЭТОТ КОД В НАЧАЛО МЕТОДА:
-        current_time = asyncio.get_event_loop().time()
-        time_since_last_spin = current_time - self._last_spin_time.get(user_id, 0)
-
-        # Проверяем флуд-контроль
-        if time_since_last_spin < self._min_spin_interval:
-            wait_time = int(self._min_spin_interval - time_since_last_spin)
-            await query.edit_message_text(f"⏳ Слишком часто! Подождите {wait_time} секунд(-ы) перед следующим спином.")
-            return
-
-        if self._spin_locks[user_id].locked():
-            await query.edit_message_text("⏳ Ваш предыдущий спин еще выполняется! Подождите...")
+        # Повторное нажатие на то же сообщение, пока его спин ждет в очереди, не плодит
+        # второй спин: оба редактировали бы одно сообщение, и первый результат пропал бы
+        message_key = (query.message.chat_id, query.message.message_id)
+        if message_key in self._queued_messages:
+            await query.answer("⏳ Спин с этого сообщения уже в очереди.")
             return
 
-        async with self._spin_locks[user_id]:
-            # Обновляем время последнего спина
-            self._last_spin_time[user_id] = current_time
-
-            if not await self.user_manager.update_balance(user_id, -bet):
-                await query.edit_message_text("❌ Недостаточно средств на балансе!")
-                return
+        async def run(mode: str):
+            await self.process_spin_animation_from_button(query, user_id, user_name, bet, turbo=mode == 'degraded')
 
-            # Запускаем анимацию спина
-            await self.process_spin_animation_from_button(query, user_id, user_name, bet)
+        if self._enqueue_spin_job(user_id, query.message.reply_text, run, bet=bet,
+                                  edit=query.edit_message_text, message_key=message_key):
+            await query.answer()
+        else:
+            await query.answer("⏳ Очередь спинов заполнена, дождитесь результата предыдущих.", show_alert=True)
 
-    async def process_spin_animation_from_button(self, query, user_id: int, user_name: str, bet: int):
+    async def process_spin_animation_from_button(self, query, user_id: int, user_name: str, bet: int,
+                                                 turbo: bool = False):
         """Анимация спина для кнопочного вызова с защитой от флуд-контроля"""
+        played = False  # Спин разыгран: дальше выигрыш и статистика рассчитываются, ставку не возвращаем
+        outcome = None
+        message = query.message
         try:
-            message = query.message
 
-            # Сохраняем имя пользователя
-            self.user_manager.user_names[user_id] = user_name
-
-            # Выполняем спин
-            reels, win_amount, is_jackpot = self.slot_machine.spin(bet)
+            if turbo or self.is_turbo(user_id):
+                played = True
+                result_text = await self.settle_spin(user_id, user_name, bet)
+                keyboard = self.get_spin_keyboard(user_id)
+                await message.edit_text(result_text, parse_mode='Markdown', reply_markup=keyboard)
+                return
 
-            # УПРОЩЕННАЯ АНИМАЦИЯ
-            display_reels = [['⚫' for _ in range(3)] for _ in range(5)]
+            # Сохраняем имя пользователя
+            self.user_manager.set_user_name(user_id, user_name)
 
-            # Анимация по столбцам справа налево
-            for col in range(5):  # 5 столбцов (барабанов)
-                for row in range(3):  # 3 строки в каждом барабане
-                    display_reels[col][row] = reels[col][row]
+            # Выполняем спин и сразу рассчитываем его
+            played = True
+            reels, win_amount, is_jackpot = outcome = await self.play_spin(user_id, bet)
 
-                reel_display = self.format_reels(display_reels)
+            # УПРОЩЕННАЯ АНИМАЦИЯ: барабаны открываются по одному
+            for frame in self.renderer.spin_frames(reels):
                 try:
-                    await message.edit_text(
-                        f"🎰 *ВРАЩЕНИЕ БАРАБАНОВ...*\n\n{reel_display}",
-                        reply_markup=None
-                    )
+                    await message.edit_text(frame, reply_markup=None)
                     await asyncio.sleep(0.7)
                 except Exception as e:
-                    logging.warning(f"Flood control in button animation: {e}")
+                    logging.warning("Flood control in button animation: %s", e, extra={'category': 'flood'})
                     break
 
             # Финальный результат
@@ -621,12 +3098,9 @@ class SlotBot:
             result_text = f"🎰 *РЕЗУЛЬТАТ ВРАЩЕНИЯ*\nИгрок: {user_name}\nСтавка: {bet} 💰\n\n{final_display}\n"
 
             if win_amount > 0:
-                await self.user_manager.update_balance(user_id, win_amount)
-                self.user_manager.stats[user_id]['total_win'] += win_amount
-
                 if is_jackpot:
                     result_text += f"\n🎉 *ДЖЕКПОТ!* 🎉\n🏆 ВЫ ВЫИГРАЛИ ДЖЕКПОТ!\n💰 Выигрыш: {win_amount} кредитов!"
-                    await self.animate_jackpot(message, result_text)
+                    await self.animate_jackpot_simple(message, result_text)
                 elif win_amount > bet * 10:
                     result_text += f"\n🎊 *БОЛЬШОЙ ВЫИГРЫШ!* 🎊\n💰 Выигрыш: {win_amount} кредитов!"
                     await self.animate_big_win(message, result_text)
@@ -638,11 +3112,6 @@ class SlotBot:
                 result_text += "\n😔 *ПОВЕЗЕТ В СЛЕДУЮЩИЙ РАЗ!*"
                 await message.edit_text(result_text, parse_mode='Markdown')
 
-            # Обновление статистики
-            self.user_manager.stats[user_id]['spins'] += 1
-            self.user_manager.stats[user_id]['total_bet'] += bet
-            self.user_manager.set_jackpot(self.slot_machine.jackpot)
-
             # Сохраняем данные
             asyncio.create_task(self.user_manager._delayed_save())
 
@@ -654,10 +3123,21 @@ class SlotBot:
             await message.edit_text(result_text, parse_mode='Markdown', reply_markup=keyboard)
 
 
+        except asyncio.CancelledError:
+            # Остановка бота до розыгрыша: ставка уже списана - возвращаем
+            if not played:
+                await self.user_manager.update_balance(user_id, bet)
+            raise
+
         except Exception as e:
 
             logging.error(f"Error in button spin animation for user {user_id}: {e}")
 
+            if played:
+                # Выигрыш уже зачислен, ошибка только в показе результата - показываем итог без анимации
+                await self.show_spin_result(message, user_id, user_name, bet, outcome)
+                return
+
             await self.user_manager.update_balance(user_id, bet)
 
             try:
@@ -702,61 +3182,41 @@ class SlotBot:
             await update.message.reply_text("❌ Ставка должна быть положительной!")
             return
 
-        # ДОБАВИТЬ ЭТОТ КОД ПЕРЕД ПРОВЕРКОЙ _spin_locks:
-        current_time = asyncio.get_event_loop().time()
-        time_since_last_spin = current_time - self._last_spin_time.get(user_id, 0)
+        await self.process_spin_from_text(update, user_id, user_name, bet)
 
-        # Проверяем флуд-контроль
-        if time_since_last_spin < self._min_spin_interval:
-            wait_time = int(self._min_spin_interval - time_since_last_spin)
-            await update.message.reply_text(
-                f"⏳ Слишком часто! Подождите {wait_time} секунд(-ы) перед следующим спином.")
-            return
-
-        if self._spin_locks[user_id].locked():
-            await update.message.reply_text("⏳ Ваш предыдущий спин еще выполняется! Подождите...")
-            return
-
-        async with self._spin_locks[user_id]:
-            # Обновляем время последнего спина
-            self._last_spin_time[user_id] = current_time
-
-            if not await self.user_manager.update_balance(user_id, -bet):
-                await update.message.reply_text("❌ Недостаточно средств на балансе!")
-                return
-
-            asyncio.create_task(
-                self.process_spin_animation(update, user_id, user_name, bet)
-            )
-
-    async def process_spin_animation(self, update: Update, user_id: int, user_name: str, bet: int):
+    async def process_spin_animation(self, update: Update, user_id: int, user_name: str, bet: int,
+                                     turbo: bool = False):
         """Обработка анимации в отдельной задаче с защитой от флуд-контроля"""
+        played = False  # Спин разыгран: дальше выигрыш и статистика рассчитываются, ставку не возвращаем
+        outcome = None
+        message = None
         try:
+            if turbo or self.is_turbo(user_id):
+                played = True
+                result_text = await self.settle_spin(user_id, user_name, bet)
+                keyboard = self.get_spin_keyboard(user_id)
+                await update.message.reply_text(result_text, parse_mode='Markdown', reply_markup=keyboard)
+                return
+
             message = await update.message.reply_text(
                 "🎰 *НАЧИНАЕМ ВРАЩЕНИЕ!*\n\n🔄 Подготовка барабанов...",
                 parse_mode='Markdown'
             )
 
             # Сохраняем имя пользователя
-            self.user_manager.user_names[user_id] = user_name
-
-            # Выполняем спин
-            reels, win_amount, is_jackpot = self.slot_machine.spin(bet)
-
-            # УПРОЩЕННАЯ АНИМАЦИЯ - меньше сообщений
-            display_reels = [['⚫' for _ in range(3)] for _ in range(5)]
+            self.user_manager.set_user_name(user_id, user_name)
 
-            # Анимация по столбцам справа налево
-            for col in range(5):  # 5 столбцов (барабанов)
-                for row in range(3):  # 3 строки в каждом барабане
-                    display_reels[col][row] = reels[col][row]
+            # Выполняем спин и сразу рассчитываем его
+            played = True
+            reels, win_amount, is_jackpot = outcome = await self.play_spin(user_id, bet)
 
-                reel_display = self.format_reels(display_reels)
+            # УПРОЩЕННАЯ АНИМАЦИЯ - меньше сообщений, барабаны открываются по одному
+            for frame in self.renderer.spin_frames(reels):
                 try:
-                    await message.edit_text(f"🎰 *ВРАЩЕНИЕ БАРАБАНОВ...*\n\n{reel_display}")
+                    await message.edit_text(frame)
                     await asyncio.sleep(0.7)  # Увеличиваем задержку
                 except Exception as e:
-                    logging.warning(f"Flood control during animation: {e}")
+                    logging.warning("Flood control during animation: %s", e, extra={'category': 'flood'})
                     # Продолжаем без анимации если сработал флуд-контроль
                     break
 
@@ -765,16 +3225,13 @@ class SlotBot:
             result_text = f"🎰 *РЕЗУЛЬТАТ ВРАЩЕНИЯ*\nИгрок: {user_name}\nСтавка: {bet} 💰\n\n{final_display}\n"
 
             if win_amount > 0:
-                await self.user_manager.update_balance(user_id, win_amount)
-                self.user_manager.stats[user_id]['total_win'] += win_amount
-
                 if is_jackpot:
                     result_text += f"\n🎉 *ДЖЕКПОТ!* 🎉\n🏆 ВЫ ВЫИГРАЛИ ДЖЕКПОТ!\n💰 Выигрыш: {win_amount} кредитов!"
                     # Упрощенная анимация джекпота
                     try:
                         await self.animate_jackpot_simple(message, result_text)
                     except Exception as e:
-                        logging.warning(f"Flood control in jackpot animation: {e}")
+                        logging.warning("Flood control in jackpot animation: %s", e, extra={'category': 'flood'})
                         await message.edit_text(result_text, parse_mode='Markdown')
                 elif win_amount > bet * 10:
                     result_text += f"\n🎊 *БОЛЬШОЙ ВЫИГРЫШ!* 🎊\n💰 Выигрыш: {win_amount} кредитов!"
@@ -786,11 +3243,6 @@ class SlotBot:
                 result_text += "\n😔 *ПОВЕЗЕТ В СЛЕДУЮЩИЙ РАЗ!*"
                 await message.edit_text(result_text, parse_mode='Markdown')
 
-            # Обновление статистики
-            self.user_manager.stats[user_id]['spins'] += 1
-            self.user_manager.stats[user_id]['total_bet'] += bet
-            self.user_manager.set_jackpot(self.slot_machine.jackpot)
-
             # Сохраняем данные
             asyncio.create_task(self.user_manager._delayed_save())
 
@@ -802,12 +3254,22 @@ class SlotBot:
             try:
                 await message.edit_text(result_text, parse_mode='Markdown', reply_markup=keyboard)
             except Exception as e:
-                logging.warning(f"Flood control for final message: {e}")
+                logging.warning("Flood control for final message: %s", e, extra={'category': 'flood'})
                 # Если не удалось отредактировать, отправляем новое сообщение
                 await update.message.reply_text(result_text, parse_mode='Markdown', reply_markup=keyboard)
 
+        except asyncio.CancelledError:
+            # Остановка бота до розыгрыша: ставка уже списана - возвращаем
+            if not played:
+                await self.user_manager.update_balance(user_id, bet)
+            raise
         except Exception as e:
             logging.error(f"Error in spin animation for user {user_id}: {e}")
+            if played:
+                # Выигрыш уже зачислен, ошибка только в показе результата - показываем итог без анимации
+                await self.show_spin_result(message or update.message, user_id, user_name, bet, outcome,
+                                            edit=message is not None)
+                return
             # Возвращаем ставку в случае ошибки
             await self.user_manager.update_balance(user_id, bet)
             try:
@@ -815,6 +3277,139 @@ class SlotBot:
             except Exception as e2:
                 logging.error(f"Could not send error message: {e2}")
 
+    async def autospin(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Серия спинов с одним итоговым сообщением: /autospin N [ставка]"""
+        user_id = update.effective_user.id
+
+        try:
+            count = int(context.args[0]) if context.args else 10
+            bet = int(context.args[1]) if len(context.args) > 1 else self.user_manager.get_default_bet(user_id)
+        except ValueError:
+            await update.message.reply_text(
+                "❌ Использование: `/autospin <кол-во> [ставка]`\n\nПример: `/autospin 20 10`",
+                parse_mode='Markdown'
+            )
+            return
+
+        if not 1 <= count <= self._max_autospin:
+            await update.message.reply_text(f"❌ Количество спинов должно быть от 1 до {self._max_autospin}")
+            return
+
+        if bet < 1:
+            await update.message.reply_text("❌ Ставка должна быть положительной!")
+            return
+
+        user_name = update.effective_user.first_name
+
+        async def run(mode: str):
+            # Автоспин и так отвечает одним сообщением, деградировать нечего
+            text = await self.run_autospin(user_id, user_name, count, bet)
+            await update.message.reply_text(text, parse_mode='Markdown', reply_markup=self.get_spin_keyboard(user_id))
+
+        if not self._enqueue_spin_job(user_id, update.message.reply_text, run):
+            await update.message.reply_text("⏳ Очередь спинов заполнена, дождитесь результата предыдущих.")
+
+    async def run_autospin(self, user_id: int, user_name: str, count: int, bet: int) -> str:
+        """Выполняет серию спинов и возвращает итоговый текст (вызывается из очереди спинов)"""
+        self.user_manager.set_user_name(user_id, user_name)
+
+        # Стоп-лосс: не больше половины текущего баланса за одну серию
+        stop_loss = max(bet, await self.user_manager.get_balance(user_id) // 2)
+        jackpot_delta = 0
+
+        def spin(spin_bet: int):
+            nonlocal jackpot_delta
+            reels, win_amount, is_jackpot, hits, delta = self.spin_machine(spin_bet)
+            jackpot_delta += delta
+            self.track_spin(user_id, spin_bet, reels, win_amount, is_jackpot, hits)
+            return reels, win_amount, is_jackpot
+
+        async def settle():
+            batch = await self.user_manager.settle_spin_batch(
+                user_id, bet, count, spin,
+                stop_loss=stop_loss, stop_win=bet * self._autospin_big_win
+            )
+            await self.commit_jackpot(jackpot_delta)
+            return batch
+
+        result = await run_to_completion(settle())
+
+        if result['spins'] == 0:
+            return "❌ Недостаточно средств на балансе!"
+
+        net = result['won'] - result['wagered']
+        stop_reasons = {
+            'done': "✅ Все спины выполнены",
+            'balance': "💸 Остановлено: недостаточно средств",
+            'stop_loss': f"🛑 Остановлено: стоп-лосс {stop_loss:,} 💰",
+            'big_win': "🎊 Остановлено: крупный выигрыш!",
+        }
+
+        text = (
+            f"🔁 *АВТОСПИН: {result['spins']}/{count}*\n"
+            f"Игрок: {user_name}\nСтавка: {bet} 💰\n\n"
+            f"📊 Всего поставлено: {result['wagered']:,} 💰\n"
+            f"🎊 Всего выиграно: {result['won']:,} 💰\n"
+            f"{'📈' if net >= 0 else '📉'} Итог: {net:+,} 💰\n"
+        )
+        if result['jackpots']:
+            text += f"\n🎉 *ДЖЕКПОТ!* 🎉 ×{result['jackpots']}\n"
+        if result['best_win'] > 0:
+            text += f"\n🏆 Лучший спин: {result['best_win']:,} 💰\n{self.format_reels(result['best_reels'])}\n"
+
+        text += f"\n{stop_reasons[result['stop_reason']]}"
+        text += f"\n\n💳 Новый баланс: {result['balance']:,} 💰"
+        text += f"\n🎯 Прогрессивный джекпот: {self.slot_machine.jackpot:,} 💰"
+
+        logging.info("Автоспин игрока %s: %d спинов, ставка %d, итог %d", user_id, result['spins'], bet, net,
+                     extra={'category': 'spin'})
+        return text
+
+    async def settle_spin(self, user_id: int, user_name: str, bet: int) -> str:
+        """Спин без анимации: расчет, зачисление выигрыша и итоговый текст (ставка уже списана)"""
+        self.user_manager.set_user_name(user_id, user_name)
+
+        reels, win_amount, is_jackpot = await self.play_spin(user_id, bet)
+        return await self.spin_result_text(user_id, user_name, bet, reels, win_amount, is_jackpot)
+
+    async def spin_result_text(self, user_id: int, user_name: str, bet: int, reels: List[List[str]],
+                               win_amount: int, is_jackpot: bool) -> str:
+        """Итоговый текст разыгранного спина: поле, выигрыш, баланс и джекпот"""
+        result_text = (f"🎰 *РЕЗУЛЬТАТ ВРАЩЕНИЯ*\nИгрок: {user_name}\nСтавка: {bet} 💰\n\n"
+                       f"{self.format_reels(reels)}\n")
+
+        if win_amount > 0:
+            if is_jackpot:
+                result_text += f"\n🎉 *ДЖЕКПОТ!* 🎉\n🏆 ВЫ ВЫИГРАЛИ ДЖЕКПОТ!\n💰 Выигрыш: {win_amount} кредитов!"
+            elif win_amount > bet * 10:
+                result_text += f"\n🎊 *БОЛЬШОЙ ВЫИГРЫШ!* 🎊\n💰 Выигрыш: {win_amount} кредитов!"
+            else:
+                result_text += f"\n🎉 *ВЫ ВЫИГРАЛИ!* 🎉\n💰 Выигрыш: {win_amount} кредитов!"
+        else:
+            result_text += "\n😔 *ПОВЕЗЕТ В СЛЕДУЮЩИЙ РАЗ!*"
+
+        result_text += f"\n\n💳 Новый баланс: {await self.user_manager.get_balance(user_id):,} 💰"
+        result_text += f"\n🎯 Прогрессивный джекпот: {self.slot_machine.jackpot:,} 💰"
+        return result_text
+
+    async def show_spin_result(self, message, user_id: int, user_name: str, bet: int, outcome, edit: bool = True):
+        """Итог разыгранного спина, когда анимация упала: игрок должен увидеть выигрыш и баланс.
+
+        outcome - (reels, win_amount, is_jackpot) или None, если ошибка случилась при расчете"""
+        try:
+            if outcome:
+                text = await self.spin_result_text(user_id, user_name, bet, *outcome)
+            else:
+                text = (f"⚠️ Спин засчитан, но показать результат не удалось.\n\n"
+                        f"💳 Баланс: {await self.user_manager.get_balance(user_id):,} 💰")
+            keyboard = self.get_spin_keyboard(user_id)
+            if edit:
+                await message.edit_text(text, parse_mode='Markdown', reply_markup=keyboard)
+            else:
+                await message.reply_text(text, parse_mode='Markdown', reply_markup=keyboard)
+        except Exception as e:
+            logging.error(f"Не удалось показать результат спина: {e}")
+
     async def animate_jackpot_simple(self, message, base_text: str):
         """Упрощенная анимация джекпота (меньше сообщений)"""
         try:
@@ -828,7 +3423,7 @@ class SlotBot:
                 await message.edit_text(f"{base_text}\n\n{frame}")
                 await asyncio.sleep(1.0)  # Увеличиваем задержку
         except Exception as e:
-            logging.warning(f"Flood control in simplified jackpot: {e}")
+            logging.warning("Flood control in simplified jackpot: %s", e, extra={'category': 'flood'})
             # Если сработал флуд-контроль, просто показываем финальный результат
             await message.edit_text(base_text, parse_mode='Markdown')
 
@@ -839,20 +3434,128 @@ class SlotBot:
             await message.edit_text(f"{base_text}\n\n💰 ✨ 💰")
             await asyncio.sleep(0.3)
 
-    async def animate_small_win(self, message, base_text: str):
-        for _ in range(2):
-            await message.edit_text(f"{base_text}\n\n✨")
-            await asyncio.sleep(0.3)
-            await message.edit_text(f"{base_text}\n\n🌟")
-            await asyncio.sleep(0.3)
+    async def animate_small_win(self, message, base_text: str):
+        for _ in range(2):
+            await message.edit_text(f"{base_text}\n\n✨")
+            await asyncio.sleep(0.3)
+            await message.edit_text(f"{base_text}\n\n🌟")
+            await asyncio.sleep(0.3)
+
+    async def place_bet(self, user_id: int, bet: int) -> bool:
+        """Списание ставки; если задачу отменили, пока списание шло, ставка возвращается"""
+        debit = asyncio.ensure_future(self.user_manager.update_balance(user_id, -bet))
+        try:
+            return await asyncio.shield(debit)
+        except asyncio.CancelledError:
+            if await debit:
+                await self.user_manager.update_balance(user_id, bet)
+            raise
+
+    async def play_spin(self, user_id: int, bet: int):
+        """Розыгрыш спина со списанной ставкой и его расчет: выигрыш, статистика, джекпот.
+
+        Расчет идет сразу, до анимации, и не прерывается отменой задачи (остановка бота)."""
+        reels, win_amount, is_jackpot, hits, jackpot_delta = self.spin_machine(bet)
+        await run_to_completion(self.settle_outcome(user_id, bet, reels, win_amount, is_jackpot, hits, jackpot_delta))
+        return reels, win_amount, is_jackpot
+
+    async def settle_outcome(self, user_id: int, bet: int, reels: List[List[str]], win_amount: int,
+                             is_jackpot: bool, hits, jackpot_delta: int) -> None:
+        """Зачисление выигрыша, статистика и джекпот разыгранного спина"""
+        if win_amount > 0:
+            await self.user_manager.update_balance(user_id, win_amount)
+        await self.record_spin(user_id, bet, reels, win_amount, is_jackpot, hits)
+        await self.commit_jackpot(jackpot_delta)
+
+    def spin_machine(self, bet: int):
+        """Спин, его выигрышные линии и изменение джекпота за него одним числом:
+        отчисление, выплата и сброс"""
+        before = self.slot_machine.jackpot
+        reels, win_amount, is_jackpot, hits = self.slot_machine.spin_with_hits(bet)
+        return reels, win_amount, is_jackpot, hits, self.slot_machine.jackpot - before
+
+    async def commit_jackpot(self, delta: int) -> None:
+        """Джекпот после спина. С хранилищем - приращением: синхронизация могла заменить
+        slot_machine.jackpot, пока спин ждал, и разность абсолютных значений потеряла бы вклад"""
+        if self.user_manager.store:
+            self.slot_machine.jackpot = await self.user_manager.update_jackpot(delta)
+        else:
+            self.slot_machine.jackpot = self.user_manager.set_jackpot(self.slot_machine.jackpot)
+
+    async def record_spin(self, user_id: int, bet: int, reels: List[List[str]], win_amount: int, is_jackpot: bool,
+                          hits):
+        """Учет спина в статистике и истории игрока"""
+        await self.user_manager.record_spin(user_id, bet, win_amount)
+        self.track_spin(user_id, bet, reels, win_amount, is_jackpot, hits)
+
+    def track_spin(self, user_id: int, bet: int, reels: List[List[str]], win_amount: int, is_jackpot: bool,
+                   hits):
+        """История и гистограммы спина (баланс и stats учитываются отдельно).
+
+        hits - выигрышные линии от движка: табличный движок отдает линии выпавшего класса,
+        и поле из пула заново не проверяется"""
+        self.spin_history.add(user_id, bet, reels, win_amount, is_jackpot)
+        self.win_histogram.record(user_id, bet, win_amount, hits)
+
+    def format_history(self, user_id: int, limit: int, with_seconds: bool = False) -> str:
+        """Текст последних спинов игрока (от новых к старым)"""
+        entries = self.spin_history.recent(user_id, limit)
+        if not entries:
+            return "📜 История спинов пуста"
+
+        time_format = '%d.%m.%Y %H:%M:%S' if with_seconds else '%d.%m %H:%M'
+        text = f"📜 *ПОСЛЕДНИЕ СПИНЫ* ({len(entries)} из {self.spin_history.total(user_id):,})\n"
+        for entry in entries:
+            when = datetime.fromtimestamp(entry['timestamp']).strftime(time_format)
+            result = f"+{entry['win']:,} 💰" if entry['win'] else "без выигрыша"
+            jackpot = " 🎉 ДЖЕКПОТ" if entry['jackpot'] else ""
+            text += (f"\n#{entry['number']} • {when} • ставка {entry['bet']} • {result}{jackpot}\n"
+                     f"{self.format_reels(entry['reels'])}\n")
+        return text
+
+    async def history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Последние спины игрока: /history [N]"""
+        user_id = update.effective_user.id
+        limit = 5
+        if context.args:
+            try:
+                limit = max(1, min(20, int(context.args[0])))
+            except ValueError:
+                await update.message.reply_text("❌ Использование: /history [количество, до 20]")
+                return
+        await update.message.reply_text(self.format_history(user_id, limit), parse_mode='Markdown')
+
+    async def user_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """История спинов любого игрока для разбора спорных ситуаций (только для администратора)"""
+        user_id = update.effective_user.id
+
+        ADMIN_IDS = []  # Ваши Telegram ID
+
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ Доступ запрещен!")
+            return
+
+        try:
+            target_id = int(context.args[0])
+            limit = max(1, min(self.spin_history.capacity, int(context.args[1]))) if len(context.args) > 1 else 10
+        except (IndexError, ValueError):
+            await update.message.reply_text("❌ Использование: /userhistory <user_id> [количество]")
+            return
+
+        name = self.user_manager.user_names.get(target_id) or "Неизвестный"
+        text = f"👤 {name} (`{target_id}`)\n" + self.format_history(target_id, limit, with_seconds=True)
+        # Длинная история не помещается в одно сообщение: делим по спинам, не разрывая разметку
+        chunk = ""
+        for block in text.split("\n\n"):
+            if chunk and len(chunk) + len(block) > 4000:
+                await update.message.reply_text(chunk, parse_mode='Markdown')
+                chunk = ""
+            chunk += block + "\n\n"
+        await update.message.reply_text(chunk, parse_mode='Markdown')
 
     def format_reels(self, reels: List[List[str]]) -> str:
         """Форматирование барабанов для отображения"""
-        lines = []
-        for i in range(3):
-            line = " ".join(reels[j][i] for j in range(5))
-            lines.append(line)
-        return "\n".join(lines)
+        return self.renderer.reels(reels)
 
     async def balance(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -870,24 +3573,56 @@ class SlotBot:
     📈 Прогрессивный джекпот: {self.slot_machine.jackpot:,} 💰
         """
 
+        histogram_text = self.format_histogram(user_id)
+        if histogram_text:
+            balance_text += histogram_text
+
         await update.message.reply_text(balance_text, parse_mode='Markdown')
 
+    def format_histogram(self, user_id: int) -> str:
+        """Распределение выигрышей игрока в сравнении со всеми игроками"""
+        histogram = self.win_histogram
+        counters = histogram.get(user_id)
+        if counters is None:
+            return ""
+
+        spins = sum(counters[:histogram.buckets])
+        all_spins = sum(histogram.total[:histogram.buckets]) or 1
+        text = "\n    📊 *Распределение выигрышей* (вы / все игроки):\n"
+        for bucket, label in enumerate(histogram.BUCKET_LABELS):
+            if counters[bucket] or bucket == 0:
+                text += (f"    {label}: {counters[bucket] / spins:.0%} / "
+                         f"{histogram.total[bucket] / all_spins:.0%}\n")
+
+        hits = [(symbol, counters[histogram.symbol_offset + i]) for i, symbol in enumerate(histogram.symbols)]
+        hits = [f"{symbol}×{count}" for symbol, count in hits if count]
+        if hits:
+            text += f"\n    🎯 Выигрышные линии: {' '.join(hits)}\n"
+        text += (f"    📉 Серия без выигрыша: сейчас {counters[histogram.streak]}, "
+                 f"рекорд {counters[histogram.longest]}\n")
+        return text
+
     async def bonus(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
 
-        if not self.user_manager.can_claim_bonus(user_id):
-            next_bonus = self.user_manager.daily_bonuses[user_id] + timedelta(hours=24)
+        try:
+            bonus = await self.user_manager.claim_bonus(user_id)
+        except StoreBusyError:
+            await update.message.reply_text("⏳ Хранилище занято, попробуйте еще раз через пару секунд.")
+            return
+        if not bonus:
+            next_bonus = self.user_manager.next_bonus_time(user_id) or datetime.now()
             wait_time = next_bonus - datetime.now()
             hours = int(wait_time.total_seconds() // 3600)
             minutes = int((wait_time.total_seconds() % 3600) // 60)
 
-            await update.message.reply_text(
-                f"❌ Вы уже получали бонус сегодня!\n"
-                f"⏰ Следующий бонус через: {hours}ч {minutes}м"
-            )
+            text = (f"❌ Вы уже получали бонус сегодня!\n"
+                    f"⏰ Следующий бонус через: {hours}ч {minutes}м")
+            if user_id not in self.user_manager.bonus_reminders:
+                text += "\n\n🔔 /remind - напомнить, когда бонус будет доступен"
+            await update.message.reply_text(text)
             return
 
-        bonus = self.user_manager.claim_bonus(user_id)
         new_balance = await self.user_manager.get_balance(user_id)
 
         bonus_text = f"""
@@ -955,11 +3690,297 @@ class SlotBot:
                 parse_mode='Markdown'
             )
 
-            logging.info(f"User {user_id} changed bet to {new_bet}")
+            logging.debug("User %s changed bet to %s", user_id, new_bet, extra={'category': 'settings'})
 
         except ValueError:
             await update.message.reply_text("❌ Неверный формат ставки! Используйте число.")
 
+    async def remind(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Включение/выключение напоминания о ежедневном бонусе"""
+        user_id = update.effective_user.id
+
+        if context.args and context.args[0].lower() in ("on", "off", "вкл", "выкл"):
+            enabled = context.args[0].lower() in ("on", "вкл")
+        else:
+            enabled = user_id not in self.user_manager.bonus_reminders
+
+        self.user_manager.set_bonus_reminder(user_id, enabled, via=self.tenant)
+
+        if enabled:
+            text = "🔔 *НАПОМИНАНИЕ ВКЛЮЧЕНО*\n\nБот напишет, когда ежедневный бонус снова будет доступен."
+        else:
+            text = "🔕 *НАПОМИНАНИЕ ВЫКЛЮЧЕНО*"
+        await update.message.reply_text(text, parse_mode='Markdown')
+
+    async def _bonus_reminder_loop(self):
+        """Напоминания о бонусе: раз в интервал забираем наступившие сроки и рассылаем пачками"""
+        schedule = self.user_manager.bonus_schedule
+        while True:
+            await asyncio.sleep(self._reminder_interval)
+            schedule.advance()
+            while schedule.due:
+                batch = []
+                while schedule.due and len(batch) < self._reminder_batch:
+                    user_id = schedule.due.popleft()
+                    if user_id in self.user_manager.bonus_reminders and self.user_manager.can_claim_bonus(user_id):
+                        batch.append(user_id)
+                if batch:
+                    await asyncio.gather(*(self._send_bonus_reminder(user_id) for user_id in batch))
+                    # Пачка в секунду: не больше _reminder_batch сообщений/с, остальное - игре
+                    await asyncio.sleep(1)
+
+    async def _send_bonus_reminder(self, user_id: int) -> None:
+        # Напоминание приходит от того бота, в котором игрок его включил
+        via = self.user_manager.user_settings.get(user_id, {}).get('reminder_bot')
+        bot = self.peers.get(via, self)
+        try:
+            await bot.app.bot.send_message(
+                chat_id=user_id,
+                text="🎁 Ваш ежедневный бонус снова доступен! Заберите его командой /bonus\n\n🔕 Отключить: /remind off"
+            )
+            bot.reminders_sent += 1
+        except Forbidden:
+            # Игрок заблокировал бота - больше не напоминаем
+            self.user_manager.set_bonus_reminder(user_id, False)
+        except Exception as e:
+            logging.warning("Напоминание о бонусе игроку %s не отправлено: %s", user_id, e, extra={'category': 'flood'})
+
+    async def _store_sync_loop(self):
+        """Балансы и джекпот, измененные другими процессами, - в память для /balance и рейтингов"""
+        while True:
+            await asyncio.sleep(self._store_sync_interval)
+            try:
+                await self.user_manager.sync_from_store()
+                self.slot_machine.jackpot = self.user_manager.jackpot
+            except (sqlite3.Error, StoreBusyError) as e:
+                logging.warning("Ошибка синхронизации с хранилищем: %s", e)
+
+    async def turbo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Включение/выключение турбо-режима (спины без анимации)"""
+        user_id = update.effective_user.id
+
+        if context.args and context.args[0].lower() in ("on", "off", "вкл", "выкл"):
+            enabled = context.args[0].lower() in ("on", "вкл")
+        else:
+            enabled = not self.user_manager.is_turbo(user_id)
+
+        self.user_manager.set_turbo(user_id, enabled)
+
+        if enabled:
+            text = "⚡ *ТУРБО-РЕЖИМ ВКЛЮЧЕН*\n\nРезультат спина приходит сразу, без анимации."
+        else:
+            text = "🎞 *ТУРБО-РЕЖИМ ВЫКЛЮЧЕН*\n\nСпины снова показываются с анимацией."
+        if self._force_turbo:
+            text += "\n\n⚠️ Сейчас турбо-режим включен администратором для всех игроков."
+
+        await update.message.reply_text(text, parse_mode='Markdown')
+
+    async def force_turbo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Принудительный турбо-режим для всех игроков (только для администратора)"""
+        user_id = update.effective_user.id
+
+        ADMIN_IDS = []  # Ваши Telegram ID
+
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ Доступ запрещен!")
+            return
+
+        if not context.args or context.args[0].lower() not in ("on", "off"):
+            state = "включен" if self._force_turbo else "выключен"
+            await update.message.reply_text(
+                f"ℹ️ Принудительный турбо-режим сейчас {state}.\n\n"
+                "Использование: `/forceturbo on` или `/forceturbo off`",
+                parse_mode='Markdown'
+            )
+            return
+
+        self._force_turbo = context.args[0].lower() == "on"
+        state = "включен" if self._force_turbo else "выключен"
+        await update.message.reply_text(f"⚡ Принудительный турбо-режим {state} для всех игроков.")
+        logging.info(f"ADMIN: User {user_id} set force turbo to {self._force_turbo}")
+
+    async def write_export(self, path: str, kind: str = 'users') -> int:
+        """Выгрузка в файл порциями с передачей управления циклу событий; возвращает число строк"""
+        fmt, compressed = export_format(path)
+        # Снимок списка ID: игроки, появившиеся во время выгрузки, в нее не попадут
+        user_ids = list(self.user_manager.balances)
+        rows = export_rows(kind, self.user_manager, self.spin_history, user_ids)
+
+        count = 0
+        opener = gzip.open if compressed else open
+        with opener(path, 'wt', encoding='utf-8', newline='') as f:
+            for line in export_lines(rows, EXPORT_FIELDS[kind], fmt):
+                f.write(line)
+                count += 1
+                if count % self._export_chunk == 0:
+                    await asyncio.sleep(0)
+        return count - (1 if fmt == 'csv' else 0)
+
+    async def export_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгрузка игроков или истории спинов файлом (только для администратора)"""
+        user_id = update.effective_user.id
+
+        ADMIN_IDS = []  # Ваши Telegram ID
+
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ Доступ запрещен!")
+            return
+
+        args = [arg.lower() for arg in (context.args or [])]
+        kind = 'spins' if 'spins' in args else 'users'
+        fmt = 'ndjson' if 'ndjson' in args or 'json' in args else 'csv'
+        suffix = f".{fmt}" + (".gz" if 'gz' in args else "")
+
+        fd, path = tempfile.mkstemp(prefix=f"export_{kind}_", suffix=suffix)
+        os.close(fd)
+        try:
+            start = time.perf_counter()
+            rows = await self.write_export(path, kind)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(path)
+            if size > self._export_max_bytes:
+                await update.message.reply_text(
+                    f"❌ Выгрузка {size / 1024 / 1024:.1f} МБ больше лимита Telegram. "
+                    f"Используйте `/export {kind} {fmt} gz` или CLI: `python SlotsBot.py --export файл{suffix}`"
+                )
+                return
+
+            filename = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}"
+            with open(path, 'rb') as f:
+                await update.message.reply_document(
+                    document=f, filename=filename,
+                    caption=f"📦 {rows:,} строк, {size / 1024:.0f} КБ, {elapsed:.1f} с"
+                )
+            logging.info(f"ADMIN: User {user_id} exported {rows} {kind} rows as {suffix}")
+        finally:
+            os.remove(path)
+
+    async def find_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Поиск игрока по началу имени или ID (только для администратора)"""
+        user_id = update.effective_user.id
+
+        ADMIN_IDS = []  # Ваши Telegram ID
+
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ Доступ запрещен!")
+            return
+
+        query = " ".join(context.args or [])
+        if not query:
+            await update.message.reply_text("ℹ️ Использование: `/finduser <начало имени или ID>`",
+                                            parse_mode='Markdown')
+            return
+
+        um = self.user_manager
+        start = time.perf_counter()
+        found = um.name_index.search(query, limit=self._finduser_limit)
+        if query.isdigit() and int(query) in um.balances and int(query) not in found:
+            found.insert(0, int(query))
+        elapsed = (time.perf_counter() - start) * 1000
+
+        if not found:
+            await update.message.reply_text(f"🔍 Никого не найдено по запросу «{query}»")
+            return
+
+        text = f"🔍 *Найдено по «{query}»* ({elapsed:.2f} мс):\n\n"
+        for found_id in found:
+            name = um.user_names.get(found_id) or "Неизвестный"
+            text += (f"`{found_id}` - {name} - {um.balances.get(found_id, 0):,} 💰, "
+                     f"{um.get_spins(found_id)} 🎰\n")
+        if len(found) >= self._finduser_limit:
+            text += "\n_Показаны первые совпадения, уточните запрос_"
+        await update.message.reply_text(text, parse_mode='Markdown')
+
+    async def bulk_balance(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Массовое изменение балансов из CSV-файла (только для администратора)"""
+        user_id = update.effective_user.id
+
+        ADMIN_IDS = []  # Ваши Telegram ID
+
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ Доступ запрещен!")
+            return
+
+        message = update.message
+        # Файл с подписью-командой или команда ответом на сообщение с файлом
+        document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+        words = (message.caption or message.text or "").split()
+        dry_run = any(word.lower() in ("dry", "dry-run", "проверка") for word in words[1:])
+
+        if document is None:
+            await message.reply_text(
+                "ℹ️ Массовое изменение балансов:\n"
+                "отправьте CSV-файл `user_id,amount` с подписью `/bulkbalance`\n"
+                "или ответьте `/bulkbalance` на сообщение с файлом.\n\n"
+                "`/bulkbalance dry` - только проверка, без изменений.\n"
+                "Правила сумм как в /addbalance: плюс - пополнение, минус - списание, 0 - обнуление."
+            )
+            return
+        if document.file_size and document.file_size > self._bulk_max_bytes:
+            await message.reply_text(f"❌ Файл больше {self._bulk_max_bytes // 1024 // 1024} МБ")
+            return
+
+        telegram_file = await context.bot.get_file(document.file_id)
+        data = bytes(await telegram_file.download_as_bytearray())
+
+        report = io.StringIO()
+        writer = csv.writer(report)
+        writer.writerow(['line', 'user_id', 'amount', 'status', 'old_balance', 'new_balance', 'error'])
+
+        lines = {}
+        operations = []
+        invalid = 0
+        try:
+            for line_no, target_id, amount, error in parse_balance_csv(data, self.user_manager.balances):
+                if error:
+                    invalid += 1
+                    writer.writerow([line_no, target_id, amount, 'invalid', '', '', error])
+                else:
+                    lines[target_id] = line_no
+                    operations.append((target_id, amount))
+        except UnicodeDecodeError:
+            await message.reply_text("❌ Файл должен быть в кодировке UTF-8")
+            return
+
+        try:
+            results = await self.user_manager.apply_balance_batch(operations, dry_run=dry_run)
+        except StoreBusyError:
+            await message.reply_text("⏳ Хранилище занято другим процессом, пакет не применен. Попробуйте еще раз.")
+            return
+
+        applied = failed = credited = debited = 0
+        for result in results:
+            if result['error']:
+                failed += 1
+                status = 'rejected'
+            else:
+                applied += 1
+                status = 'dry-run' if dry_run else 'applied'
+                delta = result['new'] - result['old']
+                if delta > 0:
+                    credited += delta
+                else:
+                    debited -= delta
+            writer.writerow([lines[result['user_id']], result['user_id'], result['amount'], status,
+                             result['old'], result['new'], result['error'] or ''])
+
+        mode = "🧪 ПРОВЕРКА (балансы не изменены)" if dry_run else "✅ ПРИМЕНЕНО"
+        summary = (
+            f"{mode}\n\n"
+            f"📄 Строк с операциями: {len(operations) + invalid:,}\n"
+            f"✅ {'Будет применено' if dry_run else 'Применено'}: {applied:,}\n"
+            f"❌ Ошибки в файле: {invalid:,}\n"
+            f"⛔ Недостаточно средств: {failed:,}\n"
+            f"💰 Пополнено: {credited:,} кредитов\n"
+            f"📉 Списано: {debited:,} кредитов"
+        )
+        report_name = f"bulk_{'dry_' if dry_run else ''}{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        await message.reply_document(document=io.BytesIO(report.getvalue().encode('utf-8')),
+                                     filename=report_name, caption=summary)
+
+        logging.info(f"ADMIN: User {user_id} bulk balance{' (dry run)' if dry_run else ''}: "
+                     f"{applied} applied, {invalid} invalid, {failed} rejected, +{credited} -{debited}")
+
     async def add_balance(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда для добавления/списания баланса пользователю (только для администратора)"""
         user_id = update.effective_user.id
@@ -1085,104 +4106,103 @@ class SlotBot:
                 await update.message.reply_text("📭 Нет зарегистрированных пользователей.")
                 return
 
-            # Сортируем по количеству прокрутов
-            users_sorted = sorted(
-                [(uid, self.user_manager.stats.get(uid, {'spins': 0})['spins'])
-                 for uid in self.user_manager.balances.keys()],
-                key=lambda x: x[1],
-                reverse=True
-            )
-
-            users_text = "👥 *СПИСОК ИГРОКОВ*\n\n"
-
-            for i, (user_id, spins) in enumerate(users_sorted[:50], 1):  # Показываем топ-50 по прокрутам
-                user_name = self.user_manager.user_names.get(user_id, "Неизвестный")
-
-                # Обрезаем длинные имена
-                if len(user_name) > 12:
-                    user_name = user_name[:12] + "..."
-
-                users_text += f"{i:2d}. `{user_id}` - {user_name} - *{spins}* 🎰\n"
-
-            users_text += f"\n👥 *Всего пользователей:* {len(users_sorted)}"
-            users_text += f"\n🎰 *Всего прокрутов:* {sum(stats['spins'] for stats in self.user_manager.stats.values())}"
-
-            await update.message.reply_text(users_text, parse_mode='Markdown')
+            text, keyboard = self.render_ranking_page('us', 0, user_id)
+            await update.message.reply_text(text, parse_mode='Markdown', reply_markup=keyboard)
 
         except Exception as e:
             logging.error(f"Ошибка в list_users: {e}")
             await update.message.reply_text("❌ Произошла ошибка при получении списка пользователей!")
 
     async def leaderboard(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        # Создаем простую таблицу лидеров по балансу
-        users_balances = [(uid, bal) for uid, bal in self.user_manager.balances.items()]
-        users_balances.sort(key=lambda x: x[1], reverse=True)
-
-        leaderboard_text = "🏆 *ТАБЛИЦА ЛИДЕРОВ*\n\n"
-
-        for i, (user_id, balance) in enumerate(users_balances[:20], 1):
-            leaderboard_text += f"{i}. 🎯 Игрок #{self.user_manager.user_names[user_id]}: {balance:,} 💰\n"
-
-        leaderboard_text += f"\n🎯 Прогрессивный джекпот: {self.slot_machine.jackpot:,} 💰"
-
-        await update.message.reply_text(leaderboard_text, parse_mode='Markdown')
-
-    async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        help_text = """
-    🎰 *ПОМОЩЬ ПО ИГРЕ СЛОТ-МАШИНА* 🎰
-
-    *🏠 ОСНОВНЫЕ КОМАНДЫ:*
-    /spin [ставка] - 🎡 Запуск слотов (по умолчанию используется ваша базовая ставка)
-    /setbet <ставка> - 🎯 Изменение базовой ставки
-    /balance - 💰 Показать баланс и статистику
-    /bonus - 🎁 Получить ежедневный бонус (50-200 кредитов)
-    /leaderboard - 🏆 Таблица лидеров по балансу
-    /settings - ⚙️ Настройка базовой ставки
-
-    *🎯 УПРАВЛЕНИЕ ЧЕРЕЗ КНОПКИ:*
-    • «🎰 Крутить» - быстрый спин с базовой ставкой
-    • «💰 Баланс» - посмотреть свой баланс
-    • «🎁 Бонус» - получить ежедневный бонус
-    • «🏆 Лидеры» - таблица лидеров
-    • «❓ Помощь» - эта справка
-
-    *🎮 ПРАВИЛА ИГРЫ:*
-    • *5 барабанов, 5 линий выплат* (3 горизонтальные + 2 диагональные)
-    • Выигрышные комбинации от 3+ одинаковых символов подряд
-    • Символ 💰 дает самый большой выигрыш и джекпот!
-    • *Прогрессивный джекпот* растет с каждой игрой
+        """Таблица лидеров по балансу с листанием страниц"""
+        text, keyboard = self.render_ranking_page('lb', 0, update.effective_user.id)
+        await update.message.reply_text(text, parse_mode='Markdown', reply_markup=keyboard)
+
+    # Списки с листанием: префикс callback_data -> размер страницы
+    _ranking_page_sizes = {'lb': 20, 'us': 50}
+
+    def _ranking_index(self, kind: str) -> RankIndex:
+        return self.user_manager.balance_index if kind == 'lb' else self.user_manager.spins_index
+
+    def _ranking_value(self, kind: str, user_id: int) -> int:
+        if kind == 'lb':
+            return self.user_manager.balances.get(user_id, 0)
+        return self.user_manager.get_spins(user_id)
+
+    def render_ranking_page(self, kind: str, start: int, viewer_id: int):
+        """Страница таблицы лидеров ('lb') или списка игроков ('us'): текст и кнопки ◀ / ▶"""
+        index = self._ranking_index(kind)
+        size = self._ranking_page_sizes[kind]
+        start = max(0, min(start, max(0, len(index) - 1) // size * size))
+        page = index.page(start, size)
+        names = self.user_manager.user_names
+
+        if kind == 'lb':
+            text = "🏆 *ТАБЛИЦА ЛИДЕРОВ*\n\n"
+            for rank, (user_id, balance) in enumerate(page, start + 1):
+                marker = " 👈" if user_id == viewer_id else ""
+                text += f"{rank}. 🎯 Игрок #{names.get(user_id, '')}: {balance:,} 💰{marker}\n"
+            text += f"\n🎯 Прогрессивный джекпот: {self.slot_machine.jackpot:,} 💰"
+        else:
+            text = "👥 *СПИСОК ИГРОКОВ*\n\n"
+            for rank, (user_id, spins) in enumerate(page, start + 1):
+                user_name = names.get(user_id, "Неизвестный")
+                # Обрезаем длинные имена
+                if len(user_name) > 12:
+                    user_name = user_name[:12] + "..."
+                text += f"{rank:2d}. `{user_id}` - {user_name} - *{spins}* 🎰\n"
+            text += f"\n👥 *Всего пользователей:* {len(index)}"
+            text += f"\n🎰 *Всего прокрутов:* {self.user_manager.totals['spins']}"
+
+        if page:
+            text += f"\n\n📄 {start + 1}-{start + len(page)} из {len(index)}"
+
+        # Курсор - ключ крайней строки страницы: листание не сбивается от новых игроков
+        buttons = []
+        if start > 0 and page:
+            first_id, first_value = page[0]
+            buttons.append(InlineKeyboardButton("◀", callback_data=f"{kind}<{first_value}:{first_id}"))
+        buttons.append(InlineKeyboardButton("📍 Моя позиция", callback_data=f"{kind}@"))
+        if start + len(page) < len(index):
+            last_id, last_value = page[-1]
+            buttons.append(InlineKeyboardButton("▶", callback_data=f"{kind}>{last_value}:{last_id}"))
+        return text, InlineKeyboardMarkup([buttons])
+
+    async def ranking_page_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Листание таблицы лидеров и списка игроков в том же сообщении"""
+        query = update.callback_query
+        user_id = query.from_user.id
+        kind, action, cursor = query.data[:2], query.data[2], query.data[3:]
 
-    *🎮 ДОСТУПНЫЕ СТАВКИ:*
-    1, 5, 10, 25, 50, 100 кредитов
+        if action == '@' and user_id not in self.user_manager.balances:
+            await query.answer("Вас еще нет в списке - сделайте первый спин!", show_alert=True)
+            return
+        await query.answer()
 
-    *💰 СИМВОЛЫ И ВЫПЛАТЫ (умножаются на вашу ставку):*
-    🍒 3x=×2, 4x=×5, 5x=×10
-    🍋 3x=×3, 4x=×8, 5x=×15  
-    🍊 3x=×4, 4x=×10, 5x=×20
-    🍇 3x=×5, 4x=×15, 5x=×30
-    🍌 3x=×8, 4x=×20, 5x=×50
-    ⭐ 3x=×10, 4x=×25, 5x=×75
-    💎 3x=×15, 4x=×40, 5x=×100
-    7️⃣ 3x=×20, 4x=×50, 5x=×150
-    💰 3x=×50, 4x=×200, 5x=×1000 + *ДЖЕКПОТ!*
+        if kind == 'us':
+            ADMIN_IDS = []  # Ваши Telegram ID
 
-    *🎊 ОСОБЫЕ ВОЗМОЖНОСТИ:*
-    • *Ежедневный бонус* - каждый 24 часа
-    • *Настройка ставки* - установите удобную базовую ставку
-    • *Анимации* - специальные эффекты для больших выигрышей
-    • *Статистика* - отслеживайте свою игровую активность
+            if user_id not in ADMIN_IDS:
+                await query.edit_message_text("❌ Доступ запрещен!")
+                return
 
-    *💡 СОВЕТЫ:*
-    • Используйте /setbet для удобной настройки ставок
-    • Начните с небольших ставок для знакомства с игрой
-    • Используйте /settings для удобной настройки ставок
-    • Не забывайте забирать ежедневный бонус!
-    • Следите за прогрессивным джекпотом
+        index = self._ranking_index(kind)
+        size = self._ranking_page_sizes[kind]
+        if action == '@':
+            start = index.rank(user_id, self._ranking_value(kind, user_id)) // size * size
+        else:
+            value, cursor_id = (int(part) for part in cursor.split(':'))
+            start = index.after((value, cursor_id)) if action == '>' else index.before((value, cursor_id), size)
 
-    *Удачи в игре! 🍀*
-        """
+        text, keyboard = self.render_ranking_page(kind, start, user_id)
+        try:
+            await query.edit_message_text(text, parse_mode='Markdown', reply_markup=keyboard)
+        except BadRequest as e:
+            # "Message is not modified": страница не изменилась
+            logging.debug("Страница рейтинга не изменилась: %s", e)
 
-        await update.message.reply_text(help_text, parse_mode='Markdown')
+    async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.message.reply_text(MessageRenderer.HELP_TEXT, parse_mode='Markdown')
 
     async def admin_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Справка по административным командам"""
@@ -1195,43 +4215,7 @@ class SlotBot:
             await update.message.reply_text("❌ Доступ запрещен!")
             return
 
-        help_text = """
-    🔧 *АДМИНИСТРАТИВНЫЕ КОМАНДЫ*
-
-    *Статистика и мониторинг:*
-    /admin - 📊 Общая статистика бота
-    /users - 👥 Список игроков (ID, имя, прокруты)
-    /leaderboard - 🏆 Таблица лидеров
-
-    *Управление балансами:*
-    /addbalance - 💰 Управление балансом пользователя
-
-    *Использование /addbalance:*
-    `/addbalance <user_id> <amount>`
-
-    *Рассылка сообщений:*
-    `/broadcast - 📢 Отправка сообщения всем пользователям`
-
-    *Использование /broadcast:*
-    `/broadcast <текст сообщения>`
-
-    *Примеры:*
-    • `/addbalance 123456789 1000` - добавить 1000 кредитов
-    • `/addbalance 123456789 -500` - списать 500 кредитов  
-    • `/addbalance 123456789 0` - обнулить баланс
-
-    *Параметры:*
-    • `user_id` - ID пользователя в Telegram
-    • `amount` - сумма (положительная - пополнение, отрицательная - списание, 0 - обнуление)
-
-    *Примечания:*
-    • Все изменения баланса логируются
-    • Проверяйте ID пользователя через /users
-    • При списании проверяется достаточность средств
-    • Джекпот автоматически растет с каждой игрой
-        """
-
-        await update.message.reply_text(help_text, parse_mode='Markdown')
+        await update.message.reply_text(MessageRenderer.ADMIN_HELP_TEXT, parse_mode='Markdown')
 
     async def admin_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Статистика для администратора"""
@@ -1254,6 +4238,11 @@ class SlotBot:
             # Активные пользователи (кто делал хотя бы 1 спин)
             active_users = sum(1 for stats in self.user_manager.stats.values() if stats['spins'] > 0)
 
+            queue = self.get_update_queue_depth()
+            admission = self.admission.get_metrics()
+            limiter = self.rate_limiter.get_metrics()
+            monitor = self.loop_monitor
+
             # Топ-5 пользователей по балансу
             top_users = sorted(
                 [(uid, bal) for uid, bal in self.user_manager.balances.items()],
@@ -1261,8 +4250,18 @@ class SlotBot:
                 reverse=True
             )[:5]
 
+            outbound = ""
+            if isinstance(self.outbound, OutboundRateLimiter):
+                sent = self.outbound.get_metrics()
+                outbound = (f"\n    📤 Исходящие (общие для ботов): отложено {sent['delayed']} "
+                            f"на {sent['wait_ms'] / 1000:.1f} с, повторов после 429: {sent['retried']}")
+            store = self.user_manager.store
+            if store:
+                outbound += (f"\n    🗄 Общее хранилище: записей {store.metrics['writes']}, "
+                             f"конфликтов CAS: {store.metrics['conflicts']}, ожиданий блокировки: {store.metrics['busy']}")
+
             stats_text = f"""
-    📊 *АДМИН СТАТИСТИКА*
+    📊 *АДМИН СТАТИСТИКА*{f" ({self.tenant})" if self.tenant else ""}
 
     👥 Всего пользователей: {total_users}
     🎯 Активных пользователей: {active_users}
@@ -1275,6 +4274,13 @@ class SlotBot:
     • Доход казино: {total_bet - total_win:,} 💰
 
     🏆 Текущий джекпот: {self.slot_machine.jackpot:,} 💰
+    ⚡ Принудительный турбо-режим: {"вкл" if self._force_turbo else "выкл"}
+    🎁 Бонус доступен: {self.user_manager.claimable_bonus_count()} игрокам (напоминания: {len(self.user_manager.bonus_reminders)}, отправлено: {self.reminders_sent})
+
+    📥 Очередь обновлений: {queue['queued']} в очереди, {queue['waiting']} ожидают, {queue['active']}/{queue['max_concurrent']} в работе
+    🚦 Ограничено запросов: {sum(limiter['throttled'].values())} (из них спинов: {limiter['throttled'].get('spin', 0)})
+    🎞 Спины в работе: {admission['inflight']}/{self.admission.max_inflight} (без анимации: {admission['degraded']}, отклонено: {admission['rejected']})
+    ⏲ Задержка цикла: {monitor.lag * 1000:.0f} мс (макс. {monitor.lag_max * 1000:.0f} мс), зависаний: {monitor.stall_count}{outbound}
 
     📈 Топ-5 игроков:
     """
@@ -1283,6 +4289,11 @@ class SlotBot:
                 user_name = self.user_manager.user_names.get(user_id, f"Игрок #{user_id}")
                 stats_text += f"{i}. {user_name}: {balance:,} 💰\n"
 
+            if monitor.stalls:
+                stats_text += "\n⏲ Последние зависания цикла:\n"
+                for stall in list(monitor.stalls)[-3:]:
+                    stats_text += f"• {stall['at']:%H:%M:%S} {stall['lag'] * 1000:.0f} мс - `{stall['culprit']}`\n"
+
             # Добавляем информацию о файле данных
             import os
             if os.path.exists(self.user_manager.data_file):
@@ -1295,6 +4306,128 @@ class SlotBot:
             logging.error(f"Ошибка в admin_stats: {e}")
             await update.message.reply_text("❌ Ошибка при получении статистики!")
 
+    async def perf_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Задержки обработчиков и вызовов Bot API (только для администратора)"""
+        user_id = update.effective_user.id
+
+        ADMIN_IDS = []  # Ваши Telegram ID
+
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ Доступ запрещен!")
+            return
+
+        text = "⏱ *ЗАДЕРЖКИ ОБРАБОТЧИКОВ* (мс: p50/p95/p99)\n\n"
+        handlers = sorted(self.metrics.handlers.items(), key=lambda x: x[1]['latency'].count, reverse=True)
+        for name, m in handlers:
+            latency = m['latency']
+            busy = m['api_time'] + m['local_time']
+            api_share = m['api_time'] / busy * 100 if busy else 0
+            text += (
+                f"`{name}`: {latency.count} шт, "
+                f"{latency.percentile(0.5):.0f}/{latency.percentile(0.95):.0f}/{latency.percentile(0.99):.0f}, "
+                f"ошибок {m['errors']}, Bot API {api_share:.0f}% "
+                f"({m['api_calls'] / latency.count:.1f} выз.)\n"
+            )
+
+        text += "\n📡 *BOT API*\n\n"
+        for api_method, api in sorted(self.metrics.api.items(), key=lambda x: x[1]['calls'], reverse=True):
+            avg_ms = api['time'] / api['calls'] * 1000
+            text += (f"`{api_method}`: {api['calls']} выз., {avg_ms:.0f} мс в среднем, "
+                     f"ошибок {api['errors']}, 429: {api['retry_after']}\n")
+
+        if self.metrics.profile_slow_ms is not None:
+            text += f"\n🔬 Профили запросов дольше {self.metrics.profile_slow_ms:.0f} мс: `{self.metrics.profile_dir}/`"
+
+        await update.message.reply_text(text, parse_mode='Markdown')
+
+    def memory_report(self) -> List[Tuple[str, int, int]]:
+        """(структура, записей, примерно байт) для поиска того, что растет"""
+        um = self.user_manager
+        structures = [
+            ('balances', um.balances), ('stats', um.stats), ('user_names', um.user_names),
+            ('user_settings', um.user_settings), ('daily_bonuses', um.daily_bonuses),
+            ('achievements', um.achievements), ('bonus_reminders', um.bonus_reminders), ('_locks', um._locks),
+            ('_spin_locks', self._spin_locks), ('_spin_queues', self._spin_queues),
+            ('_spin_consumers', self._spin_consumers),
+        ]
+        report = [(name, len(container), estimate_size(container)) for name, container in structures]
+        report += [
+            ('balance_index', len(um.balance_index), um.balance_index.memory_bytes()),
+            ('spins_index', len(um.spins_index), um.spins_index.memory_bytes()),
+            ('name_index', len(um.name_index), um.name_index.memory_bytes()),
+            ('spin_history', len(self.spin_history), self.spin_history.memory_bytes()),
+            ('rate_limiter', self.rate_limiter.get_metrics()['buckets'], estimate_size(self.rate_limiter._buckets)),
+        ]
+        return report
+
+    @staticmethod
+    def task_report() -> List[Tuple[str, int]]:
+        """Незавершенные задачи asyncio по имени корутины: _delayed_save, анимации спинов и т.д."""
+        counts = defaultdict(int)
+        for task in asyncio.all_tasks():
+            coro = task.get_coro()
+            counts[getattr(coro, '__qualname__', type(coro).__name__)] += 1
+        return sorted(counts.items(), key=lambda x: x[1], reverse=True)
+
+    async def mem_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Память по структурам, задачи и разница снимков tracemalloc (только для администратора)"""
+        user_id = update.effective_user.id
+
+        ADMIN_IDS = []  # Ваши Telegram ID
+
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ Доступ запрещен!")
+            return
+
+        action = context.args[0].lower() if context.args else ""
+        if action == "trace":
+            frames = int(context.args[1]) if len(context.args) > 1 and context.args[1].isdigit() else 1
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            # Снимок - тяжелая операция, делаем ее вне цикла событий
+            self._trace_snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+            await update.message.reply_text(
+                "🔬 tracemalloc включен, исходный снимок сделан. Сравнение: /memstats diff [N]\n"
+                "Учет выделений замедляет бота - выключите, когда закончите: /memstats stop")
+            return
+        if action == "stop":
+            tracemalloc.stop()
+            self._trace_snapshot = None
+            await update.message.reply_text("🔬 tracemalloc выключен")
+            return
+        if action == "diff":
+            if self._trace_snapshot is None or not tracemalloc.is_tracing():
+                await update.message.reply_text("❌ Сначала включите учет: /memstats trace")
+                return
+            top = int(context.args[1]) if len(context.args) > 1 and context.args[1].isdigit() else self._memstats_top
+            snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+            diff = await asyncio.to_thread(snapshot.compare_to, self._trace_snapshot, 'lineno')
+            # Следующая разница - от этого снимка: видно, что выросло за последний интервал
+            self._trace_snapshot = snapshot
+            text = f"🔬 *РОСТ ПАМЯТИ* (топ {top} строк с прошлого снимка)\n\n"
+            for stat in diff[:top]:
+                frame = stat.traceback[0]
+                text += (f"`{os.path.basename(frame.filename)}:{frame.lineno}` "
+                         f"{'+' if stat.size_diff >= 0 else ''}{format_bytes(stat.size_diff)} "
+                         f"({stat.count_diff:+d} объектов), всего {format_bytes(stat.size)}\n")
+            await update.message.reply_text(text, parse_mode='Markdown')
+            return
+
+        report = self.memory_report()
+        text = f"🧠 *ПАМЯТЬ* (RSS {format_bytes(process_rss())}, оценка по выборке)\n\n"
+        for name, count, size in sorted(report, key=lambda x: x[2], reverse=True):
+            text += f"`{name}`: {count:,} записей, ~{format_bytes(size)}\n"
+
+        tasks = self.task_report()
+        text += f"\n⚙️ *ЗАДАЧИ ASYNCIO*: {sum(n for _, n in tasks)}\n"
+        for name, count in tasks[:self._memstats_top]:
+            text += f"`{name}`: {count}\n"
+
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            text += f"\n🔬 tracemalloc: {format_bytes(current)} (пик {format_bytes(peak)}), /memstats diff [N]"
+        await update.message.reply_text(text, parse_mode='Markdown')
+
     async def broadcast_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Отправка сообщения всем пользователям (только для администратора)"""
         user_id = update.effective_user.id
@@ -1431,11 +4564,149 @@ class SlotBot:
             logging.error(f"Ошибка при выполнении рассылки: {e}")
             await query.edit_message_text(f"❌ Произошла ошибка при рассылке: {e}")
 
-    def run(self):
-        """Запуск бота"""
+    async def _on_start(self, application: Application) -> None:
+        """Запуск фоновых задач после инициализации приложения"""
+        self.loop_monitor.start()
+        if self.metrics_server:
+            await self.metrics_server.start()
+        if self.wallet_owner:
+            # Очередь напоминаний общая для ботов кошелька - разбирает ее один
+            self._reminder_task = asyncio.create_task(self._bonus_reminder_loop())
+            if self.user_manager.store:
+                self._store_sync_task = asyncio.create_task(self._store_sync_loop())
+
+    async def _on_stop(self, application: Application) -> None:
+        """Остановка бота: дожидаемся начатых спинов и сохраняем данные"""
+        self.loop_monitor.stop()
+        if self._reminder_task:
+            self._reminder_task.cancel()
+        if self._store_sync_task:
+            self._store_sync_task.cancel()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await self.admission.drain()
+        self.spin_history.save(self.history_file)
+        self.win_histogram.save(self.histogram_file)
+        if self.recorder:
+            self.recorder.close()
+            logging.info(f"Записано обновлений: {self.recorder.count} в {self.recorder.path}")
+        self.user_manager.save_data()
+
+    def render_metrics(self) -> str:
+        """Текущее состояние бота в формате Prometheus (без обхода всех пользователей)"""
+        um = self.user_manager
+        totals = um.totals
+        queue = self.get_update_queue_depth()
+        admission = self.admission.get_metrics()
+        limiter = self.rate_limiter.get_metrics()
+
+        lines = []
+        lines += format_metric("slotbot_spins_total", "counter", "Сыграно спинов", [({}, totals['spins'])])
+        lines += format_metric("slotbot_wagered_total", "counter", "Поставлено монет", [({}, totals['total_bet'])])
+        lines += format_metric("slotbot_won_total", "counter", "Выиграно монет", [({}, totals['total_win'])])
+        rtp = totals['total_win'] / totals['total_bet'] if totals['total_bet'] else 0
+        lines += format_metric("slotbot_rtp_ratio", "gauge", "Возврат игроку (RTP) по всем спинам", [({}, rtp)])
+        lines += format_metric("slotbot_jackpot", "gauge", "Прогрессивный джекпот", [({}, self.slot_machine.jackpot)])
+        lines += format_metric("slotbot_users", "gauge", "Известных пользователей", [({}, len(um.balances))])
+
+        lines += format_metric("slotbot_update_queue", "gauge", "Входящие обновления по состояниям",
+                               [({'state': state}, queue[state]) for state in ('queued', 'waiting', 'active')])
+        lines += format_metric("slotbot_spin_queue_depth", "gauge", "Спинов в очередях игроков",
+                               [({}, sum(q.qsize() for q in self._spin_queues.values()))])
+        lines += format_metric("slotbot_spin_sessions", "gauge", "Активных обработчиков очередей спинов",
+                               [({}, len(self._spin_consumers))])
+        lines += format_metric("slotbot_user_locks", "gauge", "Блокировок балансов в памяти", [({}, len(um._locks))])
+        lines += format_metric("slotbot_spin_locks", "gauge", "Блокировок спинов в памяти",
+                               [({}, len(self._spin_locks))])
+        lines += format_metric("slotbot_spins_inflight", "gauge", "Спинов выполняется сейчас", [({}, admission['inflight'])])
+        lines += format_metric("slotbot_spins_degraded_total", "counter", "Спинов без анимации (перегрузка)",
+                               [({}, admission['degraded'])])
+        lines += format_metric("slotbot_spins_rejected_total", "counter", "Спинов отклонено из-за перегрузки",
+                               [({}, admission['rejected'])])
+        lines += format_metric("slotbot_throttled_total", "counter", "Запросов отклонено лимитом частоты",
+                               [({'command': cmd}, n) for cmd, n in limiter['throttled'].items()])
+
+        save = um.save_metrics
+        lines += format_metric("slotbot_save_total", "counter", "Сохранений файла данных", [({}, save['count'])])
+        lines += format_metric("slotbot_save_errors_total", "counter", "Неудачных сохранений", [({}, save['errors'])])
+        lines += format_metric("slotbot_save_duration_seconds", "gauge", "Длительность последнего сохранения",
+                               [({}, save['duration'])])
+        lines += format_metric("slotbot_save_bytes", "gauge", "Размер файла данных после последнего сохранения",
+                               [({}, save['bytes'])])
+
+        api = self.metrics.api
+        lines += format_metric("slotbot_api_calls_total", "counter", "Вызовов Bot API",
+                               [({'method': m}, a['calls']) for m, a in api.items()])
+        lines += format_metric("slotbot_api_errors_total", "counter", "Неудачных вызовов Bot API",
+                               [({'method': m}, a['errors']) for m, a in api.items()])
+        lines += format_metric("slotbot_api_retry_after_total", "counter", "Ответов Bot API о флуд-контроле (429)",
+                               [({'method': m}, a['retry_after']) for m, a in api.items()])
+        lines += format_metric("slotbot_api_seconds_total", "counter", "Время в вызовах Bot API",
+                               [({'method': m}, a['time']) for m, a in api.items()])
+
+        if um.store:
+            lines += format_metric("slotbot_store_writes_total", "counter", "Записей версий в общее хранилище",
+                                   [({}, um.store.metrics['writes'])])
+            lines += format_metric("slotbot_store_conflicts_total", "counter", "Повторов из-за конфликтов версий",
+                                   [({}, um.store.metrics['conflicts'])])
+            lines += format_metric("slotbot_store_busy_total", "counter", "Повторов записи из-за занятой базы",
+                                   [({}, um.store.metrics['busy'])])
+        if isinstance(self.outbound, OutboundRateLimiter):
+            sent = self.outbound.get_metrics()
+            lines += format_metric("slotbot_outbound_delayed_total", "counter",
+                                   "Вызовов Bot API, задержанных общим лимитом исходящих", [({}, sent['delayed'])])
+            lines += format_metric("slotbot_outbound_wait_seconds_total", "counter",
+                                   "Время ожидания вызовов в общем лимите исходящих", [({}, sent['wait_ms'] / 1000)])
+            lines += format_metric("slotbot_outbound_retried_total", "counter",
+                                   "Повторных отправок после флуд-контроля", [({}, sent['retried'])])
+
+        samples = []
+        for name, m in self.metrics.handlers.items():
+            latency = m['latency']
+            cumulative = 0
+            for bound, count in zip(LatencyHistogram.BOUNDS, latency.counts):
+                cumulative += count
+                samples.append(({'handler': name, 'le': bound}, cumulative))
+            samples.append(({'handler': name, 'le': '+Inf'}, latency.count))
+        lines += format_metric("slotbot_handler_latency_ms", "histogram", "Задержка обработчиков, мс", samples)
+        for name, m in self.metrics.handlers.items():
+            lines.append(f'slotbot_handler_latency_ms_sum{{handler="{name}"}} {m["latency"].total}')
+            lines.append(f'slotbot_handler_latency_ms_count{{handler="{name}"}} {m["latency"].count}')
+        lines += format_metric("slotbot_handler_errors_total", "counter", "Исключений в обработчиках",
+                               [({'handler': n}, m['errors']) for n, m in self.metrics.handlers.items()])
+
+        lines += format_metric("slotbot_event_loop_lag_seconds", "gauge", "Последняя измеренная задержка цикла событий",
+                               [({}, self.loop_monitor.lag)])
+        lines += format_metric("slotbot_event_loop_lag_max_seconds", "gauge", "Максимальная задержка цикла событий с запуска",
+                               [({}, self.loop_monitor.lag_max)])
+        lines += format_metric("slotbot_event_loop_stalls_total", "counter", "Зависаний цикла событий выше порога",
+                               [({}, self.loop_monitor.stall_count)])
+        return "\n".join(lines) + "\n"
+
+    def get_update_queue_depth(self) -> Dict[str, int]:
+        """Глубина очереди входящих обновлений"""
+        return {
+            'queued': self.app.update_queue.qsize(),  # Еще не взяты в обработку
+            'waiting': self.update_processor.pending - self.update_processor.active,  # Ждут свободного слота
+            'active': self.update_processor.active,
+            'max_concurrent': self.update_processor.max_concurrent_updates,
+        }
+
+    def run(self, webhook_url: str = None, listen: str = "0.0.0.0", port: int = 8443,
+            url_path: str = "", secret_token: str = None):
+        """Запуск бота (long polling или webhook, если указан webhook_url)"""
         print("🎰 Слот-бот запущен!")
         try:
-            self.app.run_polling()
+            if webhook_url:
+                self.app.run_webhook(
+                    listen=listen,
+                    port=port,
+                    url_path=url_path,
+                    webhook_url=webhook_url,
+                    secret_token=secret_token
+                )
+            else:
+                self.app.run_polling()
         except KeyboardInterrupt:
             print("\nСохранение данных перед завершением...")
             self.user_manager.save_data()
@@ -1445,6 +4716,63 @@ class SlotBot:
 # Запуск бота
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Telegram слот-бот")
+    parser.add_argument("--concurrent-updates", type=int, default=1,
+                        help="Сколько обновлений обрабатывать параллельно")
+    parser.add_argument("--base-url", default=None,
+                        help="Адрес Bot API, например http://127.0.0.1:8081/bot для локального сервера")
+    parser.add_argument("--webhook-url", default=None,
+                        help="Публичный URL вебхука; без него используется long polling")
+    parser.add_argument("--listen", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--url-path", default="")
+    parser.add_argument("--secret-token", default=None)
+    parser.add_argument("--profile-slow-ms", type=float, default=None,
+                        help="Сохранять cProfile запросов дольше этого порога (мс)")
+    parser.add_argument("--profile-dir", default="profiles")
+    parser.add_argument("--record", default=None,
+                        help="Записывать входящие обновления (обезличенно) в этот файл .jsonl.gz")
+    parser.add_argument("--log-file", default="slot_bot.log", help="Файл лога (JSON, с ротацией)")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Порт для метрик Prometheus (только 127.0.0.1)")
+    parser.add_argument("--data-file", default="user_data.json", help="Файл данных пользователей")
+    parser.add_argument("--engine", default="reels", choices=["reels", "table"],
+                        help="reels - барабаны и проверка линий, table - класс выплаты из точной таблицы (O(1))")
+    parser.add_argument("--machine", default=None, metavar="JSON",
+                        help="Веса символов и выплаты из файла (см. rtp_solver.py)")
+    parser.add_argument("--store", default=None, metavar="DB",
+                        help="SQLite для балансов, общий для нескольких процессов на одной машине")
+    parser.add_argument("--export", default=None, metavar="FILE",
+                        help="Выгрузить данные в FILE (.csv, .ndjson, можно .gz) и выйти, бот не запускается")
+    parser.add_argument("--export-kind", default="users", choices=sorted(EXPORT_FIELDS))
+    args = parser.parse_args()
+
+    setup_logging(args.log_file, getattr(logging, args.log_level))
+
+    if args.export:
+        user_manager = UserManager(args.data_file, store=SqliteStore(args.store) if args.store else None)
+        spin_history = SpinHistory(SlotMachine().symbols)
+        spin_history.load(os.path.splitext(args.data_file)[0] + "_history.bin")
+        fmt, compressed = export_format(args.export)
+        rows = export_rows(args.export_kind, user_manager, spin_history, list(user_manager.balances))
+        with (gzip.open if compressed else open)(args.export, 'wt', encoding='utf-8', newline='') as f:
+            f.writelines(export_lines(rows, EXPORT_FIELDS[args.export_kind], fmt))
+        print(f"Выгрузка сохранена в {args.export}")
+        sys.exit(0)
+
     TOKEN = "Token"  # Замените на ваш токен
-    bot = SlotBot(TOKEN)
-    bot.run()
+    bot = SlotBot(TOKEN, concurrent_updates=args.concurrent_updates, base_url=args.base_url,
+                  profile_slow_ms=args.profile_slow_ms, profile_dir=args.profile_dir,
+                  metrics_port=args.metrics_port, data_file=args.data_file, record_file=args.record,
+                  store_file=args.store, engine=args.engine,
+                  machine_config=load_machine_config(args.machine) if args.machine else None)
+    bot.run(
+        webhook_url=args.webhook_url,
+        listen=args.listen,
+        port=args.port,
+        url_path=args.url_path,
+        secret_token=args.secret_token
+    )
@@ -0,0 +1,115 @@
+"""Проверка движка TableSlotMachine против SlotMachine.calculate_win.
+
+1. Вероятности классов в таблице в сумме дают 1.
+2. Классы настоящих спинов SlotMachine (барабаны + line_hits) согласуются с таблицей (хи-квадрат).
+3. Каждый спин TableSlotMachine платит ровно то, что calculate_win насчитал бы за его поле,
+   а классы его полей согласуются с таблицей (хи-квадрат).
+
+Пример:
+    python engine_check.py --spins 200000 --seed 1
+"""
+import argparse
+import math
+import random
+import time
+from collections import Counter
+
+from SlotsBot import SlotMachine, TableSlotMachine
+
+
+def chi_square_pvalue(statistic: float, dof: int) -> float:
+    """Верхний хвост хи-квадрат через приближение Уилсона-Хилферти (точно для dof от ~10)"""
+    if dof <= 0:
+        return 1.0
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def chi_square(observed: Counter, engine: TableSlotMachine, spins: int, min_expected: float = 5.0):
+    """(статистика, степени свободы, p): классы с ожиданием меньше min_expected объединены в один"""
+    statistic = 0.0
+    bins = 0
+    rest_expected = rest_observed = 0.0
+    for hits, probability in zip(engine.classes, engine.class_probabilities):
+        expected = probability * spins
+        if expected >= min_expected:
+            statistic += (observed.get(hits, 0) - expected) ** 2 / expected
+            bins += 1
+        else:
+            rest_expected += expected
+            rest_observed += observed.get(hits, 0)
+    if rest_expected > 0:
+        statistic += (rest_observed - rest_expected) ** 2 / rest_expected
+        bins += 1
+    return statistic, bins - 1, chi_square_pvalue(statistic, bins - 1)
+
+
+def spin_class(machine: SlotMachine, reels) -> tuple:
+    return tuple(sorted(machine.line_hits(reels)))
+
+
+def line_return(machine: SlotMachine, observed: Counter, spins: int) -> float:
+    """Выигрыш по линиям на единицу ставки по наблюдаемым классам"""
+    return sum(count * sum(machine.payouts[symbol][length] for symbol, length in hits)
+               for hits, count in observed.items()) / spins
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Статистическая проверка табличного движка слотов")
+    parser.add_argument("--spins", type=int, default=200000)
+    parser.add_argument("--bet", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--alpha", type=float, default=0.001, help="Порог p-значения для провала проверки")
+    parser.add_argument("--cache", default="engine_tables.json", help="Кэш таблиц движка")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    started = time.perf_counter()
+    engine = TableSlotMachine(args.cache)
+    print(f"Таблицы: {len(engine.classes)} классов, {sum(map(len, engine.pools))} полей в пулах "
+          f"({time.perf_counter() - started:.1f} с)")
+    failed = False
+
+    total = math.fsum(engine.class_probabilities)
+    rtp = math.fsum(p * m for p, m in zip(engine.class_probabilities, engine.class_multipliers))
+    print(f"Сумма вероятностей: {total:.15f}, точный возврат без джекпота: {rtp:.6f} ставки")
+    if abs(total - 1) > 1e-9:
+        print("❌ Вероятности классов не складываются в 1")
+        failed = True
+
+    # Настоящие спины: барабаны с весами и calculate_win
+    reference = SlotMachine()
+    observed = Counter()
+    for _ in range(args.spins):
+        reels, _, _ = reference.spin(args.bet)
+        observed[spin_class(reference, reels)] += 1
+    statistic, dof, p_value = chi_square(observed, engine, args.spins)
+    print(f"SlotMachine: хи-квадрат {statistic:.1f} при {dof} ст. св., p = {p_value:.4f}, "
+          f"возврат без джекпота {line_return(reference, observed, args.spins):.4f}")
+    failed |= p_value < args.alpha
+
+    # Табличный движок: выплата каждого спина сверяется с calculate_win по выпавшему полю
+    checker = SlotMachine()
+    observed = Counter()
+    mismatches = 0
+    for _ in range(args.spins):
+        jackpot_before = engine.jackpot
+        reels, win_amount, is_jackpot = engine.spin(args.bet)
+        checker.jackpot = jackpot_before
+        if checker.calculate_win(reels, args.bet) != (win_amount, is_jackpot):
+            mismatches += 1
+        observed[spin_class(checker, reels)] += 1
+    statistic, dof, p_value = chi_square(observed, engine, args.spins)
+    print(f"TableSlotMachine: хи-квадрат {statistic:.1f} при {dof} ст. св., p = {p_value:.4f}, "
+          f"возврат без джекпота {line_return(checker, observed, args.spins):.4f}")
+    print(f"Расхождений с calculate_win: {mismatches}")
+    failed |= p_value < args.alpha or mismatches > 0
+
+    print("❌ Проверка не пройдена" if failed else "✅ Движки эквивалентны")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
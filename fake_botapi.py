@@ -0,0 +1,186 @@
+"""Поддельный сервер Telegram Bot API для нагрузочных тестов и воспроизведения записей.
+
+Запускается в том же процессе, что и бот (SlotBot(..., base_url=server.base_url)).
+Имитирует задержку сети, флуд-контроль (429 с retry_after) и лимиты на чат.
+"""
+import asyncio
+import json
+import random
+import re
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+
+class TokenBucket:
+    """Простейший token bucket для лимитов сервера"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> Optional[float]:
+        """None - разрешено, иначе через сколько секунд появится токен"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+
+class FakeBotAPI:
+    """HTTP-сервер, отвечающий на методы Bot API, которые использует SlotBot"""
+
+    # Методы, которые отправляют или меняют сообщения и попадают под лимиты Telegram
+    LIMITED_METHODS = {'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendDocument'}
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05, jitter: float = 0.02,
+                 global_rate: float = 30, chat_rate: float = 1, chat_burst: int = 3, flood_control: bool = True):
+        self.host = host
+        self.port = port
+        self.latency = latency  # Средняя задержка ответа, с
+        self.jitter = jitter
+        self.flood_control = flood_control
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        # Собственный генератор, чтобы не сбивать последовательность random бота при воспроизведении
+        self._random = random.Random()
+
+        self.calls = defaultdict(int)  # Метод -> число вызовов
+        self.retry_after = defaultdict(int)  # Метод -> число ответов 429
+        self.chat_calls = defaultdict(int)  # Чат -> число вызовов
+        self.listeners = []  # Функции (chat_id, method, params), вызываемые на каждый успешный вызов
+        self.documents: List[dict] = []  # Отправленные файлы: chat_id, имя, содержимое
+
+        self._message_id = 0
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        """Соединение HTTP/1.1 с keep-alive: httpx переиспользует соединения"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                path = request_line.decode('latin-1').split()[1]
+                status, payload = await self.handle(path, headers.get('content-type', ''), body)
+
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_params(content_type: str, body: bytes) -> dict:
+        if content_type.startswith('multipart/form-data'):
+            # Полноценный разбор не нужен: достаточно текстовых полей и содержимого файла
+            params = {}
+            boundary = content_type.split('boundary=')[-1].strip('"').encode('latin-1')
+            for part in body.split(b'--' + boundary):
+                head, _, content = part.partition(b'\r\n\r\n')
+                match = re.search(rb'name="([^"]+)"(?:; filename="([^"]*)")?', head)
+                if not match:
+                    continue
+                content = content[:-2] if content.endswith(b'\r\n') else content
+                if match.group(2) is not None:
+                    params['_file_name'] = match.group(2).decode('utf-8', 'replace')
+                    params['_file'] = content
+                else:
+                    params[match.group(1).decode()] = content.decode('utf-8', 'replace')
+            return params
+        return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+    def _message(self, chat_id, text: str = "", message_id: int = None) -> dict:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text,
+        }
+
+    async def handle(self, path: str, content_type: str, body: bytes):
+        """Обработка вызова метода: (HTTP-код, JSON-ответ)"""
+        method = path.rsplit('/', 1)[-1]
+        params = self._parse_params(content_type, body)
+        chat_id = int(params['chat_id']) if params.get('chat_id', '').lstrip('-').isdigit() else None
+
+        await asyncio.sleep(max(0.0, self._random.gauss(self.latency, self.jitter)))
+
+        if self.flood_control and method in self.LIMITED_METHODS:
+            wait = self._global_bucket.take()
+            if wait is None and chat_id is not None:
+                bucket = self._chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+                wait = bucket.take()
+            if wait is not None:
+                self.retry_after[method] += 1
+                retry = max(1, int(wait + 0.999))
+                return 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {retry}",
+                    'parameters': {'retry_after': retry},
+                }
+
+        self.calls[method] += 1
+        if chat_id is not None:
+            self.chat_calls[chat_id] += 1
+        if method == 'sendDocument':
+            self.documents.append({'chat_id': chat_id, 'name': params.get('_file_name'), 'data': params.get('_file')})
+        for listener in self.listeners:
+            listener(chat_id, method, params)
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'SlotBot', 'username': 'slot_test_bot',
+                      'can_join_groups': False, 'can_read_all_group_messages': False,
+                      'supports_inline_queries': False}
+        elif method == 'getUpdates':
+            result = []
+        elif method in ('sendMessage', 'sendDocument'):
+            result = self._message(chat_id, params.get('text', ''))
+        elif method in ('editMessageText', 'editMessageReplyMarkup'):
+            message_id = int(params.get('message_id', 0)) or None
+            result = self._message(chat_id, params.get('text', ''), message_id)
+        else:
+            # answerCallbackQuery, deleteWebhook, setWebhook, close и т.п.
+            result = True
+        return 200, {'ok': True, 'result': result}
@@ -0,0 +1,240 @@
+"""Нагрузочный тест SlotBot: имитируемые игроки против поддельного Bot API в том же процессе.
+
+Обновления попадают в очередь приложения и проходят через настоящие обработчики бота.
+Поддельный сервер имитирует задержку сети, флуд-контроль и лимиты на чат.
+
+Пример:
+    python loadtest.py --users 2000 --duration 60 --rate 0.2 --concurrent-updates 64
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+from typing import Dict
+
+from telegram import Update
+
+from SlotsBot import SlotBot
+from fake_botapi import FakeBotAPI
+
+# Признаки того, что спин завершился (финальный результат или отказ)
+SPIN_DONE_MARKERS = ("Новый баланс", "Недостаточно средств", "слишком много спинов", "Произошла ошибка")
+
+
+class UpdateFactory:
+    """Сборка обновлений Telegram от имени имитируемых игроков"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Update:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self.user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return Update.de_json({'update_id': next(self._update_ids), 'message': message}, self.bot)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'text': "🎰",
+        }
+        callback_query = {
+            'id': str(next(self._update_ids)),
+            'from': self.user(user_id),
+            'message': message,
+            'chat_instance': str(user_id),
+            'data': data,
+        }
+        return Update.de_json({'update_id': next(self._update_ids), 'callback_query': callback_query}, self.bot)
+
+
+class SpinTracker:
+    """Ловит на поддельном сервере сообщение, которым заканчивается спин игрока"""
+
+    def __init__(self):
+        self._waiting: Dict[int, asyncio.Future] = {}
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[chat_id] = future
+        return future
+
+    def forget(self, chat_id: int) -> None:
+        self._waiting.pop(chat_id, None)
+
+    def __call__(self, chat_id, method, params):
+        future = self._waiting.get(chat_id)
+        if future is None or future.done():
+            return
+        if any(marker in params.get('text', '') for marker in SPIN_DONE_MARKERS):
+            future.set_result(time.perf_counter())
+            del self._waiting[chat_id]
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса (Linux), иначе пиковый"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_load(args) -> dict:
+    fake = FakeBotAPI(latency=args.latency, jitter=args.latency / 3, chat_rate=args.chat_rate,
+                      flood_control=not args.no_flood_control)
+    await fake.start()
+
+    data_file = os.path.join(tempfile.mkdtemp(prefix="slotbot-load-"), "user_data.json")
+    bot = SlotBot("123456:LOADTEST", concurrent_updates=args.concurrent_updates,
+                  base_url=fake.base_url, data_file=data_file)
+    app = bot.app
+    await app.initialize()
+    await bot._on_start(app)
+    await app.start()
+
+    factory = UpdateFactory(app.bot)
+    tracker = SpinTracker()
+    fake.listeners.append(tracker)
+
+    if args.turbo:
+        for user_id in range(1, args.users + 1):
+            bot.user_manager.set_turbo(user_id, True)
+
+    actions = ['spin', 'callback', 'bonus', 'leaderboard']
+    weights = [args.w_spin, args.w_callback, args.w_bonus, args.w_leaderboard]
+    report = {'latencies': [], 'api_per_spin': [], 'timeouts': 0, 'other': 0, 'updates': 0}
+
+    rss_start = rss_mb()
+    started = time.perf_counter()
+    deadline = started + args.duration
+
+    async def player(user_id: int):
+        # Игроки подключаются постепенно, а не все в первую миллисекунду
+        await asyncio.sleep(random.uniform(0, min(args.duration / 4, 5)))
+        while time.perf_counter() < deadline:
+            action = random.choices(actions, weights)[0]
+            if action in ('spin', 'callback'):
+                update = factory.message(user_id, "/spin") if action == 'spin' else factory.callback(user_id, "spin")
+                done = tracker.expect(user_id)
+                calls_before = fake.chat_calls[user_id]
+                sent_at = time.perf_counter()
+                await app.update_queue.put(update)
+                try:
+                    finished_at = await asyncio.wait_for(done, timeout=args.spin_timeout)
+                    report['latencies'].append(finished_at - sent_at)
+                    report['api_per_spin'].append(fake.chat_calls[user_id] - calls_before)
+                except asyncio.TimeoutError:
+                    # Спин отброшен очередью или лимитом частоты, либо застрял
+                    tracker.forget(user_id)
+                    report['timeouts'] += 1
+            else:
+                text = "/bonus" if action == 'bonus' else "/leaderboard"
+                await app.update_queue.put(factory.message(user_id, text))
+                report['other'] += 1
+            report['updates'] += 1
+            # Пауза на раздумья между действиями: в среднем 1/rate секунд
+            await asyncio.sleep(random.expovariate(args.rate))
+
+    await asyncio.gather(*(player(user_id) for user_id in range(1, args.users + 1)))
+    elapsed = time.perf_counter() - started
+    rss_end = rss_mb()
+
+    await app.stop()
+    await bot._on_stop(app)
+    await app.shutdown()
+    await fake.stop()
+
+    latencies = report['latencies']
+    return {
+        'users': args.users,
+        'elapsed': elapsed,
+        'updates': report['updates'],
+        'spins': len(latencies),
+        'spin_timeouts': report['timeouts'],
+        'throughput': len(latencies) / elapsed,
+        'latency': {q: percentile(latencies, q) for q in (0.5, 0.95, 0.99)},
+        'latency_max': max(latencies, default=0.0),
+        'api_per_spin': sum(report['api_per_spin']) / len(report['api_per_spin']) if latencies else 0.0,
+        'api_calls': dict(fake.calls),
+        'api_429': dict(fake.retry_after),
+        'rss_start': rss_start,
+        'rss_end': rss_end,
+        'throttled': bot.rate_limiter.get_metrics()['throttled'],
+        'admission': bot.admission.get_metrics(),
+        'loop_lag_max': bot.loop_monitor.lag_max,
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"\n🎰 Нагрузочный тест: {result['users']} игроков, {result['elapsed']:.1f} с")
+    print(f"Обновлений отправлено: {result['updates']} ({result['updates'] / result['elapsed']:.1f}/с)")
+    print(f"Спинов завершено: {result['spins']} ({result['throughput']:.1f}/с), "
+          f"не дождались: {result['spin_timeouts']}")
+    latency = result['latency']
+    print(f"Задержка спина, с: p50 {latency[0.5]:.2f}, p95 {latency[0.95]:.2f}, p99 {latency[0.99]:.2f}, "
+          f"макс {result['latency_max']:.2f}")
+    print(f"Вызовов Bot API на спин: {result['api_per_spin']:.1f}")
+    print(f"Вызовы Bot API: {result['api_calls']}")
+    print(f"Ответы 429: {result['api_429']}")
+    print(f"Ограничено лимитом частоты: {result['throttled']}")
+    print(f"Контроль спинов: {result['admission']}")
+    print(f"Макс. задержка цикла событий: {result['loop_lag_max'] * 1000:.0f} мс")
+    print(f"RSS: {result['rss_start']:.1f} → {result['rss_end']:.1f} МБ "
+          f"(+{result['rss_end'] - result['rss_start']:.1f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест SlotBot против поддельного Bot API")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30, help="Длительность, с")
+    parser.add_argument("--rate", type=float, default=0.5, help="Действий в секунду на игрока (между ответами)")
+    parser.add_argument("--w-spin", type=float, default=5, help="Вес /spin")
+    parser.add_argument("--w-callback", type=float, default=3, help="Вес кнопки «Крутить снова»")
+    parser.add_argument("--w-bonus", type=float, default=1, help="Вес /bonus")
+    parser.add_argument("--w-leaderboard", type=float, default=1, help="Вес /leaderboard")
+    parser.add_argument("--concurrent-updates", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.05, help="Средняя задержка Bot API, с")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="Сообщений в секунду на чат до 429")
+    parser.add_argument("--no-flood-control", action="store_true", help="Не отвечать 429")
+    parser.add_argument("--turbo", action="store_true", help="Включить турбо-режим всем игрокам")
+    parser.add_argument("--spin-timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    logging.basicConfig(level=logging.ERROR)
+
+    print_report(asyncio.run(run_load(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Несколько ботов (токенов) в одном процессе с общим движком.
+
+Каждый бот - отдельное Application со своими очередями, лимитами частоты и метриками.
+Боты с одинаковым "wallet" делят игроков: балансы, статистику, историю спинов и
+напоминания о бонусе. С "shared_jackpot" все боты растят один джекпот.
+Исходящие вызовы Bot API всех ботов проходят через общий OutboundRateLimiter:
+общий лимит процесса и лимит на чат у каждого бота свой.
+"machine" (у бота или общий) - веса и выплаты из файла rtp_solver.py; с "shared_jackpot"
+машина общая, и действует конфигурация первого бота.
+
+Пример конфигурации (multibot.json):
+    {
+      "tenants": [
+        {"name": "lucky", "token": "123:AAA", "wallet": "main"},
+        {"name": "vegas", "token": "456:BBB", "wallet": "main", "metrics_port": 9109},
+        {"name": "test", "token": "789:CCC"}
+      ],
+      "wallets": {"main": "main_data.json"},
+      "shared_jackpot": true,
+      "concurrent_updates": 32,
+      "rate_limit": {"overall": 30, "per_chat": 1, "chat_burst": 3}
+    }
+
+    python multibot.py multibot.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+from typing import Dict, List
+
+from SlotsBot import OutboundRateLimiter, SlotBot, load_machine_config, setup_logging
+
+
+def load_config(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    names = [tenant['name'] for tenant in config.get('tenants', [])]
+    if not names:
+        raise ValueError("В конфигурации нет ни одного бота (tenants)")
+    if len(set(names)) != len(names):
+        raise ValueError("Имена ботов (name) должны быть уникальными")
+    return config
+
+
+def build_bots(config: dict, base_url: str = None) -> List[SlotBot]:
+    """Боты в порядке конфигурации; первый бот каждого кошелька - его владелец"""
+    limits = config.get('rate_limit', {})
+    outbound = OutboundRateLimiter(overall_rate=limits.get('overall', 30),
+                                   chat_rate=limits.get('per_chat', 1),
+                                   chat_burst=limits.get('chat_burst', 3))
+    wallets = config.get('wallets', {})
+    data_dir = config.get('data_dir', '.')
+
+    owners: Dict[str, SlotBot] = {}
+    jackpot_machine = None
+    bots = []
+    for tenant in config['tenants']:
+        name = tenant['name']
+        wallet = tenant.get('wallet', name)
+        owner = owners.get(wallet)
+        machine = tenant.get('machine', config.get('machine'))
+        bot = SlotBot(tenant['token'],
+                      concurrent_updates=tenant.get('concurrent_updates', config.get('concurrent_updates', 1)),
+                      base_url=tenant.get('base_url', base_url),
+                      metrics_port=tenant.get('metrics_port'),
+                      data_file=os.path.join(data_dir, wallets.get(wallet, f"{wallet}_data.json")),
+                      record_file=tenant.get('record'),
+                      store_file=tenant.get('store'),
+                      engine=tenant.get('engine', config.get('engine', 'reels')),
+                      machine_config=load_machine_config(machine) if machine else None,
+                      tenant=name,
+                      wallet=owner,
+                      slot_machine=jackpot_machine,
+                      rate_limiter=outbound.for_tenant(name))
+        if owner is None:
+            owners[wallet] = bot
+        if config.get('shared_jackpot') and jackpot_machine is None:
+            jackpot_machine = bot.slot_machine
+        bots.append(bot)
+    return bots
+
+
+async def start_bots(bots: List[SlotBot]) -> None:
+    for bot in bots:
+        app = bot.app
+        await app.initialize()
+        await bot._on_start(app)
+        await app.updater.start_polling()
+        await app.start()
+        logging.info(f"Бот {bot.tenant} (@{app.bot.username}) запущен")
+
+
+async def stop_bots(bots: List[SlotBot]) -> None:
+    """Сначала перестаем принимать обновления у всех ботов, затем сохраняем данные и закрываем клиенты"""
+    for bot in bots:
+        if bot.app.updater.running:
+            await bot.app.updater.stop()
+        if bot.app.running:
+            await bot.app.stop()
+    # Владельцы кошельков - последними: их напоминания отправляются через остальных ботов
+    for bot in sorted(bots, key=lambda b: b.wallet_owner):
+        await bot._on_stop(bot.app)
+    for bot in bots:
+        await bot.app.shutdown()
+
+
+async def serve(config: dict, base_url: str = None) -> None:
+    bots = build_bots(config, base_url)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await start_bots(bots)
+        print(f"🎰 Запущено ботов: {len(bots)}")
+        await stop.wait()
+    finally:
+        print("\nСохранение данных перед завершением...")
+        await stop_bots(bots)
+        print("Данные сохранены. До свидания!")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Несколько слот-ботов в одном процессе")
+    parser.add_argument("config", help="JSON с ботами, кошельками и лимитами")
+    parser.add_argument("--base-url", default=None,
+                        help="Адрес Bot API для всех ботов, например http://127.0.0.1:8081/bot")
+    parser.add_argument("--log-file", default="slot_bot.log")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    setup_logging(args.log_file, getattr(logging, args.log_level.upper(), logging.INFO))
+    asyncio.run(serve(load_config(args.config), args.base_url))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Воспроизведение записанных обновлений (SlotBot --record) против поддельного Bot API.
+
+Обновления отправляются в очередь приложения с теми же интервалами, что в записи,
+ускоренными в --speed раз; asyncio.sleep внутри бота ускоряется так же.
+Итоговое состояние UserManager можно сохранить и сравнить с другим прогоном.
+
+Пример:
+    python replay.py updates.jsonl.gz --speed 10
+    python replay.py updates.jsonl.gz --speed max --sequential --seed 1 --state-out run1.json
+    python replay.py updates.jsonl.gz --speed max --sequential --seed 1 --compare run1.json
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from telegram import Update
+
+import SlotsBot
+from SlotsBot import SlotBot
+from fake_botapi import FakeBotAPI
+
+
+class VirtualAsyncio:
+    """Модуль asyncio для SlotsBot, в котором sleep ускорен в speed раз"""
+
+    def __init__(self, speed: float):
+        self.speed = speed
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+    async def sleep(self, delay, result=None):
+        return await asyncio.sleep(0 if math.isinf(self.speed) else delay / self.speed, result)
+
+
+class VirtualClock:
+    """Время записи для лимитов частоты: ускоренное реальное или время текущего обновления"""
+
+    def __init__(self, speed: float):
+        self.speed = speed
+        self.recorded = 0.0  # Время последнего отправленного обновления по записи
+        self._start = time.monotonic()
+
+    def __call__(self) -> float:
+        if math.isinf(self.speed):
+            return self.recorded
+        return (time.monotonic() - self._start) * self.speed
+
+
+def load_recording(path: str):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def snapshot_state(data_file: str) -> dict:
+    """Состояние для сравнения прогонов: без дат бонусов, зависящих от реального времени"""
+    with open(data_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {
+        'balances': data.get('balances', {}),
+        'stats': data.get('stats', {}),
+        'user_settings': data.get('user_settings', {}),
+        'bonus_claimed': sorted(uid for uid, claimed in data.get('daily_bonuses', {}).items() if claimed),
+        'jackpot': data.get('jackpot'),
+    }
+
+
+def state_digest(state: dict) -> str:
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def compare_states(left: dict, right: dict) -> list:
+    """Список расхождений между двумя снимками состояния"""
+    differences = []
+    for section in ('balances', 'stats', 'user_settings'):
+        users = set(left.get(section, {})) | set(right.get(section, {}))
+        for user_id in sorted(users):
+            a, b = left[section].get(user_id), right[section].get(user_id)
+            if a != b:
+                differences.append(f"{section}[{user_id}]: {a} != {b}")
+    if left.get('bonus_claimed') != right.get('bonus_claimed'):
+        differences.append("bonus_claimed: разные наборы игроков")
+    if left.get('jackpot') != right.get('jackpot'):
+        differences.append(f"jackpot: {left.get('jackpot')} != {right.get('jackpot')}")
+    return differences
+
+
+def is_idle(bot: SlotBot) -> bool:
+    return not (bot.app.update_queue.qsize() or bot.update_processor.pending
+                or bot._spin_consumers or bot.admission.get_metrics()['tasks'])
+
+
+async def wait_idle(bot: SlotBot) -> None:
+    """Ждем, пока бот обработает все обновления и спины"""
+    # Обновление, только что взятое из очереди, еще не учтено процессором: проверяем несколько итераций
+    idle_checks = 0
+    while idle_checks < 3:
+        await asyncio.sleep(0)
+        idle_checks = idle_checks + 1 if is_idle(bot) else 0
+
+
+async def run_replay(args) -> dict:
+    speed = math.inf if args.speed == 'max' else float(args.speed)
+    SlotsBot.asyncio = VirtualAsyncio(speed)
+    clock = VirtualClock(speed)
+
+    fake = FakeBotAPI(latency=args.latency, jitter=0.0, flood_control=False)
+    await fake.start()
+
+    data_file = os.path.join(tempfile.mkdtemp(prefix="slotbot-replay-"), "user_data.json")
+    if args.initial_state:
+        shutil.copy(args.initial_state, data_file)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    bot = SlotBot("123456:REPLAY", concurrent_updates=1 if args.sequential else args.concurrent_updates,
+                  base_url=fake.base_url, data_file=data_file)
+    bot.rate_limiter.clock = clock
+    app = bot.app
+    # Монитор цикла и сервер метрик не запускаем: ускоренный sleep исказил бы их показания
+    await app.initialize()
+    await app.start()
+
+    records = 0
+    started = time.perf_counter()
+    for record in load_recording(args.recording):
+        if not math.isinf(speed):
+            delay = record['t'] / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        clock.recorded = record['t']
+        update = Update.de_json(record['u'], app.bot)
+        records += 1
+        if args.sequential:
+            await app.process_update(update)
+            await wait_idle(bot)
+        else:
+            await app.update_queue.put(update)
+
+    await wait_idle(bot)
+    elapsed = time.perf_counter() - started
+
+    await app.stop()
+    await bot._on_stop(app)
+    await app.shutdown()
+    await fake.stop()
+
+    state = snapshot_state(data_file)
+    return {
+        'updates': records,
+        'recorded': clock.recorded,
+        'elapsed': elapsed,
+        'api_calls': dict(fake.calls),
+        'throttled': bot.rate_limiter.get_metrics()['throttled'],
+        'users': len(state['balances']),
+        'state': state,
+        'digest': state_digest(state),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений SlotBot")
+    parser.add_argument("recording", help="Файл записи (.jsonl или .jsonl.gz)")
+    parser.add_argument("--speed", default="1", help="Ускорение: 1, 10, ... или max")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Следующее обновление - только после полной обработки предыдущего (детерминированно)")
+    parser.add_argument("--concurrent-updates", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка поддельного Bot API, с")
+    parser.add_argument("--seed", type=int, default=None, help="Зерно random для повторяемых результатов")
+    parser.add_argument("--initial-state", default=None, help="Начальный файл данных пользователей")
+    parser.add_argument("--state-out", default=None, help="Сохранить итоговое состояние в JSON")
+    parser.add_argument("--compare", default=None, help="Сравнить итоговое состояние с сохраненным")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    result = asyncio.run(run_replay(args))
+
+    print(f"\n🎰 Воспроизведено обновлений: {result['updates']} "
+          f"({result['recorded']:.1f} с записи за {result['elapsed']:.1f} с)")
+    print(f"Вызовы Bot API: {result['api_calls']}")
+    print(f"Ограничено лимитом частоты: {result['throttled']}")
+    print(f"Игроков: {result['users']}, джекпот: {result['state']['jackpot']}, "
+          f"отпечаток состояния: {result['digest']}")
+
+    if args.state_out:
+        with open(args.state_out, 'w', encoding='utf-8') as f:
+            json.dump(result['state'], f, ensure_ascii=False, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            differences = compare_states(json.load(f), result['state'])
+        if differences:
+            print(f"❌ Состояние отличается ({len(differences)} расхождений):")
+            for line in differences[:20]:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print("✅ Состояние совпадает")
+
+
+if __name__ == "__main__":
+    main()
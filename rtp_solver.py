@@ -0,0 +1,381 @@
+"""Подбор весов символов и выплат SlotMachine под целевой RTP, частоту выигрыша и волатильность.
+
+Метрики считаются точно, без симуляции:
+- возврат по линиям: каждая линия - 5 независимых ячеек с одними весами, поэтому он равен
+  5 × E[выплата линии]; выигрышных раскладов линии около 2000 из 9^5, они перебираются один раз;
+- дисперсия: пересекающиеся линии делят ячейки на одних и тех же позициях ({0,4}, {2} или {1,3}),
+  при известных общих ячейках линии независимы и E[Li·Lj] = Σ P(общие) · E[L | общие]²;
+- частота выигрыша: при известных центральных ячейках (как в TableSlotMachine) вероятность
+  проигрыша каждой группы линий выражается формулой, остается 9^4 слагаемых.
+Одна оценка занимает десятки миллисекунд, поэтому оптимизатор (Нелдер-Мид) перебирает сотни
+вариантов за секунды.
+
+Что подбирается (--solve):
+- weights: веса p_i ∝ p0_i^κ · exp(θ·z_i), z_i - нормированный логарифм выплаты символа;
+  κ меняет концентрацию весов (частоту серий), θ сдвигает вес к дорогим или дешевым символам;
+- payouts: выплаты a · x^γ, γ меняет крутизну таблицы (волатильность), a - под целевой RTP;
+- both: все вместе.
+
+RTP здесь - полный возврат: линии + отчисления в джекпот + пополнение джекпота после выигрыша
+при средней ставке --bet. Волатильность - стандартное отклонение выплаты по линиям за спин
+в ставках (без джекпота).
+
+Пример:
+    python rtp_solver.py --rtp 0.96 --hit-rate 0.25 --volatility 3:6 --out machine.json
+    python SlotsBot.py --machine machine.json
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import time
+from collections import defaultdict
+
+from SlotsBot import SlotMachine, load_machine_config
+
+JACKPOT_SYMBOL = '💰'
+JACKPOT_RESET = 10000  # Джекпот после выигрыша, как в SlotMachine.calculate_win
+LINES = 5
+# Общие позиции ячеек у пар линий -> число таких пар из 10:
+# строки не пересекаются; верхняя строка и диагональ 1 делят позиции 0 и 4, верхняя строка и
+# диагональ 2 - позицию 2 (для нижней строки наоборот); средняя строка и обе диагонали - 1 и 3
+LINE_PAIRS = {(): 3, (0, 4): 2, (2,): 2, (1, 3): 3}
+
+
+class LineModel:
+    """Точные метрики слот-машины по весам и выплатам"""
+
+    def __init__(self, machine: SlotMachine):
+        self.symbols = machine.symbols
+        n = len(self.symbols)
+        # Какая серия выигрывает на линии, не зависит от весов и выплат
+        self.patterns = []
+        for cells in itertools.product(range(n), repeat=5):
+            hit = machine.line_hit([self.symbols[i] for i in cells])
+            if hit:
+                self.patterns.append((cells, self.symbols.index(hit[0]), hit[1]))
+        self._win_cache = (None, None)
+
+    def metrics(self, probabilities, payouts: dict, bet: float, jackpot_increment: float) -> dict:
+        total = sum(probabilities)
+        p = [w / total for w in probabilities]
+        table = [payouts[symbol] for symbol in self.symbols]
+
+        mean = second = 0.0
+        shared = {positions: defaultdict(float) for positions in LINE_PAIRS if positions}
+        for cells, symbol, count in self.patterns:
+            value = table[symbol].get(count, 0)
+            if not value:
+                continue
+            weighted = p[cells[0]] * p[cells[1]] * p[cells[2]] * p[cells[3]] * p[cells[4]] * value
+            mean += weighted
+            second += weighted * value
+            for positions, sums in shared.items():
+                sums[tuple(cells[i] for i in positions)] += weighted
+
+        # E[Li·Lj] для пар с общими ячейками: Σ (Σ w·v)² / P(общие)
+        cross = LINE_PAIRS[()] * mean * mean
+        for positions, sums in shared.items():
+            cross += LINE_PAIRS[positions] * sum(s * s / math.prod(p[i] for i in key) for key, s in sums.items())
+        line_rtp = LINES * mean
+        variance = LINES * second + 2 * cross - line_rtp * line_rtp
+
+        jackpot_lines = LINES * p[self.symbols.index(JACKPOT_SYMBOL)] ** 5
+        jackpot_rtp = jackpot_increment + jackpot_lines * JACKPOT_RESET / bet
+        return {
+            'rtp': line_rtp + jackpot_rtp,
+            'line_rtp': line_rtp,
+            'jackpot_rtp': jackpot_rtp,
+            'hit_rate': self.win_probability(p),
+            'volatility': math.sqrt(max(variance, 0.0)),
+            'jackpot_every': 1 / jackpot_lines if jackpot_lines else math.inf,
+        }
+
+    def line_rtp(self, p, payouts: dict) -> float:
+        """Только возврат по линиям (p нормированы) - для подгонки масштаба выплат"""
+        table = [payouts[symbol] for symbol in self.symbols]
+        return LINES * math.fsum(p[c[0]] * p[c[1]] * p[c[2]] * p[c[3]] * p[c[4]] * table[symbol].get(count, 0)
+                                 for c, symbol, count in self.patterns)
+
+    def win_probability(self, p) -> float:
+        """P(хотя бы одна выигрышная линия); все серии 3+ платят, поэтому зависит только от весов"""
+        key = tuple(p)
+        if self._win_cache[0] == key:
+            return self._win_cache[1]
+        r = range(len(p))
+        # Средняя строка (l, h1, m, h3, r) без выигрыша при известных h1, h3
+        middle = {}
+        for h1, h3 in itertools.product(r, repeat=2):
+            middle[h1, h3] = sum(p[m] * (1 - (p[h1] if m == h1 else 0)) * (1 - (p[h3] if m == h3 else 0))
+                                 for m in r if not m == h1 == h3)
+
+        def group(x, h1, y, h3):
+            """Строка (a, b, x, c, e) и диагональ (a, h1, y, h3, e) без выигрыша при известных x, h1, y, h3"""
+            if h1 == y == h3:
+                return 0.0
+            # Диагональ: a не продолжает серию h1 = y, e не продолжает серию y = h3
+            left = 1 - (p[h1] if h1 == y else 0)
+            right = 1 - (p[h3] if h3 == y else 0)
+            # Строка выигрывает, если b = c = x, либо b = x = a, либо c = x = e
+            px = p[x]
+            lose = 1 - px * px
+            edge = px * (1 - px)
+            left_x = 0 if h1 == y == x else px
+            right_x = 0 if h3 == y == x else px
+            return lose * left * right - edge * left_x * right - edge * left * right_x
+
+        groups = {key: group(*key) for key in itertools.product(r, repeat=4)}
+        lose = math.fsum(p[h1] * p[h3] * p[x] * p[y] * groups[x, h1, y, h3] * groups[y, h1, x, h3] * middle[h1, h3]
+                         for x, h1, y, h3 in itertools.product(r, repeat=4))
+        self._win_cache = (key, 1 - lose)
+        return 1 - lose
+
+
+def tilt_weights(base, values, kappa: float, theta: float) -> list:
+    weights = [b ** kappa * math.exp(theta * z) for b, z in zip(base, values)]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def shape_payouts(base: dict, gamma: float, scale: float) -> dict:
+    """Выплаты scale · x^gamma, целые и строго растущие с длиной серии"""
+    payouts = {}
+    for symbol, row in base.items():
+        shaped = {}
+        previous = 0
+        for count in sorted(row):
+            previous = max(previous + 1, round(scale * row[count] ** gamma))
+            shaped[count] = previous
+        payouts[symbol] = shaped
+    return payouts
+
+
+def nelder_mead(f, x0, steps, iterations: int = 200, tolerance: float = 1e-10):
+    simplex = [list(x0)] + [[x + (step if i == j else 0) for j, x in enumerate(x0)] for i, step in enumerate(steps)]
+    values = [f(x) for x in simplex]
+    for _ in range(iterations):
+        order = sorted(range(len(simplex)), key=values.__getitem__)
+        simplex = [simplex[i] for i in order]
+        values = [values[i] for i in order]
+        if values[-1] - values[0] < tolerance:
+            break
+        centroid = [sum(column) / (len(simplex) - 1) for column in zip(*simplex[:-1])]
+
+        def toward(t):
+            return [c + t * (c - w) for c, w in zip(centroid, simplex[-1])]
+
+        reflected = toward(1)
+        reflected_value = f(reflected)
+        if reflected_value < values[0]:
+            expanded = toward(2)
+            expanded_value = f(expanded)
+            if expanded_value < reflected_value:
+                simplex[-1], values[-1] = expanded, expanded_value
+            else:
+                simplex[-1], values[-1] = reflected, reflected_value
+        elif reflected_value < values[-2]:
+            simplex[-1], values[-1] = reflected, reflected_value
+        else:
+            contracted = toward(0.5 if reflected_value < values[-1] else -0.5)
+            contracted_value = f(contracted)
+            if contracted_value < min(reflected_value, values[-1]):
+                simplex[-1], values[-1] = contracted, contracted_value
+            else:
+                for i in range(1, len(simplex)):
+                    simplex[i] = [b + 0.5 * (x - b) for b, x in zip(simplex[0], simplex[i])]
+                    values[i] = f(simplex[i])
+    best = min(range(len(simplex)), key=values.__getitem__)
+    return simplex[best], values[best]
+
+
+class Solver:
+    # Границы параметров: за ними штраф, чтобы симплекс не уходил в вырожденные таблицы
+    BOUNDS = {'kappa': (0.2, 4.0), 'theta': (-3.0, 3.0), 'gamma': (0.3, 3.0)}
+    STEPS = {'kappa': 0.3, 'theta': 0.3, 'gamma': 0.2}
+    NEUTRAL = {'kappa': 1.0, 'theta': 0.0, 'gamma': 1.0}
+
+    def __init__(self, machine: SlotMachine, args):
+        self.model = LineModel(machine)
+        self.machine = machine
+        self.args = args
+        self.params = {'weights': ['kappa', 'theta'], 'payouts': ['gamma'],
+                       'both': ['kappa', 'theta', 'gamma']}[args.solve]
+        logs = [math.log(machine.payouts[symbol][min(machine.payouts[symbol])]) for symbol in machine.symbols]
+        mean = sum(logs) / len(logs)
+        spread = math.sqrt(sum((v - mean) ** 2 for v in logs) / len(logs)) or 1.0
+        self.values = [(v - mean) / spread for v in logs]
+        self.evaluations = 0
+
+    def config(self, x) -> dict:
+        params = dict(self.NEUTRAL, **dict(zip(self.params, x)))
+        for name, (low, high) in self.BOUNDS.items():
+            params[name] = min(max(params[name], low), high)
+        probabilities = tilt_weights(self.machine.probabilities, self.values, params['kappa'], params['theta'])
+        payouts = self.machine.payouts
+        if 'gamma' in self.params:
+            payouts = self.fit_payouts(probabilities, params['gamma'])
+        return {'probabilities': probabilities, 'payouts': payouts}
+
+    def fit_payouts(self, probabilities, gamma: float) -> dict:
+        """Масштаб выплат под целевой RTP: возврат по линиям линеен по масштабу, после округления - поправка"""
+        jackpot_lines = LINES * probabilities[self.machine.symbols.index(JACKPOT_SYMBOL)] ** 5
+        target = self.args.rtp - self.machine.jackpot_increment - jackpot_lines * JACKPOT_RESET / self.args.bet
+        scale = target / self.model.line_rtp(probabilities, shape_payouts(self.machine.payouts, gamma, 1.0))
+        # Целые выплаты сдвигают возврат: уточняем масштаб по фактическому
+        for _ in range(4):
+            payouts = shape_payouts(self.machine.payouts, gamma, scale)
+            line_rtp = self.model.line_rtp(probabilities, payouts)
+            if abs(line_rtp - target) < 1e-4:
+                break
+            scale *= target / line_rtp
+        return payouts
+
+    def measure(self, probabilities, payouts) -> dict:
+        self.evaluations += 1
+        return self.model.metrics(probabilities, payouts, self.args.bet, self.machine.jackpot_increment)
+
+    def loss(self, metrics: dict) -> float:
+        args = self.args
+        loss = ((metrics['rtp'] - args.rtp) / 0.001) ** 2
+        if args.hit_rate is not None:
+            loss += ((metrics['hit_rate'] - args.hit_rate) / 0.002) ** 2
+        if args.volatility:
+            low, high = args.volatility
+            sigma = metrics['volatility']
+            if sigma < low:
+                loss += ((low - sigma) / (0.01 * low)) ** 2
+            elif sigma > high:
+                loss += ((sigma - high) / (0.01 * high)) ** 2
+        return loss
+
+    def objective(self, x) -> float:
+        params = dict(zip(self.params, x))
+        penalty = 0.0
+        for name, value in params.items():
+            low, high = self.BOUNDS[name]
+            penalty += 1e4 * (max(low - value, 0) + max(value - high, 0)) ** 2
+            # Слабое притяжение к исходной машине: из равноценных решений берем ближайшее
+            penalty += 1e-2 * (value - self.NEUTRAL[name]) ** 2
+        config = self.config(x)
+        return self.loss(self.measure(config['probabilities'], config['payouts'])) + penalty
+
+    def solve(self):
+        x = [self.NEUTRAL[name] for name in self.params]
+        steps = [self.STEPS[name] for name in self.params]
+        # Перезапуск из найденной точки спасает от схлопнувшегося симплекса; loss < 1 - все цели
+        # в пределах 1-2 десятых процента, дальше уточнять незачем
+        for _ in range(3):
+            x, value = nelder_mead(self.objective, x, steps, iterations=self.args.iterations)
+            if value < 1:
+                break
+        return dict(zip(self.params, x)), self.config(x)
+
+
+def rounded_config(machine: SlotMachine, config: dict) -> dict:
+    return {
+        'symbols': machine.symbols,
+        'probabilities': [round(p, 4) for p in config['probabilities']],
+        'payouts': {symbol: {str(count): payout for count, payout in row.items()}
+                    for symbol, row in config['payouts'].items()},
+        'jackpot_increment': machine.jackpot_increment,
+    }
+
+
+def simulate(config: dict, spins: int) -> dict:
+    """Контроль Монте-Карло: настоящие барабаны SlotMachine с подобранной конфигурацией"""
+    machine = SlotMachine(config)
+    total = squares = 0.0
+    hits = 0
+    for _ in range(spins):
+        reels = [random.choices(machine.symbols, weights=machine.probabilities, k=3) for _ in range(5)]
+        win = sum(machine.payouts[symbol][count] for symbol, count in machine.line_hits(reels))
+        total += win
+        squares += win * win
+        hits += win > 0
+    mean = total / spins
+    return {'line_rtp': mean, 'hit_rate': hits / spins,
+            'volatility': math.sqrt(max(squares / spins - mean * mean, 0.0))}
+
+
+def print_metrics(title: str, metrics: dict) -> None:
+    print(f"{title}: RTP {metrics['rtp']:.4f} (линии {metrics['line_rtp']:.4f}, "
+          f"джекпот {metrics['jackpot_rtp']:.4f}), выигрыш в {metrics['hit_rate']:.2%} спинов, "
+          f"волатильность {metrics['volatility']:.2f} ставки, джекпот раз в {metrics['jackpot_every']:,.0f} спинов")
+
+
+def parse_band(text: str):
+    low, _, high = text.partition(':')
+    return float(low), float(high or low)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Подбор весов и выплат слот-машины под целевые метрики")
+    parser.add_argument("--rtp", type=float, required=True, help="Целевой полный возврат, например 0.96")
+    parser.add_argument("--hit-rate", type=float, default=None, help="Целевая доля выигрышных спинов")
+    parser.add_argument("--volatility", type=parse_band, default=None, metavar="LOW:HIGH",
+                        help="Допустимое стандартное отклонение выплаты за спин, в ставках")
+    parser.add_argument("--solve", default="both", choices=["weights", "payouts", "both"])
+    parser.add_argument("--bet", type=float, default=10, help="Средняя ставка (для пополнения джекпота)")
+    parser.add_argument("--base", default=None, help="Начальная конфигурация JSON вместо встроенной")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--tolerance", type=float, default=0.002, help="Допуск по RTP и частоте выигрыша")
+    parser.add_argument("--verify-spins", type=int, default=200000, help="Спинов для контроля, 0 - без него")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default=None, help="Куда сохранить конфигурацию (для SlotsBot.py --machine)")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    machine = SlotMachine(load_machine_config(args.base) if args.base else None)
+
+    started = time.perf_counter()
+    solver = Solver(machine, args)
+    before = solver.measure(machine.probabilities, machine.payouts)
+    print_metrics("Исходная машина", before)
+    params, solution = solver.solve()
+    config = rounded_config(machine, solution)
+    after = solver.model.metrics(config['probabilities'], solution['payouts'], args.bet, machine.jackpot_increment)
+    print(f"Параметры: {', '.join(f'{name} = {value:.3f}' for name, value in params.items())} "
+          f"({solver.evaluations} точных оценок за {time.perf_counter() - started:.1f} с)")
+    print_metrics("Подобранная машина", after)
+
+    failed = False
+    checks = [("RTP", after['rtp'], args.rtp, abs(after['rtp'] - args.rtp) <= args.tolerance)]
+    if args.hit_rate is not None:
+        checks.append(("Частота выигрыша", after['hit_rate'], args.hit_rate,
+                       abs(after['hit_rate'] - args.hit_rate) <= args.tolerance))
+    if args.volatility:
+        low, high = args.volatility
+        checks.append(("Волатильность", after['volatility'], f"{low}:{high}",
+                       low * 0.99 <= after['volatility'] <= high * 1.01))
+    for name, value, target, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}: {value:.4f}, цель {target}")
+        failed |= not ok
+
+    if args.verify_spins:
+        observed = simulate(config, args.verify_spins)
+        # 99% доверительные интервалы для среднего выигрыша и доли выигрышных спинов
+        rtp_margin = 2.576 * after['volatility'] / math.sqrt(args.verify_spins)
+        hit_margin = 2.576 * math.sqrt(after['hit_rate'] * (1 - after['hit_rate']) / args.verify_spins)
+        rtp_ok = abs(observed['line_rtp'] - after['line_rtp']) <= rtp_margin
+        hit_ok = abs(observed['hit_rate'] - after['hit_rate']) <= hit_margin
+        print(f"{'✅' if rtp_ok and hit_ok else '❌'} Симуляция {args.verify_spins} спинов: "
+              f"линии {observed['line_rtp']:.4f} ± {rtp_margin:.4f}, "
+              f"выигрыш в {observed['hit_rate']:.2%} ± {hit_margin:.2%}, "
+              f"волатильность {observed['volatility']:.2f}")
+        failed |= not (rtp_ok and hit_ok)
+
+    config['metrics'] = {key: round(value, 6) for key, value in after.items() if math.isfinite(value)}
+    text = json.dumps(config, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"Конфигурация сохранена в {args.out}: python SlotsBot.py --machine {args.out}")
+    else:
+        print(text)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()